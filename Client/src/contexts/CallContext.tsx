@@ -11,7 +11,12 @@ import { useToastContext } from "../providers/ToastProvider";
 import { socketService } from "../services/socketService";
 import { webrtcService } from "../services/webrtcService";
 import { useSocketEvents } from "../hooks/useSocketEvents";
-import type { CallType, CallRequest } from "../types";
+import type {
+  CallType,
+  CallRequest,
+  CallMissedData,
+  RequestExpiredData,
+} from "../types";
 import { sounds } from "../utils/soundManager";
 
 interface CallContextType {
@@ -498,6 +503,39 @@ export const CallProvider: React.FC<CallProviderProps> = ({ children }) => {
     [showToast]
   );
 
+  const handleCallMissed = useCallback(
+    (data: CallMissedData) => {
+      if (pendingCallRequestRef.current?.request_id !== data.request_id) {
+        return;
+      }
+
+      showToast(
+        "Missed Call",
+        `Missed call from ${data.from_username}`,
+        "info"
+      );
+      sounds.callRinging.pause();
+      sounds.callRinging.currentTime = 0;
+      setPendingCallRequest(null);
+    },
+    [showToast]
+  );
+
+  const handleRequestExpired = useCallback(
+    (data: RequestExpiredData) => {
+      if (data.type === "chat") return;
+
+      showToast(
+        "No Answer",
+        data.reason === "user_left"
+          ? "The other user went offline"
+          : "The call was not answered",
+        "warning"
+      );
+    },
+    [showToast]
+  );
+
   const handleCallEnded = useCallback(
     (data: { ended_by: string }) => {
       if (
@@ -520,6 +558,8 @@ export const CallProvider: React.FC<CallProviderProps> = ({ children }) => {
     call_accepted: handleCallAccepted,
     call_started: handleCallStarted,
     call_rejected: handleCallRejected,
+    call_missed: handleCallMissed,
+    request_expired: handleRequestExpired,
     call_ended: handleCallEnded,
     webrtc_offer: handleWebrtcOffer,
     webrtc_answer: handleWebrtcAnswer,
@@ -14,6 +14,7 @@ import React, {
 import { useToastContext } from "../providers/ToastProvider";
 import { socketService } from "../services/socketService";
 import { useSocketEvents } from "../hooks/useSocketEvents";
+import { useHeartbeat } from "../hooks/useHeartbeat";
 import {
   ChatState,
   UserInfo,
@@ -21,8 +22,11 @@ import {
   ChatRequest,
   ConnectionEstablishedData,
   OnlineUsersData,
+  PresenceDeltaData,
+  RequestExpiredData,
   ChatStartedData,
   PrivateMessageData,
+  HistoryPageData,
   PartnerLeftData,
 } from "../types";
 
@@ -39,6 +43,8 @@ interface ChatContextType extends ChatState {
   rejectChatRequest: () => void;
   sendMessage: (message: string) => void;
   addMessage: (message: Message) => void;
+  loadOlderMessages: () => void;
+  hasMoreHistory: boolean;
   leaveChat: () => void;
 
   // Connection
@@ -78,11 +84,17 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     useState<ChatRequest | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
   const [connected, setConnected] = useState(false);
+  const [hasMoreHistory, setHasMoreHistory] = useState(false);
 
   // Refs for cleanup
   const pendingRequestRef = useRef<ChatRequest | null>(null);
   const currentRoomRef = useRef<string | null>(null);
   const partnerSidRef = useRef<string | null>(null);
+  const mySidRef = useRef("");
+  // Presence version of the online users list, null until the first snapshot
+  const presenceVersionRef = useRef<number | null>(null);
+  // Sequence number to page the room's history back from
+  const historyCursorRef = useRef<number | null>(null);
 
   // Update refs when state changes
   useEffect(() => {
@@ -111,6 +123,8 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     setPartnerSid(null);
     setPartnerInfo(null);
     setMessages([]);
+    setHasMoreHistory(false);
+    historyCursorRef.current = null;
     setPendingChatRequest(null);
 
     // Update user status to online
@@ -133,8 +147,30 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     showToast("Disconnected", "Connection to server lost", "error");
   }, [showToast]);
 
+  // Show a chat room and load its history
+  const enterChat = useCallback((data: ChatStartedData) => {
+    // Set right away: the history page may arrive before the next render
+    currentRoomRef.current = data.room_id;
+    setCurrentRoom(data.room_id);
+    setPartnerSid(data.partner_sid);
+    setPartnerInfo({
+      sid: data.partner_sid,
+      username: data.partner_username,
+      ip: data.partner_ip,
+      status: "online",
+    });
+
+    setMessages([]);
+    socketService.emit("get_history", { room_id: data.room_id });
+
+    // Update user status to busy
+    setMyInfo((prev) => ({ ...prev, status: "busy" }));
+  }, []);
+
   const handleConnectionEstablished = useCallback(
     (data: ConnectionEstablishedData) => {
+      mySidRef.current = data.sid;
+      presenceVersionRef.current = null;
       setMyInfo({
         sid: data.sid,
         ip: data.ip,
@@ -142,6 +178,11 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
         status: "online",
       });
 
+      // A reloaded page resumed its session: show its chat again
+      if (data.chat && data.chat.room_id !== currentRoomRef.current) {
+        enterChat(data.chat);
+      }
+
       // Request online users list
       setTimeout(() => {
         if (socketService.isConnectedState()) {
@@ -158,17 +199,47 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
         }
       }, 100);
     },
-    []
+    [enterChat]
   );
 
-  const handleOnlineUsersList = useCallback(
-    (data: OnlineUsersData) => {
-      // Filter out current user from the list
-      const otherUsers = data.users.filter((user) => user.sid !== myInfo.sid);
-      setOnlineUsers(otherUsers);
-    },
-    [myInfo.sid]
-  );
+  const handleOnlineUsersList = useCallback((data: OnlineUsersData) => {
+    presenceVersionRef.current = data.version;
+    // Filter out current user from the list
+    const otherUsers = data.users.filter(
+      (user) => user.sid !== mySidRef.current
+    );
+    setOnlineUsers(otherUsers);
+  }, []);
+
+  const handlePresenceDelta = useCallback((data: PresenceDeltaData) => {
+    const known = presenceVersionRef.current;
+    // Wait for the snapshot, or already included in it
+    if (known === null || data.version <= known) return;
+
+    if (data.since > known) {
+      // Missed some changes, start over from a fresh snapshot
+      presenceVersionRef.current = null;
+      socketService.emit("get_online_users").catch(() => {});
+      return;
+    }
+
+    const changes = data.changes.filter((change) => change.version > known);
+    presenceVersionRef.current = data.version;
+    setOnlineUsers((users) => {
+      let next = users;
+      changes.forEach((change) => {
+        if (change.type === "user_left") {
+          next = next.filter((user) => user.sid !== change.sid);
+        } else if (change.user.sid !== mySidRef.current) {
+          const updated = change.user;
+          next = next.some((user) => user.sid === updated.sid)
+            ? next.map((user) => (user.sid === updated.sid ? updated : user))
+            : [...next, updated];
+        }
+      });
+      return next;
+    });
+  }, []);
 
   const handleIncomingChatRequest = useCallback(
     (data: ChatRequest) => {
@@ -189,20 +260,8 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
 
   const handleChatRequestAccepted = useCallback(
     (data: ChatStartedData) => {
-      setCurrentRoom(data.room_id);
-      setPartnerSid(data.partner_sid);
-      setPartnerInfo({
-        sid: data.partner_sid,
-        username: data.partner_username,
-        ip: data.partner_ip,
-        status: "online",
-      });
-
+      enterChat(data);
       setPendingChatRequest(null);
-      setMessages([]);
-
-      // Update user status to busy
-      setMyInfo((prev) => ({ ...prev, status: "busy" }));
 
       showToast(
         "Connected",
@@ -210,24 +269,12 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
         "success"
       );
     },
-    [showToast]
+    [showToast, enterChat]
   );
 
   const handleChatStarted = useCallback(
     (data: ChatStartedData) => {
-      setCurrentRoom(data.room_id);
-      setPartnerSid(data.partner_sid);
-      setPartnerInfo({
-        sid: data.partner_sid,
-        username: data.partner_username,
-        ip: data.partner_ip,
-        status: "online",
-      });
-
-      setMessages([]);
-
-      // Update user status to busy
-      setMyInfo((prev) => ({ ...prev, status: "busy" }));
+      enterChat(data);
 
       showToast(
         "Chat Started",
@@ -235,7 +282,7 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
         "success"
       );
     },
-    [showToast]
+    [showToast, enterChat]
   );
 
   const handleChatRequestRejected = useCallback(
@@ -250,21 +297,42 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     [showToast]
   );
 
+  const handleRequestExpired = useCallback(
+    (data: RequestExpiredData) => {
+      if (data.type !== "chat") return;
+
+      if (pendingRequestRef.current?.request_id === data.request_id) {
+        setPendingChatRequest(null);
+      }
+      showToast(
+        "Request Expired",
+        data.reason === "user_left"
+          ? "The other user went offline"
+          : "The chat request was not answered in time",
+        "warning"
+      );
+    },
+    [showToast]
+  );
+
   const handleReceivePrivateMessage = useCallback(
     (data: PrivateMessageData) => {
       if (data.from_sid === myInfo.sid) {
         return;
       }
       const message: Message = {
-        id: `msg-${Date.now()}-${Math.random()}`,
+        id: data.message_id || `msg-${Date.now()}-${Math.random()}`,
         from_sid: data.from_sid,
         from_username: data.from_username,
         message: data.message,
         timestamp: data.timestamp,
         type: "received",
+        seq: data.seq,
       };
 
-      setMessages((prev) => [...prev, message]);
+      setMessages((prev) =>
+        prev.some((m) => m.id === message.id) ? prev : [...prev, message]
+      );
 
       // Only show toast if chat window is not focused
       if (!document.hasFocus()) {
@@ -283,17 +351,46 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     [showToast, handleLeaveChat]
   );
 
+  // Activity heartbeats (away status, dead peer detection in calls)
+  useHeartbeat();
+
+  const handleHistoryPage = useCallback((data: HistoryPageData) => {
+    if (data.room_id !== currentRoomRef.current) return;
+
+    historyCursorRef.current = data.nextBeforeSeq;
+    setHasMoreHistory(data.nextBeforeSeq !== null);
+
+    const older: Message[] = data.messages.map((m) => ({
+      id: m.message_id || `seq-${m.seq}`,
+      from_sid: m.from_sid,
+      from_username: m.from_username,
+      message: m.message,
+      timestamp: m.timestamp,
+      type: m.from_sid === mySidRef.current ? "sent" : "received",
+      seq: m.seq,
+    }));
+
+    // Messages shown already (live, or sent from here) are kept as they are
+    setMessages((prev) => {
+      const known = new Set(prev.map((m) => m.id));
+      return [...older.filter((m) => !known.has(m.id)), ...prev];
+    });
+  }, []);
+
   // Register socket events
   useSocketEvents({
     connect: handleConnect,
     disconnect: handleDisconnect,
     connection_established: handleConnectionEstablished,
     online_users_list: handleOnlineUsersList,
+    presence_delta: handlePresenceDelta,
     incoming_chat_request: handleIncomingChatRequest,
     chat_request_accepted: handleChatRequestAccepted,
     chat_started: handleChatStarted,
     chat_request_rejected: handleChatRequestRejected,
+    request_expired: handleRequestExpired,
     receive_private_message: handleReceivePrivateMessage,
+    history_page: handleHistoryPage,
     partner_left_chat: handlePartnerLeftChat,
   });
 
@@ -464,6 +561,14 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     setMessages((prev) => [...prev, message]);
   }, []);
 
+  const loadOlderMessages = useCallback(() => {
+    const room = currentRoomRef.current;
+    const beforeSeq = historyCursorRef.current;
+    if (!room || beforeSeq === null) return;
+
+    socketService.emit("get_history", { room_id: room, before_seq: beforeSeq });
+  }, []);
+
   const leaveChat = useCallback(() => {
     const room = currentRoomRef.current;
 
@@ -523,6 +628,8 @@ export const ChatProvider: React.FC<ChatProviderProps> = ({ children }) => {
     rejectChatRequest,
     sendMessage,
     addMessage,
+    loadOlderMessages,
+    hasMoreHistory,
     leaveChat,
     disconnect,
   };
@@ -15,6 +15,7 @@ interface UploadProgress {
 }
 
 const CHUNK_SIZE = 1024 * 1024; // 1 MB per chunk
+const MERGE_TIMEOUT = 5 * 60 * 1000; // Wait for a background merge, in ms
 
 export const useFileUpload = () => {
   const [uploads, setUploads] = useState<Map<string, UploadProgress>>(
@@ -86,6 +87,38 @@ export const useFileUpload = () => {
     };
   }, [socketService, addMessage, partnerInfo, myInfo]);
 
+  // Outcome of a merge queued in the background (complete answered 202),
+  // subscribed before completing so a fast merge is not missed
+  const waitForMerge = (fileId: string) => {
+    let timer: ReturnType<typeof setTimeout> | undefined;
+    const unsubscribers: Array<() => void> = [];
+    const cancel = () => {
+      clearTimeout(timer);
+      unsubscribers.forEach((unsubscribe) => unsubscribe());
+    };
+
+    const done = new Promise<void>((resolve, reject) => {
+      unsubscribers.push(
+        socketService.on("file_upload_completed", (data) => {
+          if (data.fileId !== fileId) return;
+          cancel();
+          resolve();
+        }),
+        socketService.on("file_upload_failed", (data) => {
+          if (data.fileId !== fileId) return;
+          cancel();
+          reject(new Error(data.error || "Upload failed"));
+        })
+      );
+      timer = setTimeout(() => {
+        cancel();
+        reject(new Error("Timed out waiting for the file to be processed"));
+      }, MERGE_TIMEOUT);
+    });
+
+    return { done, cancel };
+  };
+
   const isDuplicateUpload = useCallback(
     (uploadId: string): boolean => {
       const uploadsArray = Array.from(uploads.values());
@@ -154,6 +187,7 @@ export const useFileUpload = () => {
             totalChunks,
             roomId,
             partnerSid,
+            senderSid: socketService.getSessionId(),
             uniqueId: file.uniqueId,
           },
           { signal: abortController.signal }
@@ -220,17 +254,26 @@ export const useFileUpload = () => {
         }
 
         // Complete upload
-        await apiClient.post(
-          "/api/files/complete",
-          {
-            uploadId: finalUploadId,
-            fileId,
-            roomId,
-            partnerSid,
-            uniqueId: file.uniqueId,
-          },
-          { signal: abortController.signal }
-        );
+        const merge = waitForMerge(fileId);
+        try {
+          const response = await apiClient.post(
+            "/api/files/complete",
+            {
+              uploadId: finalUploadId,
+              fileId,
+              roomId,
+              partnerSid,
+              senderSid: socketService.getSessionId(),
+              uniqueId: file.uniqueId,
+            },
+            { signal: abortController.signal }
+          );
+          if (response.status === 202) {
+            await merge.done;
+          }
+        } finally {
+          merge.cancel();
+        }
 
         setUploads((prev) => {
           const newMap = new Map(prev);
@@ -0,0 +1,79 @@
+import { useEffect } from "react";
+import { socketService } from "../services/socketService";
+import type { HeartbeatAck } from "../types";
+
+// Until the server answers with its own interval
+const DEFAULT_INTERVAL = 15;
+
+const ACTIVITY_EVENTS = ["pointerdown", "keydown", "wheel", "touchstart"];
+
+/**
+ * Sends application heartbeats telling the server whether the user
+ * interacted since the last one. The server answers with the number of
+ * seconds until the next heartbeat: short during calls, long when idle
+ */
+export const useHeartbeat = () => {
+  useEffect(() => {
+    let active = true;
+    let interval = DEFAULT_INTERVAL;
+    let timer: ReturnType<typeof setTimeout> | undefined;
+
+    const schedule = (seconds: number) => {
+      interval = seconds;
+      clearTimeout(timer);
+      timer = setTimeout(beat, seconds * 1000);
+    };
+
+    const beat = () => {
+      if (!socketService.isConnectedState()) {
+        schedule(DEFAULT_INTERVAL);
+        return;
+      }
+
+      const wasActive = active && document.visibilityState === "visible";
+      active = false;
+      socketService
+        .emit("heartbeat", { active: wasActive }, (response: HeartbeatAck) =>
+          schedule(response?.interval || DEFAULT_INTERVAL)
+        )
+        .catch(() => schedule(DEFAULT_INTERVAL));
+    };
+
+    const markActive = () => {
+      if (active) return;
+      active = true;
+      // An away user should not wait for the slow idle cadence
+      if (interval > DEFAULT_INTERVAL) beat();
+    };
+
+    // Coming back to the tab is activity worth reporting right away
+    const handleVisibilityChange = () => {
+      if (document.visibilityState === "visible") {
+        active = true;
+        beat();
+      }
+    };
+
+    // Switch to the short in-call interval as soon as a call starts: the
+    // server ends calls whose heartbeats stop at that cadence
+    const unsubscribers = [
+      socketService.on("call_started", beat),
+      socketService.on("call_accepted", beat),
+    ];
+
+    ACTIVITY_EVENTS.forEach((event) =>
+      window.addEventListener(event, markActive, { passive: true })
+    );
+    document.addEventListener("visibilitychange", handleVisibilityChange);
+    schedule(DEFAULT_INTERVAL);
+
+    return () => {
+      clearTimeout(timer);
+      unsubscribers.forEach((unsubscribe) => unsubscribe());
+      ACTIVITY_EVENTS.forEach((event) =>
+        window.removeEventListener(event, markActive)
+      );
+      document.removeEventListener("visibilitychange", handleVisibilityChange);
+    };
+  }, []);
+};
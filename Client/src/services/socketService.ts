@@ -2,6 +2,9 @@ import { io, Socket } from "socket.io-client";
 import type { SocketEventPayloads } from "../types";
 import { serverConfig } from "../serverConfig";
 
+// Kept per tab across page reloads, so a reload resumes the session
+const RESUME_TOKEN_KEY = "resumeToken";
+
 type EventHandler<K extends keyof SocketEventPayloads> = (
   data: SocketEventPayloads[K]
 ) => void;
@@ -12,6 +15,10 @@ class SocketService {
   private eventHandlers: Map<string, EventHandler<any>[]> = new Map();
   private isConnected = false;
   private connectionPromise: Promise<Socket> | null = null;
+  // Lets the server resume our session after a dropped connection
+  private resumeToken: string | null = sessionStorage.getItem(RESUME_TOKEN_KEY);
+  // Session sid assigned by the server; stays the same across reconnects
+  private sessionId: string | null = null;
 
   constructor() {
     const url = serverConfig.apiUrl;
@@ -37,6 +44,14 @@ class SocketService {
         autoConnect: true,
         timeout: 10000,
         rejectUnauthorized: false,
+        auth: (cb) =>
+          cb(this.resumeToken ? { resume_token: this.resumeToken } : {}),
+      });
+
+      this.socket.on("connection_established", (data) => {
+        this.resumeToken = data.resume_token;
+        this.sessionId = data.sid;
+        sessionStorage.setItem(RESUME_TOKEN_KEY, data.resume_token);
       });
 
       this.socket.on("connect", () => {
@@ -61,6 +76,9 @@ class SocketService {
 
   disconnect(): void {
     this.eventHandlers.clear();
+    this.resumeToken = null;
+    this.sessionId = null;
+    sessionStorage.removeItem(RESUME_TOKEN_KEY);
     if (this.socket) {
       this.socket.disconnect();
       this.socket = null;
@@ -206,6 +224,10 @@ class SocketService {
     return this.socket?.id || null;
   }
 
+  getSessionId(): string | null {
+    return this.sessionId || this.getSocketId();
+  }
+
   removeAllListeners(event?: string): void {
     if (event) {
       this.eventHandlers.delete(event);
@@ -2,7 +2,13 @@
  * Type definitions for the chat application
  */
 
-export type UserStatus = "online" | "offline" | "busy" | "in_call";
+export type UserStatus =
+  | "online"
+  | "offline"
+  | "busy"
+  | "in_call"
+  | "reconnecting"
+  | "away";
 export type CallType = "video" | "audio";
 export type RequestType = "chat" | "call";
 export type MessageType = "sent" | "received";
@@ -65,6 +71,7 @@ export interface BaseMessage {
 
 export interface Message extends BaseMessage {
   type: MessageType;
+  seq?: number;
   fileData?: FileData;
 }
 
@@ -83,15 +90,92 @@ export interface CallRequest extends BaseRequest {
 
 export interface ConnectionEstablishedData extends BaseUserInfo {
   ip: string;
+  resume_token: string;
+  resumed: boolean;
+  // Chat of a resumed session, null when it is in none
+  chat?: ChatStartedData | null;
 }
 
 export interface OnlineUsersData {
   users: UserInfo[];
+  version: number;
+}
+
+export type PresenceChange =
+  | {
+      type: "user_joined" | "user_updated";
+      version: number;
+      sid: string;
+      user: UserInfo;
+    }
+  | { type: "user_left"; version: number; sid: string };
+
+export interface RequestExpiredData {
+  request_id: string;
+  type: RequestType | CallType;
+  reason: "expired" | "user_left";
+}
+
+export interface CallMissedData extends RequestExpiredData {
+  from_sid: string;
+  from_username: string;
+}
+
+export interface OnlineUsersQuery {
+  prefix?: string;
+  subnet?: string;
+  status?: string;
+  cursor?: string | null;
+  limit?: number;
+}
+
+export interface HeartbeatData {
+  active: boolean;
+}
+
+export interface HeartbeatAck {
+  interval: number;
+}
+
+export interface OnlineUsersPageData {
+  users: UserInfo[];
+  nextCursor: string | null;
+  version: number;
+}
+
+export interface PresenceDeltaData {
+  since: number;
+  version: number;
+  changes: PresenceChange[];
 }
 
 export interface ChatStartedData extends BaseChatStartedData {}
 
-export interface PrivateMessageData extends BaseMessage {}
+export interface PrivateMessageData extends BaseMessage {
+  message_id?: string | null;
+  seq?: number;
+}
+
+export interface HistoryMessage {
+  seq: number;
+  message_id: string | null;
+  from_sid: string;
+  from_username: string;
+  message: string;
+  timestamp: string;
+}
+
+export interface HistoryQuery {
+  room_id: string;
+  before_seq?: number | null;
+  limit?: number;
+}
+
+export interface HistoryPageData {
+  room_id: string;
+  messages: HistoryMessage[];
+  nextBeforeSeq: number | null;
+}
 
 export interface PartnerLeftData {
   username: string;
@@ -142,9 +226,17 @@ interface BaseSocketPayloads {
   disconnect: void;
   connection_established: ConnectionEstablishedData;
   online_users_list: OnlineUsersData;
+  presence_delta: PresenceDeltaData;
+  online_users_page: OnlineUsersPageData;
+  presence_subscribed: OnlineUsersData;
+  query_failed: { error: string };
+  request_expired: RequestExpiredData;
 
   // User events
   get_online_users: void;
+  query_online_users: OnlineUsersQuery;
+  subscribe_presence: { sids: string[] };
+  heartbeat: HeartbeatData;
   set_username: { username: string };
 
   // Common events with request_id
@@ -167,6 +259,8 @@ interface ChatSpecificPayloads {
     messageId?: string;
   };
   partner_left_chat: PartnerLeftData;
+  get_history: HistoryQuery;
+  history_page: HistoryPageData;
   leave_chat: { room_id: string };
   reject_chat_request: { request_id: string };
   accept_chat_request: { request_id: string };
@@ -175,6 +269,13 @@ interface ChatSpecificPayloads {
 interface FileSpecificPayloads {
   // File events
   file_received: FileReceivedData;
+  file_upload_completed: {
+    fileId: string;
+    fileName: string;
+    fileSize: number;
+    downloadUrl: string;
+  };
+  file_upload_failed: { fileId: string; error: string };
 }
 
 interface CallSpecificPayloads {
@@ -199,6 +300,7 @@ interface CallSpecificPayloads {
   reject_call: { request_id: string };
   call_ended: { ended_by: string };
   end_call: { room_id: string };
+  call_missed: CallMissedData;
 }
 
 interface WebRTCSpecificPayloads {
@@ -232,11 +334,15 @@ export type SocketEventPayloads = BaseSocketPayloads &
 export type SocketEmitPayloads = Pick<
   SocketEventPayloads,
   | "get_online_users"
+  | "query_online_users"
+  | "subscribe_presence"
+  | "heartbeat"
   | "set_username"
   | "send_chat_request"
   | "accept_chat_request"
   | "reject_chat_request"
   | "send_private_message"
+  | "get_history"
   | "leave_chat"
   | "start_call"
   | "accept_call"
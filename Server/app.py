@@ -25,8 +25,19 @@ from config.settings import Config
 from handlers.http_handlers import register_http_handlers
 from handlers.file_handler import register_file_handlers
 from handlers.socket_handlers import register_socket_handlers
+from handlers.socket_upload_handlers import register_socket_upload_handlers
+from handlers.p2p_transfer_handlers import register_p2p_transfer_handlers
+from handlers.live_relay_handlers import register_live_relay_handlers
+from handlers.room_files_handlers import register_room_files_handlers
+from handlers.archive_handlers import register_archive_handlers
+from handlers.job_handlers import register_job_handlers
+from handlers.presence_handlers import register_presence_handlers
 from services.network_service import get_local_ip
-
+from services.session_recovery_service import start_session_recovery
+from services.job_service import init_job_engine
+from services.heartbeat_service import start_heartbeat_monitor
+from services.request_service import start_request_expiry
+from services.user_service import init_presence_broadcaster
 
 banner = """
 ╔═══════════════════════════════════════════════════════════════════════════════╗
@@ -70,22 +81,40 @@ def create_app():
     socketio = SocketIO(
         app,
         cors_allowed_origins="*",
-        max_http_buffer_size=100 * 1024 * 1024,  # 100 MB buffer  chunks
-        ping_timeout=120,
-        ping_interval=25,
+        max_http_buffer_size=Config.SOCKETIO_MAX_HTTP_BUFFER_SIZE,  # buffer for chunks
+        ping_timeout=Config.SOCKETIO_PING_TIMEOUT,
+        ping_interval=Config.SOCKETIO_PING_INTERVAL,
         async_mode="eventlet",  # async_mode="threading",
         logger=False,  # Enable logging for debugging
         engineio_logger=False,  # Enable engine.io logging
     )
 
+    # Background jobs for post-upload work
+    init_job_engine(app, socketio)
+    # Coalesced presence broadcasts
+    init_presence_broadcaster(app, socketio)
+
     # Register handlers
     register_http_handlers(app)
     register_socket_handlers(app, socketio)
     register_file_handlers(app, socketio)
+    register_socket_upload_handlers(app, socketio)
+    register_p2p_transfer_handlers(app, socketio)
+    register_live_relay_handlers(app, socketio)
+    register_room_files_handlers(app)
+    register_archive_handlers(app)
+    register_job_handlers(app)
+    register_presence_handlers(app)
     # Setup CORS middleware
     setup_cors_headers(app)
     # Register global error handlers
     register_error_handlers(app)
+    # Rehydrate upload sessions interrupted by a restart
+    start_session_recovery(app, socketio)
+    # Expire unanswered chat and call requests
+    start_request_expiry(app, socketio)
+    # Mark idle users away, end the calls of silent peers
+    start_heartbeat_monitor(app, socketio)
     return app, socketio
 
 
@@ -126,6 +155,7 @@ if __name__ == "__main__":
     print(f" • Video calls via WebRTC")
     print(f" • Audio calls via WebRTC")
     print(f" • Real-time notifications")
+    print(f" • Peer-to-peer file transfer with server fallback")
 
     try:
 
@@ -0,0 +1,72 @@
+"""
+Ingest throughput and dedup ratio of the chunk-level dedup engine
+
+Ingests a random base file, then an edited copy (a few small insertions),
+and reports MB/s for each plus the resulting dedup ratio
+
+Usage (from the Server directory):
+    python -m benchmarks.dedup_benchmark [--size-mb 64] [--edits 8]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config.settings import Config
+from utils.files.dedup_store import get_dedup_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--edits", type=int, default=8)
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix="dedup-bench-")
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config["DEDUP_FOLDER"] = os.path.join(base_dir, "dedup")
+    app.config["DURABILITY_MODE"] = "none"
+
+    rng = random.Random(42)
+    base = bytearray(rng.randbytes(args.size_mb * 1024 * 1024))
+    edited = bytearray(base)
+    for _ in range(args.edits):
+        pos = rng.randrange(len(edited))
+        edited[pos:pos] = rng.randbytes(100)
+
+    try:
+        with app.app_context():
+            store = get_dedup_store()
+            for name, data in (("base.bin", base), ("edited.bin", edited)):
+                path = os.path.join(base_dir, name)
+                with open(path, "wb") as f:
+                    f.write(data)
+
+                start = time.perf_counter()
+                result = store.ingest(name, path)
+                elapsed = time.perf_counter() - start
+
+                print(
+                    f"{name:<11} {len(data) / elapsed / (1024 * 1024):7.1f} MB/s   "
+                    f"{result['newChunks']}/{result['chunks']} new chunks"
+                )
+
+            stats = store.stats()
+            print(
+                f"dedup ratio {stats['dedupRatio']}  "
+                f"({stats['logicalBytes']:,} logical / {stats['storedBytes']:,} stored bytes)"
+            )
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
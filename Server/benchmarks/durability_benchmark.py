@@ -0,0 +1,82 @@
+"""
+Throughput cost of each upload durability mode
+
+Uploads the same synthetic file through the chunk service once per
+DURABILITY_MODE and reports MB/s relative to "none"
+
+Usage (from the Server directory):
+    python -m benchmarks.durability_benchmark [--size-mb 256] [--chunk-mb 1]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from config.settings import Config
+from services.chunk_upload_service import (
+    upload_chunk_bytes_service,
+    complete_upload_service,
+)
+from utils.files.durability import DURABILITY_MODES, get_batcher
+from utils.files.metadata_manager import create_metadata
+
+
+def run_mode(mode: str, size_mb: int, chunk_mb: int, base_dir: str) -> float:
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config["DURABILITY_MODE"] = mode
+    app.config["UPLOAD_FOLDER"] = os.path.join(base_dir, mode, "temp")
+    app.config["COMPLETED_FOLDER"] = os.path.join(base_dir, mode, "completed")
+    os.makedirs(app.config["UPLOAD_FOLDER"])
+    os.makedirs(app.config["COMPLETED_FOLDER"])
+
+    chunk = os.urandom(chunk_mb * 1024 * 1024)
+    total_chunks = size_mb // chunk_mb
+    file_id = f"bench-{mode}"
+
+    with app.app_context():
+        create_metadata(
+            file_id, "bench.bin", total_chunks * len(chunk), total_chunks, {}
+        )
+
+        start = time.perf_counter()
+        for i in range(total_chunks):
+            upload_chunk_bytes_service(file_id, i, total_chunks, chunk)
+        complete_upload_service(file_id)
+        if mode == "batched":
+            get_batcher().flush()
+        elapsed = time.perf_counter() - start
+
+    return size_mb / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=int, default=256)
+    parser.add_argument("--chunk-mb", type=int, default=1)
+    parser.add_argument("--dir", default=None, help="Directory on the disk to test")
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix="durability-bench-", dir=args.dir)
+    try:
+        results = {
+            mode: run_mode(mode, args.size_mb, args.chunk_mb, base_dir)
+            for mode in DURABILITY_MODES
+        }
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+    print(f"{args.size_mb} MB in {args.chunk_mb} MB chunks")
+    for mode, mb_per_s in results.items():
+        cost = (1 - mb_per_s / results["none"]) * 100
+        print(f"  {mode:<8} {mb_per_s:8.1f} MB/s   ({cost:5.1f}% slower than none)")
+
+
+if __name__ == "__main__":
+    main()
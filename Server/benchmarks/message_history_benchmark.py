@@ -0,0 +1,77 @@
+"""
+Sustained throughput of the private message history store
+
+Appends messages spread over a number of rooms as fast as possible, waits
+for the batched writer to store them all and reports messages/s for the
+send path (queueing) and end to end (stored in SQLite), plus the time to
+read a history page
+
+Usage (from the Server directory):
+    python -m benchmarks.message_history_benchmark [--messages 200000] [--rooms 100]
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import Config
+from services.message_history_service import MessageStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument(
+        "--batch-size", type=int, default=Config.MESSAGE_HISTORY_BATCH_SIZE
+    )
+    args = parser.parse_args()
+
+    base_dir = tempfile.mkdtemp(prefix="history-bench-")
+    store = MessageStore(
+        os.path.join(base_dir, "messages.db"),
+        args.batch_size,
+        Config.MESSAGE_HISTORY_BATCH_INTERVAL_MS / 1000,
+    )
+    payload = {
+        "from_sid": "bench-sid",
+        "from_username": "bench",
+        "message": "x" * 80,
+        "timestamp": "12:00",
+        "message_id": None,
+    }
+
+    try:
+        start = time.perf_counter()
+        for i in range(args.messages):
+            store.append(f"room_{i % args.rooms}", payload)
+        queued = time.perf_counter() - start
+
+        while store.pending():
+            time.sleep(0.01)
+        stored = time.perf_counter() - start
+
+        start = time.perf_counter()
+        page = store.history("room_0", limit=50)
+        while page["nextBeforeSeq"] is not None:
+            page = store.history("room_0", page["nextBeforeSeq"], limit=50)
+        pages = -(-args.messages // args.rooms // 50)
+        page_ms = (time.perf_counter() - start) * 1000 / pages
+
+        print(f"send path  {args.messages / queued:10.0f} msg/s")
+        print(
+            f"stored     {args.messages / stored:10.0f} msg/s   "
+            f"{store.batches} batches of {store.written / store.batches:.0f}"
+        )
+        print(f"history    {page_ms:10.3f} ms per 50-message page")
+    finally:
+        shutil.rmtree(base_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
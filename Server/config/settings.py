@@ -16,10 +16,146 @@ class Config:
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024 * 1024  # 10 GB
     UPLOAD_FOLDER = "uploads/temp"
     COMPLETED_FOLDER = "uploads/completed"
+    # Completed files up to SMALL_FILE_THRESHOLD bytes are kept in one
+    # SQLite blob store instead of COMPLETED_FOLDER (0 disables)
+    BLOB_STORE_PATH = "uploads/blobs.db"
+    SMALL_FILE_THRESHOLD = 256 * 1024
+    # Fingerprints of completed files, for instant re-sends
+    CONTENT_INDEX_PATH = "uploads/content_index.jsonl"
+    # Proof of possession asked for before a full hash completes an upload
+    INSTANT_CHALLENGE_SIZE = 64 * 1024  # Bytes of the file to hash
+    INSTANT_CHALLENGE_TTL = 60  # Seconds to answer
+    # Entry lists of uploaded archives (ZIP, TAR, 7z with py7zr installed)
+    ARCHIVE_INDEX_FOLDER = "uploads/archive_index"
+    ARCHIVE_MAX_ENTRIES = 100000  # Longer listings are truncated
+    # Cached previews of code and document files
+    PREVIEW_FOLDER = "uploads/previews"
+    PREVIEW_BYTES = 64 * 1024  # Head and tail size
+    PREVIEW_MAX_LINES = 5000  # Longest line range per request
+    PREVIEW_MAX_RANGE_BYTES = 4 * 1024 * 1024
+    # Background jobs for post-upload work (lower priority runs first).
+    # "process" jobs run in a fresh Python process, for CPU-bound work
+    # that only shares files and SQLite with the server
+    JOB_MAX_WORKERS = 4
+    JOB_HISTORY = 500  # Finished jobs kept for GET /api/jobs
+    JOB_RETRY_DELAY = 2  # Seconds, multiplied by the attempt
+    JOB_TYPES = {
+        "merge": {
+            "concurrency": 2,
+            "priority": 0,
+            "retries": 0,
+            "executor": "thread",
+        },
+        "relay_publish": {
+            "concurrency": 2,
+            "priority": 0,
+            "retries": 0,
+            "executor": "thread",
+        },
+        "archive_index": {
+            "concurrency": 2,
+            "priority": 3,
+            "retries": 1,
+            "executor": "thread",
+        },
+        "dedup_ingest": {
+            "concurrency": 1,
+            "priority": 5,
+            "retries": 2,
+            "executor": "process",
+        },
+        "preview": {
+            "concurrency": 1,
+            "priority": 8,
+            "retries": 0,
+            "executor": "thread",
+        },
+    }
+    # Merge uploads in the background and answer /api/files/complete with 202;
+    # the uploader then learns the outcome from file_upload_completed or
+    # file_upload_failed. When off, the request waits for the merge (still
+    # run on a tpool thread)
+    ASYNC_COMPLETE = True
+    # Presence changes are gathered for PRESENCE_FLUSH_WINDOW seconds and
+    # sent as one presence_delta, at most PRESENCE_MAX_FLUSH_RATE per second
+    PRESENCE_FLUSH_WINDOW = 0.15
+    PRESENCE_MAX_FLUSH_RATE = 4
+    PRESENCE_MAX_WATCHED = 200  # Users one presence subscription may watch
+    # Page sizes of online user queries
+    USER_QUERY_DEFAULT_LIMIT = 50
+    USER_QUERY_MAX_LIMIT = 200
+    # Unanswered chat requests expire, ringing calls become missed calls
+    CHAT_REQUEST_TTL = 60  # Seconds
+    CALL_RING_TIMEOUT = 30  # Seconds
+    REQUEST_EXPIRY_TICK = 1  # Seconds between expiry sweeps
+    # Seconds a disconnected user stays "reconnecting" and can resume its
+    # session (0 removes it right away)
+    RECONNECT_GRACE = 30
+    RECONNECT_QUEUE_LIMIT = 200  # Events kept for a reconnecting user
+    # Application heartbeats: seconds between them for users in a call,
+    # active users and idle ones (clients follow the interval returned)
+    HEARTBEAT_CALL_INTERVAL = 2
+    HEARTBEAT_INTERVAL = 15
+    HEARTBEAT_IDLE_INTERVAL = 60
+    HEARTBEAT_SWEEP_TICK = 1  # Seconds between idle/dead peer sweeps
+    CALL_DEAD_AFTER = 6  # Seconds without heartbeat that end a user's call
+    AWAY_AFTER = 300  # Seconds without activity before a user is "away"
+    # Per-room shared files gallery
+    ROOM_FILES_DB = "uploads/room_files.db"
+    ROOM_FILES_CACHE_ROOMS = 256  # Rooms whose listing pages are kept cached
+    ROOM_FILES_CACHE_PAGES = 8  # First pages (limit/category/sort) cached per room
+    # Private message history, written in batches by a background writer
+    MESSAGE_HISTORY_DB = "uploads/messages.db"
+    MESSAGE_HISTORY_BATCH_SIZE = 500  # Queued messages that force a write...
+    MESSAGE_HISTORY_BATCH_INTERVAL_MS = 50  # ...else written every 50 ms
+    MESSAGE_HISTORY_PAGE_LIMIT = 50
+    MESSAGE_HISTORY_MAX_LIMIT = 200
+    # Cached delta block signatures and their default block size
+    SIGNATURE_FOLDER = "uploads/signatures"
+    DELTA_BLOCK_SIZE = 64 * 1024
 
     # SocketIO configuration
     SOCKETIO_ASYNC_MODE = "threading"
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
+    SOCKETIO_MAX_HTTP_BUFFER_SIZE = 100 * 1024 * 1024  # 100 MB
+    # Engine.IO keepalive for every connection; clients in a call are also
+    # watched through their heartbeats
+    SOCKETIO_PING_INTERVAL = 25
+    SOCKETIO_PING_TIMEOUT = 20
+
+    # Upload durability: "none", "batched" (group fsync) or "strict" (fsync before ack)
+    DURABILITY_MODE = os.environ.get("DURABILITY_MODE", "batched")
+    DURABILITY_BATCH_BYTES = 32 * 1024 * 1024  # Group fsync every 32 MB...
+    DURABILITY_BATCH_INTERVAL_MS = 500  # ...or every 500 ms
+
+    # Chunk-level dedup engine, enabled per category of ALLOWED_EXTENSIONS,
+    # e.g. {"archives", "virtual"}; files in other categories stay plain
+    DEDUP_CATEGORIES = set()
+    DEDUP_FOLDER = "uploads/dedup"
+    DEDUP_PACK_SIZE = 256 * 1024 * 1024  # Start a new pack file after 256 MB
+    DEDUP_MIN_CHUNK = 16 * 1024
+    DEDUP_AVG_CHUNK = 64 * 1024
+    DEDUP_MAX_CHUNK = 256 * 1024
+
+    # Reconcile upload sessions left by a previous run in the background
+    # (sessions are always reconciled lazily on first access)
+    UPLOAD_RECOVERY_SWEEP = True
+
+    # Shared read cache for hot completed files
+    FILE_CACHE_SIZE = 256 * 1024 * 1024  # 256 MB total
+    FILE_CACHE_MAX_FILE_SIZE = 16 * 1024 * 1024  # Larger files get readahead hints
+
+    # Socket.IO upload configuration
+    SOCKET_UPLOAD_WINDOW = 8  # Max in-flight (un-acked) chunks per upload
+
+    # Peer-to-peer (WebRTC DataChannel) file transfer configuration
+    P2P_CONNECT_TIMEOUT = 15  # Seconds before falling back to chunked HTTP
+    # Seconds a connected transfer may take before falling back as stalled
+    P2P_TRANSFER_TIMEOUT = 30 * 60
+
+    # Live relay (diskless sender -> receiver streaming) configuration
+    LIVE_RELAY_BUFFER_SIZE = 16 * 1024 * 1024  # 16 MB in-memory buffer per relay
+    LIVE_RELAY_TIMEOUT = 60  # Seconds either side may stall before abort
 
     # Server configuration
     HOST = "0.0.0.0"
@@ -0,0 +1,161 @@
+"""
+Archive handlers
+Browse the entries of an uploaded archive and download a single entry
+without fetching (or unpacking) the whole archive
+"""
+
+import mimetypes
+import os
+from flask import request, jsonify, Response, stream_with_context
+
+from utils.files.archive_index import (
+    indexing_archives,
+    iter_entry,
+    safe_member_name,
+    load_archive_index,
+)
+from utils.files.storage import attachment_header
+
+MAX_PAGE_SIZE = 1000
+
+
+def register_archive_handlers(app):
+    """
+    Register archive browsing endpoints
+
+    Args:
+        app: Flask application instance
+    """
+
+    def get_index(file_id):
+        """
+        Get an archive index, or the error response to return instead
+        """
+        index = load_archive_index(file_id)
+        if index is None:
+            if file_id in indexing_archives:
+                return None, (jsonify({"success": True, "status": "indexing"}), 202)
+            return None, (jsonify({"success": False, "error": "Not indexed"}), 404)
+
+        if index["error"]:
+            return None, (jsonify({"success": False, "error": index["error"]}), 415)
+
+        return index, None
+
+    @app.route("/api/files/<file_id>/entries", methods=["GET", "OPTIONS"])
+    def list_archive_entries(file_id):
+        """
+        List the entries of an archive
+
+        Query parameters:
+            cursor: ``nextCursor`` of the previous page
+            limit: Page size (1-1000, default 100)
+
+        Returns:
+            JSON with ``entries`` (each with the ``index`` used to extract
+            it), ``total``, ``truncated`` and ``nextCursor``. 202 while the
+            archive is still being indexed
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            index, error = get_index(file_id)
+            if error:
+                return error
+
+            start = int(request.args.get("cursor", 0))
+            limit = int(request.args.get("limit", 100))
+            if start < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+                return jsonify({"success": False, "error": "Invalid page"}), 400
+
+            entries = index["entries"]
+            page = [
+                {
+                    "index": i,
+                    "name": entry["name"],
+                    "size": entry["size"],
+                    "compressedSize": entry["compressedSize"],
+                    "isDir": entry["isDir"],
+                    "modified": entry["modified"],
+                    "encrypted": entry["encrypted"],
+                }
+                for i, entry in enumerate(entries[start : start + limit], start=start)
+            ]
+            end = start + len(page)
+
+            return jsonify(
+                {
+                    "success": True,
+                    "fileId": file_id,
+                    "format": index["format"],
+                    "entries": page,
+                    "total": len(entries),
+                    "truncated": index["truncated"],
+                    "nextCursor": str(end) if end < len(entries) else None,
+                }
+            )
+
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        except Exception as e:
+            print(f"Archive entries error: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route(
+        "/api/files/<file_id>/entries/<int:position>", methods=["GET", "OPTIONS"]
+    )
+    def download_archive_entry(file_id, position):
+        """
+        Stream a single archive entry
+
+        Args:
+            file_id: Unique file identifier of the archive
+            position: ``index`` of the entry in the listing
+
+        Returns:
+            The decompressed entry as an attachment
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            index, error = get_index(file_id)
+            if error:
+                return error
+
+            if position >= len(index["entries"]):
+                return jsonify({"success": False, "error": "Entry not found"}), 404
+
+            entry = index["entries"][position]
+            if entry["isDir"] or entry.get("isFile") is False:
+                return (
+                    jsonify({"success": False, "error": "Entry is not a file"}),
+                    400,
+                )
+            if entry["encrypted"]:
+                return jsonify({"success": False, "error": "Entry is encrypted"}), 409
+
+            if index["format"] == "7z":
+                # 7z entries are extracted to disk under their own name
+                safe_member_name(entry["name"])
+
+            name = os.path.basename(entry["name"].rstrip("/"))
+            return Response(
+                stream_with_context(iter_entry(index, position)),
+                mimetype=mimetypes.guess_type(name)[0] or "application/octet-stream",
+                headers={
+                    "Content-Length": str(entry["size"]),
+                    "Content-Disposition": attachment_header(name),
+                },
+            )
+
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        except Exception as e:
+            print(f"Archive entry error: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
@@ -3,16 +3,51 @@ File upload handlers for large file support with chunking
 Supports files up to 10GB with chunk-based uploading
 """
 
+import io
 import os
-import json
 import shutil
-from datetime import datetime
-from flask import request, jsonify, send_file, current_app
-from services.chunk_upload_service import upload_chunk_service
-from utils.files.metadata_manager import create_metadata
-from utils.files.file_validation import allowed_file
+from eventlet import tpool
+from flask import (
+    request,
+    jsonify,
+    send_file,
+    current_app,
+    Response,
+    stream_with_context,
+)
+from models.data_models import socket_uploads
+from services.chunk_upload_service import (
+    upload_chunk_service,
+    upload_session_exists,
+    complete_upload_in_thread,
+    complete_upload_async,
+    check_upload_complete,
+    schedule_post_upload_jobs,
+    notify_file_received,
+    try_instant_upload,
+    get_download_url,
+)
+from services.file_cache_service import FileCache, advise_readahead, file_etag
+from utils.files.metadata_manager import (
+    create_metadata,
+    load_metadata,
+    rehydrated_sessions,
+)
+from utils.files.file_validation import validate_init_payload
 from utils.files.constants import MAX_CHUNK_SIZE, MAX_FILE_SIZE
+from utils.files.paths import get_temp_dir, get_completed_path
+from utils.files.dedup_store import get_dedup_store, find_deduped
+from utils.files.blob_store import get_blob_store, find_blob
+from utils.files.storage import attachment_header
+from utils.files.delta import get_signature, MIN_BLOCK_SIZE, MAX_BLOCK_SIZE
 from utils.files.allowed_extensions import ALLOWED_EXTENSIONS
+from utils.files.file_categories import get_file_category
+from utils.files.text_preview import (
+    PREVIEW_CATEGORIES,
+    NotTextError,
+    get_preview,
+    read_lines,
+)
 
 
 def register_file_handlers(app, socketio):
@@ -24,6 +59,22 @@ def register_file_handlers(app, socketio):
         socketio: SocketIO instance for real-time communication
     """
 
+    # Shared by all downloads so a file sent to many recipients is read once
+    file_cache = FileCache(
+        app.config["FILE_CACHE_SIZE"], app.config["FILE_CACHE_MAX_FILE_SIZE"]
+    )
+
+    def run_in_thread(func, *args):
+        """
+        Run blocking file work on a tpool thread, inside the app context
+        """
+
+        def run():
+            with app.app_context():
+                return func(*args)
+
+        return tpool.execute(run)
+
     @app.route("/api/files/init", methods=["POST", "OPTIONS"])
     def init_upload():
         """
@@ -38,11 +89,27 @@ def register_file_handlers(app, socketio):
             "totalChunks": 10,
             "fileType": "application/pdf",
             "roomId": "room-123",
-            "partnerSid": "user-456"
+            "partnerSid": "user-456",
+            "recipients": ["user-456", "user-789"] (optional, fan-out),
+            "rooms": ["room-123"] (optional, fan-out),
+            "senderSid": "user-123" (optional, left out of the fan-out),
+            "fingerprint": {"sha256": "...", "proof": {...}} or
+                {"sampleHash": "..."} (optional, see utils/files/content_index.py),
+            "thumbnail": "data:image/jpeg;base64,..." (optional, room gallery),
+            "delta": {
+                "baseFile": "fileId_name.ext",
+                "blockSize": 65536,
+                "deltaSize": 4096,
+                "sha256": "..."
+            } (optional, chunks then carry a delta stream, see utils/files/delta.py)
         }
 
         Returns:
-            JSON response with success status and fileId
+            JSON response with success status and fileId. With a known
+            fingerprint the upload completes immediately (``instant``),
+            ``needsFullHash`` asks to confirm a sample hash match and
+            ``challenge`` asks for the proof of a full hash
+            (``{"challengeId", "hash"}``)
         """
         # Handle preflight OPTIONS request
         if request.method == "OPTIONS":
@@ -52,25 +119,9 @@ def register_file_handlers(app, socketio):
             # Parse JSON data from request
             data = request.get_json()
 
-            if not data:
-                return (
-                    jsonify({"success": False, "error": "No JSON data provided"}),
-                    400,
-                )
-
-            # Validate required fields
-            required_fields = ["fileId", "fileName", "fileSize", "totalChunks"]
-            for field in required_fields:
-                if field not in data:
-                    return (
-                        jsonify(
-                            {
-                                "success": False,
-                                "error": f"Missing required field: {field}",
-                            }
-                        ),
-                        400,
-                    )
+            error = validate_init_payload(data)
+            if error:
+                return jsonify({"success": False, "error": error}), 400
 
             # Extract data
             file_id = data["fileId"]
@@ -78,24 +129,10 @@ def register_file_handlers(app, socketio):
             file_size = int(data["fileSize"])
             total_chunks = int(data["totalChunks"])
 
-            # Validate file size (max 10GB)
-            if file_size > MAX_FILE_SIZE:
-                return (
-                    jsonify(
-                        {
-                            "success": False,
-                            "error": f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024*1024)}GB",
-                        }
-                    ),
-                    400,
-                )
-
-            # Validate file type
-            if not allowed_file(file_name):
-                return (
-                    jsonify({"success": False, "error": "File type not allowed"}),
-                    400,
-                )
+            # Content the server already holds needs no chunk traffic
+            instant = try_instant_upload(socketio, file_id, data, data.get("senderSid"))
+            if instant:
+                return jsonify(instant)
 
             create_metadata(file_id, file_name, file_size, total_chunks, data)
             print(
@@ -160,11 +197,8 @@ def register_file_handlers(app, socketio):
             total_chunks = int(total_chunks) if total_chunks else 1
             chunk_file = request.files["chunk"]
 
-            # Get temporary directory path
-            temp_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], file_id)
-
             # Verify upload session exists
-            if not os.path.exists(temp_dir):
+            if not upload_session_exists(file_id):
                 return (
                     jsonify({"success": False, "error": "Upload session not found"}),
                     404,
@@ -190,11 +224,17 @@ def register_file_handlers(app, socketio):
         Expected JSON payload:
         {
             "fileId": "unique-file-id",
-            "roomId": "room-123" (optional)
+            "roomId": "room-123" (optional),
+            "recipients": [...] (optional, overrides the init list),
+            "rooms": [...] (optional, overrides the init list),
+            "senderSid": "user-123" (optional)
         }
 
         Returns:
-            JSON response with file information and download URL
+            JSON response with file information and download URL. With
+            ASYNC_COMPLETE the merge is queued as a background job and the
+            response is 202 with its ``jobId``; the uploader's socket
+            (``senderSid``) then gets ``file_upload_completed``
         """
         # Handle preflight OPTIONS request
         if request.method == "OPTIONS":
@@ -212,114 +252,241 @@ def register_file_handlers(app, socketio):
             partner_sid = data.get("partnerSid")
             upload_id = data.get("uploadId")
             # Get temporary directory path
-            temp_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], file_id)
+            temp_dir = get_temp_dir(file_id)
 
-            # Read metadata
-            metadata_path = os.path.join(temp_dir, "metadata.json")
-            with open(metadata_path, "r", encoding="utf-8") as f:
-                metadata = json.load(f)
+            notify_options = {
+                "partner_sid": partner_sid,
+                "room_id": room_id,
+                "recipients": data.get("recipients"),
+                "rooms": data.get("rooms"),
+            }
 
-            file_name = metadata["fileName"]
-            original_name = metadata.get("originalName", file_name)
-            total_chunks = metadata["totalChunks"]
+            if current_app.config["ASYNC_COMPLETE"]:
+                metadata = load_metadata(file_id)
+                error = check_upload_complete(metadata)
+                if error:
+                    return jsonify({"success": False, "error": error}), 400
 
-            # Verify all chunks are uploaded
-            if len(metadata["uploadedChunks"]) != total_chunks:
-                missing = total_chunks - len(metadata["uploadedChunks"])
+                job = complete_upload_async(
+                    socketio, file_id, data.get("senderSid"), **notify_options
+                )
                 return (
-                    jsonify({"success": False, "error": f"Missing {missing} chunks"}),
-                    400,
+                    jsonify(
+                        {
+                            "success": True,
+                            "fileId": file_id,
+                            "status": "processing",
+                            "jobId": job.id if job else None,
+                            "fileName": metadata["fileName"],
+                            "fileSize": metadata["fileSize"],
+                            "fileCategory": metadata.get("fileCategory", "other"),
+                            "downloadUrl": get_download_url(metadata),
+                        }
+                    ),
+                    202,
                 )
 
-            print(f"Merging {total_chunks} chunks for: {file_name}")
+            try:
+                metadata = complete_upload_in_thread(file_id)
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+
+            schedule_post_upload_jobs(metadata)
+            notify_file_received(
+                socketio,
+                metadata,
+                sender_sid=data.get("senderSid"),
+                **notify_options,
+            )
 
-            # Create final file path
-            final_path = os.path.join(
-                current_app.config["COMPLETED_FOLDER"], f"{file_id}_{file_name}"
+            return jsonify(
+                {
+                    "success": True,
+                    "fileId": file_id,
+                    "fileName": metadata["fileName"],
+                    "fileSize": metadata["fileSize"],
+                    "fileCategory": metadata.get("fileCategory", "other"),
+                    "downloadUrl": get_download_url(metadata),
+                }
             )
 
-            # Merge all chunks into final file
-            with open(final_path, "wb") as outfile:
-                for i in range(total_chunks):
-                    chunk_path = os.path.join(temp_dir, f"chunk_{i:06d}")
+        except Exception as e:
+            print(f"Upload completion error: {str(e)}")
 
-                    # Verify chunk exists
-                    if not os.path.exists(chunk_path):
-                        raise Exception(f"Missing chunk {i}")
+            # Cleanup temporary directory on error
+            try:
+                if "temp_dir" in locals() and os.path.exists(temp_dir):
+                    shutil.rmtree(temp_dir)
+            except:
+                pass
 
-                    # Append chunk to final file
-                    with open(chunk_path, "rb") as infile:
-                        outfile.write(infile.read())
+            return jsonify({"success": False, "error": str(e)}), 500
 
-            # Verify file size matches expected size
-            final_size = os.path.getsize(final_path)
-            expected_size = metadata["fileSize"]
+    @app.route("/api/files/status/<file_id>", methods=["GET", "OPTIONS"])
+    def upload_status(file_id):
+        """
+        Get the state of an upload session so a client can resume it,
+        e.g. after a server restart
 
-            if final_size != expected_size:
-                print(
-                    f"Warning: Size mismatch! Expected: {expected_size}, Got: {final_size}"
-                )
+        Args:
+            file_id: Unique file identifier
+
+        Returns:
+            JSON with uploaded and missing chunk indexes
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
 
-            # Delete temporary directory and chunks
-            shutil.rmtree(temp_dir)
+        try:
+            if not upload_session_exists(file_id):
+                return (
+                    jsonify({"success": False, "error": "Upload session not found"}),
+                    404,
+                )
 
-            print(f"File upload completed: {file_name} ({final_size:,} bytes)")
+            metadata = load_metadata(file_id)
+            uploaded = sorted(metadata["uploadedChunks"])
+            uploaded_set = set(uploaded)
+            total_chunks = metadata["totalChunks"]
 
-            if partner_sid:
-                file_data = {
+            return jsonify(
+                {
+                    "success": True,
                     "fileId": file_id,
-                    "fileName": file_name,
-                    "originalName": original_name,
-                    "fileSize": final_size,
-                    "fileType": metadata["fileType"],
-                    "fileCategory": metadata.get("fileCategory", "other"),
-                    "fileIcon": metadata.get("fileIcon", "📁"),
-                    "downloadUrl": f"/api/files/download/{file_id}_{file_name}",
-                    "timestamp": datetime.now().isoformat(),
-                    "from_sid": partner_sid,
+                    "fileName": metadata["fileName"],
+                    "fileSize": metadata["fileSize"],
+                    "totalChunks": total_chunks,
+                    "uploadedChunks": uploaded,
+                    "missingChunks": [
+                        i for i in range(total_chunks) if i not in uploaded_set
+                    ],
+                    "progress": round(len(uploaded) / max(1, total_chunks) * 100, 2),
                 }
+            )
+
+        except Exception as e:
+            print(f"Upload status error: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/files/signature/<filename>", methods=["GET", "OPTIONS"])
+    def get_file_signature(filename):
+        """
+        Get rolling-checksum block signatures of a completed file, used by
+        clients to compute a delta upload against it
+
+        Args:
+            filename: Stored name of the base file (format: fileId_originalName)
+
+        Query:
+            blockSize: Block size in bytes (optional)
 
-                socketio.emit("file_received", file_data, to=partner_sid)
-                print(f"File notification sent to partner: {partner_sid}")
+        Returns:
+            JSON with fileSize, blockSize and ``[weak, strong]`` per block
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            block_size = int(
+                request.args.get("blockSize", current_app.config["DELTA_BLOCK_SIZE"])
+            )
+            if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+                return (
+                    jsonify({"success": False, "error": "Invalid block size"}),
+                    400,
+                )
+
+            try:
+                signature = get_signature(filename, block_size)
+            except FileNotFoundError:
+                return jsonify({"success": False, "error": "File not found"}), 404
+
+            return jsonify({"success": True, "baseFile": filename, **signature})
+
+        except ValueError:
+            return jsonify({"success": False, "error": "Invalid data format"}), 400
+
+        except Exception as e:
+            print(f"Signature error: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/files/preview/<filename>", methods=["GET", "OPTIONS"])
+    def get_file_preview(filename):
+        """
+        Preview a completed code or document file without downloading it
+
+        Args:
+            filename: Stored name of the file (format: fileId_originalName)
+
+        Query:
+            lines: Line range to return instead, e.g. ``1000-2000`` (optional)
+
+        Returns:
+            JSON with encoding, fileSize, lineCount, head and tail text, or
+            the requested lines
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            if get_file_category(filename) not in PREVIEW_CATEGORIES:
+                return (
+                    jsonify({"success": False, "error": "Preview not available"}),
+                    415,
+                )
+
+            line_range = request.args.get("lines")
+            if line_range:
+                first, last = (int(part) for part in line_range.split("-", 1))
+                max_lines = current_app.config["PREVIEW_MAX_LINES"]
+                if not 1 <= first <= last or last - first >= max_lines:
+                    return (
+                        jsonify(
+                            {
+                                "success": False,
+                                "error": f"lines must be a range of at most {max_lines} lines",
+                            }
+                        ),
+                        400,
+                    )
 
-            elif room_id:
-                socketio.emit(
-                    "file_received",
+                return jsonify(
                     {
-                        "fileId": file_id,
-                        "fileName": file_name,
-                        "originalName": original_name,
-                        "fileSize": final_size,
-                        "fileType": metadata["fileType"],
-                        "fileCategory": metadata.get("fileCategory", "other"),
-                        "fileIcon": metadata.get("fileIcon", "📁"),
-                        "downloadUrl": f"/api/files/download/{file_id}_{file_name}",
-                        "timestamp": datetime.now().isoformat(),
-                        "from_sid": request.sid,
-                    },
-                    room=room_id,
+                        "success": True,
+                        "fileName": filename,
+                        **run_in_thread(read_lines, filename, first, last),
+                    }
                 )
+
+            # A first preview scans the whole file
+            preview = run_in_thread(get_preview, filename)
             return jsonify(
                 {
                     "success": True,
-                    "fileId": file_id,
-                    "fileName": file_name,
-                    "fileSize": final_size,
-                    "fileCategory": metadata.get("fileCategory", "other"),
-                    "downloadUrl": f"/api/files/download/{file_id}_{file_name}",
+                    "fileName": filename,
+                    "encoding": preview["encoding"],
+                    "fileSize": preview["fileSize"],
+                    "lineCount": preview["lineCount"],
+                    "head": preview["head"],
+                    "tail": preview["tail"],
+                    "truncated": preview["truncated"],
                 }
             )
 
-        except Exception as e:
-            print(f"Upload completion error: {str(e)}")
+        except FileNotFoundError:
+            return jsonify({"success": False, "error": "File not found"}), 404
 
-            # Cleanup temporary directory on error
-            try:
-                if "temp_dir" in locals() and os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
-            except:
-                pass
+        except NotTextError as e:
+            return jsonify({"success": False, "error": str(e)}), 415
+
+        except ValueError:
+            return jsonify({"success": False, "error": "Invalid data format"}), 400
 
+        except Exception as e:
+            print(f"Preview error: {str(e)}")
             return jsonify({"success": False, "error": str(e)}), 500
 
     @app.route("/api/files/download/<filename>", methods=["GET", "OPTIONS"])
@@ -339,22 +506,94 @@ def register_file_handlers(app, socketio):
 
         try:
             # Get file path
-            file_path = os.path.join(current_app.config["COMPLETED_FOLDER"], filename)
-
-            # Verify file exists
-            if not os.path.exists(file_path):
-                return jsonify({"error": "File not found"}), 404
+            file_path = get_completed_path(filename)
 
             # Extract original filename (remove fileId prefix)
             original_name = filename.split("_", 1)[1] if "_" in filename else filename
 
+            # Verify file exists
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                # Small files are served from the blob store
+                blob = None
+                if find_blob(filename) is not None:
+                    blob = get_blob_store().get(filename)
+                if blob is not None:
+                    data, mtime = blob
+                    return send_file(
+                        io.BytesIO(data),
+                        as_attachment=True,
+                        download_name=original_name,
+                        last_modified=mtime,
+                        etag=f"{mtime}-{len(data)}",
+                        conditional=True,
+                    )
+
+                # Files in the dedup engine are rebuilt as a stream
+                size = find_deduped(filename)
+                if size is None:
+                    return jsonify({"error": "File not found"}), 404
+
+                return Response(
+                    stream_with_context(get_dedup_store().iter_file(filename)),
+                    mimetype="application/octet-stream",
+                    headers={
+                        "Content-Length": str(size),
+                        "Content-Disposition": attachment_header(original_name),
+                    },
+                )
+
+            # Serve small/medium files from the shared cache
+            data = file_cache.get(file_path, stat)
+            if data is not None:
+                return send_file(
+                    io.BytesIO(data),
+                    as_attachment=True,
+                    download_name=original_name,
+                    last_modified=stat.st_mtime,
+                    etag=file_etag(file_path, stat),
+                    conditional=True,
+                )
+
             # Send file as attachment
-            return send_file(file_path, as_attachment=True, download_name=original_name)
+            advise_readahead(file_path, stat.st_size)
+            return send_file(
+                file_path,
+                as_attachment=True,
+                download_name=original_name,
+                conditional=True,
+            )
 
         except Exception as e:
             print(f"Download error: {str(e)}")
             return jsonify({"error": str(e)}), 500
 
+    @app.route("/api/files/dedup/stats", methods=["GET", "OPTIONS"])
+    def get_dedup_stats():
+        """
+        Get chunk-level dedup engine statistics
+
+        Returns:
+            JSON with file/chunk counts, logical and stored bytes and the
+            dedup ratio (logical / stored)
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        if not current_app.config["DEDUP_CATEGORIES"]:
+            return jsonify({"success": True, "enabled": False})
+
+        return jsonify(
+            {
+                "success": True,
+                "enabled": True,
+                "categories": sorted(current_app.config["DEDUP_CATEGORIES"]),
+                **get_dedup_store().stats(),
+            }
+        )
+
     @app.route("/api/files/cleanup/<file_id>", methods=["DELETE", "OPTIONS"])
     def cleanup_upload(file_id):
         """
@@ -371,10 +610,12 @@ def register_file_handlers(app, socketio):
             return "", 204
 
         try:
-            temp_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], file_id)
+            temp_dir = get_temp_dir(file_id)
 
             if os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
+                socket_uploads.pop(file_id, None)
+                rehydrated_sessions.discard(file_id)
                 print(f"Cleaned up upload: {file_id}")
                 return jsonify({"success": True, "message": "Upload cleaned up"})
             else:
@@ -0,0 +1,78 @@
+"""
+Job handlers
+Status and cancellation of background jobs (merges, dedup ingest, archive
+indexing, previews)
+"""
+
+from flask import request, jsonify
+
+from services.job_service import get_job_engine
+
+
+def register_job_handlers(app):
+    """
+    Register background job endpoints
+
+    Args:
+        app: Flask application instance
+    """
+
+    @app.route("/api/jobs", methods=["GET", "OPTIONS"])
+    def list_jobs():
+        """
+        List queued, running and recently finished jobs, newest first
+
+        Query parameters:
+            state: Only jobs in this state (queued, running, ...)
+            type: Only jobs of this type (merge, dedup_ingest, ...)
+
+        Returns:
+            JSON with ``jobs`` and engine ``stats``
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        engine = get_job_engine()
+        return jsonify(
+            {
+                "success": True,
+                "jobs": engine.list(
+                    state=request.args.get("state"),
+                    job_type=request.args.get("type"),
+                ),
+                "stats": engine.stats(),
+            }
+        )
+
+    @app.route("/api/jobs/<job_id>", methods=["GET", "DELETE", "OPTIONS"])
+    def job_detail(job_id):
+        """
+        Get (GET) or cancel (DELETE) a job
+
+        Returns:
+            JSON with the job; DELETE answers 409 when the job already
+            finished or is a running thread job, which cannot be interrupted
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        engine = get_job_engine()
+        job = engine.get(job_id)
+        if not job:
+            return jsonify({"success": False, "error": "Job not found"}), 404
+
+        if request.method == "DELETE" and not engine.cancel(job_id):
+            return (
+                jsonify(
+                    {
+                        "success": False,
+                        "error": "Job cannot be cancelled",
+                        "job": job.to_dict(),
+                    }
+                ),
+                409,
+            )
+
+        return jsonify({"success": True, "job": job.to_dict()})
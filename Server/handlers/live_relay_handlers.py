@@ -0,0 +1,298 @@
+"""
+Live relay handlers
+Streams a file from an online sender to an online receiver through a
+bounded in-memory buffer instead of persisting it first
+"""
+
+import os
+from flask import request, jsonify, current_app, Response, stream_with_context
+from flask_socketio import SocketIO
+
+from models.data_models import user_registry
+from services.chunk_upload_service import (
+    add_to_galleries,
+    build_file_received_payload,
+    schedule_post_upload_jobs,
+)
+from services.job_service import submit_job
+from services.live_relay_service import (
+    RelayError,
+    live_relays,
+    create_relay,
+    finish_relay,
+    release_relay,
+    abort_relay,
+)
+from utils.files.metadata_manager import build_metadata
+from utils.files.file_validation import validate_init_payload
+from utils.files.paths import get_final_path
+from utils.files.storage import attachment_header
+
+
+def register_live_relay_handlers(app, socketio: SocketIO):
+    """
+    Register live relay endpoints and Socket.IO events
+
+    Args:
+        app: Flask application instance
+        socketio: SocketIO instance
+    """
+
+    def watch_receiver(file_id, relay, timeout):
+        """
+        Abort a relay whose receiver never attached
+        """
+        socketio.sleep(timeout)
+        if live_relays.get(file_id) is relay and not relay.reader_attached:
+            abort_relay(file_id, "Receiver never connected")
+            print(f"Live relay aborted, receiver never connected: {file_id}")
+
+    def publish_tee(relay):
+        """
+        Publish the tee file of a finished relay like a merged upload:
+        durability policy, content index, small file store, then the
+        follow-up jobs and the room galleries
+        """
+        part_path = relay.tee_path + ".part"
+        metadata = {**relay.metadata, "fileSize": relay.bytes_in}
+
+        def on_success(metadata):
+            schedule_post_upload_jobs(metadata)
+            add_to_galleries(metadata, relay.sender_sid)
+
+        def on_failure(error):
+            print(f"Live relay publish error: {error}")
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+        submit_job(
+            "relay_publish",
+            metadata,
+            part_path,
+            relay.sha256,
+            key=f"relay_publish:{relay.file_id}",
+            on_success=on_success,
+            on_failure=on_failure,
+        )
+
+    def push_chunk(file_id, chunk):
+        relay = live_relays.get(file_id)
+        if not relay:
+            return {"success": False, "error": "Relay not found"}, 404
+
+        try:
+            relay.put(chunk, current_app.config["LIVE_RELAY_TIMEOUT"])
+        except RelayError as e:
+            abort_relay(file_id, str(e))
+            return {"success": False, "error": str(e)}, 409
+
+        return {"success": True, "bytesRelayed": relay.bytes_in}, 200
+
+    @app.route("/api/files/relay/init", methods=["POST", "OPTIONS"])
+    def init_relay():
+        """
+        Start a live relay to an online partner
+
+        Expected JSON payload: same as ``/api/files/init`` plus
+        ``"tee": true`` to also persist the stream for later re-download
+
+        The partner receives ``file_received`` with ``live: true`` and a
+        download URL that streams while the sender uploads
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            data = request.get_json()
+            if data:
+                data.setdefault("totalChunks", 0)
+
+            error = validate_init_payload(data)
+            if error:
+                return jsonify({"success": False, "error": error}), 400
+
+            partner_sid = data.get("partnerSid")
+            if partner_sid not in user_registry:
+                return (
+                    jsonify({"success": False, "error": "Partner is not online"}),
+                    409,
+                )
+
+            file_id = data["fileId"]
+            metadata = build_metadata(
+                file_id,
+                data["fileName"],
+                int(data["fileSize"]),
+                int(data["totalChunks"]),
+                data,
+            )
+
+            tee_path = None
+            if data.get("tee"):
+                tee_path = get_final_path(file_id, metadata["fileName"])
+                os.makedirs(os.path.dirname(tee_path), exist_ok=True)
+
+            relay = create_relay(
+                file_id,
+                metadata,
+                current_app.config["LIVE_RELAY_BUFFER_SIZE"],
+                tee_path,
+                data.get("senderSid"),
+                partner_sid,
+            )
+
+            payload = build_file_received_payload(metadata, data.get("senderSid"))
+            payload["downloadUrl"] = f"/api/files/relay/{file_id}"
+            payload["live"] = True
+            socketio.emit("file_received", payload, to=partner_sid)
+
+            socketio.start_background_task(
+                watch_receiver,
+                file_id,
+                relay,
+                current_app.config["LIVE_RELAY_TIMEOUT"],
+            )
+
+            print(f"Live relay initialized: {metadata['fileName']} -> {partner_sid}")
+
+            return jsonify(
+                {
+                    "success": True,
+                    "fileId": file_id,
+                    "bufferSize": relay.capacity,
+                    "message": "Live relay initialized",
+                }
+            )
+
+        except ValueError:
+            return jsonify({"success": False, "error": "Invalid data format"}), 400
+
+        except Exception as e:
+            print(f"Live relay init error: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app.route("/api/files/relay/<file_id>/chunk", methods=["POST", "OPTIONS"])
+    def relay_chunk(file_id):
+        """
+        Push the next chunk of a live relay
+
+        Accepts form-data ``chunk`` or a raw request body. The response is
+        delayed while the relay buffer is full
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        if request.files and "chunk" in request.files:
+            chunk = request.files["chunk"].read()
+        else:
+            chunk = request.get_data()
+
+        body, status = push_chunk(file_id, chunk)
+        return jsonify(body), status
+
+    @app.route("/api/files/relay/<file_id>/complete", methods=["POST", "OPTIONS"])
+    def complete_relay(file_id):
+        """
+        Signal the end of the sender's stream
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            relay = finish_relay(file_id)
+        except OSError as e:
+            abort_relay(file_id, str(e))
+            return jsonify({"success": False, "error": str(e)}), 500
+
+        if not relay:
+            return jsonify({"success": False, "error": "Relay not found"}), 404
+
+        metadata = relay.metadata
+        response = {
+            "success": True,
+            "fileId": file_id,
+            "fileName": metadata["fileName"],
+            "fileSize": relay.bytes_in,
+            "fileCategory": metadata.get("fileCategory", "other"),
+        }
+        if relay.tee_path:
+            publish_tee(relay)
+            response["downloadUrl"] = (
+                f"/api/files/download/{file_id}_{metadata['fileName']}"
+            )
+
+        print(
+            f"Live relay completed: {metadata['fileName']} ({relay.bytes_in:,} bytes)"
+        )
+        return jsonify(response)
+
+    @app.route("/api/files/relay/<file_id>", methods=["GET", "DELETE", "OPTIONS"])
+    def relay_stream(file_id):
+        """
+        GET: stream the relayed file to the receiver (one reader per relay)
+        DELETE: abort the relay from either side
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        if request.method == "DELETE":
+            abort_relay(file_id, "Relay cancelled")
+            return jsonify({"success": True, "message": "Relay cancelled"})
+
+        relay = live_relays.get(file_id)
+        if not relay:
+            return jsonify({"error": "Relay not found"}), 404
+
+        if relay.reader_attached:
+            return jsonify({"error": "Relay already has a receiver"}), 409
+
+        relay.reader_attached = True
+        timeout = current_app.config["LIVE_RELAY_TIMEOUT"]
+
+        def generate():
+            try:
+                while True:
+                    chunk = relay.get(timeout)
+                    if chunk is None:
+                        break
+                    yield chunk
+            except RelayError as e:
+                print(f"Live relay stream error: {str(e)}")
+            finally:
+                # Receiver went away early: unblock and fail the sender
+                if not relay.drained:
+                    relay.abort("Receiver disconnected")
+                release_relay(relay)
+
+        metadata = relay.metadata
+        return Response(
+            stream_with_context(generate()),
+            mimetype=metadata.get("fileType") or "application/octet-stream",
+            headers={
+                "Content-Length": str(metadata["fileSize"]),
+                "Content-Disposition": attachment_header(metadata["fileName"]),
+            },
+        )
+
+    @socketio.on("file_relay_chunk")
+    def handle_file_relay_chunk(data):
+        """
+        Push the next binary chunk of a live relay over Socket.IO
+
+        The ack is withheld while the relay buffer is full, so a client
+        waiting for each ack is throttled to the receiver's speed
+        """
+        file_id = data.get("fileId")
+        chunk = data.get("chunk")
+
+        if not file_id or not isinstance(chunk, (bytes, bytearray)):
+            return {"success": False, "error": "Missing required parameters"}
+
+        body, _ = push_chunk(file_id, bytes(chunk))
+        return body
+
+    print("Live relay handlers registered successfully")
@@ -0,0 +1,171 @@
+"""
+Signaling handlers for peer-to-peer file transfers over WebRTC DataChannel
+The server only relays negotiation messages; file bytes flow directly
+between the peers, with the chunked HTTP upload as automatic fallback
+"""
+
+from flask import current_app
+from flask_socketio import SocketIO, emit
+
+from models.data_models import user_registry, p2p_transfers
+from services.p2p_transfer_service import (
+    create_transfer,
+    get_peer_sid,
+    fall_back_to_server,
+    remove_transfer,
+    watch_transfer,
+)
+from services.session_service import current_sid
+
+
+def register_p2p_transfer_handlers(app, socketio: SocketIO):
+    """
+    Register peer-to-peer file transfer signaling events
+
+    Args:
+        app: Flask application instance
+        socketio: SocketIO instance
+    """
+
+    @socketio.on("p2p_file_offer")
+    def handle_p2p_file_offer(data):
+        """
+        Offer a file to another user over a DataChannel
+
+        Expected payload:
+        {
+            "target_sid": "user-456",
+            "fileName": "example.pdf",
+            "fileSize": 1048576,
+            "fileType": "application/pdf"
+        }
+
+        Returns:
+            Ack with the server generated transferId and the connect
+            timeout in seconds; an invalid offer also gets
+            ``p2p_transfer_failed``
+        """
+        target_sid = data.get("target_sid")
+
+        if target_sid not in user_registry or current_sid() not in user_registry:
+            return {"success": False, "error": "User not found or offline"}
+
+        try:
+            transfer = create_transfer(current_sid(), target_sid, data)
+        except ValueError as e:
+            emit("p2p_transfer_failed", {"error": str(e)})
+            return {"success": False, "error": str(e)}
+        timeout = current_app.config["P2P_CONNECT_TIMEOUT"]
+
+        emit(
+            "p2p_file_offer",
+            {
+                "transferId": transfer["id"],
+                "from_sid": current_sid(),
+                "from_username": user_registry.get(current_sid()).username,
+                "fileName": transfer["fileName"],
+                "fileSize": transfer["fileSize"],
+                "fileType": transfer["fileType"],
+            },
+            room=target_sid,
+        )
+
+        socketio.start_background_task(
+            watch_transfer,
+            socketio,
+            transfer["id"],
+            timeout,
+            current_app.config["P2P_TRANSFER_TIMEOUT"],
+        )
+
+        return {"success": True, "transferId": transfer["id"], "timeout": timeout}
+
+    @socketio.on("p2p_file_answer")
+    def handle_p2p_file_answer(data):
+        """
+        Accept or decline a file offer
+
+        A declined offer falls back to the server path so the file still
+        arrives, just not peer-to-peer
+        """
+        transfer_id = data.get("transferId")
+        transfer = p2p_transfers.get(transfer_id)
+
+        if not transfer or transfer["to_sid"] != current_sid():
+            return {"success": False, "error": "Transfer not found"}
+
+        if not data.get("accepted", True):
+            fall_back_to_server(socketio, transfer_id, "Peer declined P2P")
+            return {"success": True, "fallback": True}
+
+        transfer["state"] = "negotiating"
+        emit(
+            "p2p_file_answer",
+            {"transferId": transfer_id, "from_sid": current_sid(), "accepted": True},
+            room=transfer["from_sid"],
+        )
+        return {"success": True}
+
+    @socketio.on("p2p_file_signal")
+    def handle_p2p_file_signal(data):
+        """
+        Relay DataChannel negotiation (SDP offer/answer, ICE candidates)
+        to the other party of the transfer
+        """
+        transfer_id = data.get("transferId")
+        transfer = p2p_transfers.get(transfer_id)
+        if not transfer:
+            return
+
+        peer_sid = get_peer_sid(transfer, current_sid())
+        if peer_sid:
+            emit(
+                "p2p_file_signal",
+                {
+                    "transferId": transfer_id,
+                    "from_sid": current_sid(),
+                    "signal": data.get("signal"),
+                },
+                room=peer_sid,
+            )
+
+    @socketio.on("p2p_file_connected")
+    def handle_p2p_file_connected(data):
+        """
+        Mark the DataChannel as open, which disarms the fallback timeout
+        """
+        transfer = p2p_transfers.get(data.get("transferId"))
+        if transfer and get_peer_sid(transfer, current_sid()):
+            transfer["state"] = "connected"
+
+    @socketio.on("p2p_file_complete")
+    def handle_p2p_file_complete(data):
+        """
+        Finish a transfer after the receiver got every byte
+        """
+        transfer_id = data.get("transferId")
+        transfer = p2p_transfers.get(transfer_id)
+        if not transfer:
+            return
+
+        peer_sid = get_peer_sid(transfer, current_sid())
+        if peer_sid:
+            remove_transfer(transfer_id)
+            print(f"P2P transfer completed: {transfer['fileName']}")
+            emit("p2p_file_completed", {"transferId": transfer_id}, room=peer_sid)
+
+    @socketio.on("p2p_file_failed")
+    def handle_p2p_file_failed(data):
+        """
+        Report a failed DataChannel (ICE failure, channel closed mid-transfer)
+        and fall back to the chunked HTTP path
+        """
+        transfer_id = data.get("transferId")
+        transfer = p2p_transfers.get(transfer_id)
+
+        if transfer and get_peer_sid(transfer, current_sid()):
+            fall_back_to_server(
+                socketio, transfer_id, data.get("reason", "Peer connection failed")
+            )
+
+    print("P2P transfer handlers registered successfully")
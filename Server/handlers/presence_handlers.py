@@ -0,0 +1,75 @@
+"""
+Presence handlers
+HTTP view of online users and of the presence broadcaster
+"""
+
+from flask import request, jsonify
+
+from services.user_service import (
+    get_presence_broadcaster,
+    get_presence_snapshot,
+    query_online_users,
+)
+
+
+def register_presence_handlers(app):
+    """
+    Register presence endpoints
+
+    Args:
+        app: Flask application instance
+    """
+
+    @app.route("/api/users", methods=["GET", "OPTIONS"])
+    def list_online_users():
+        """
+        List online users
+
+        Query parameters (all optional; without any, the full list is
+        served from the cached snapshot):
+            prefix: Username prefix, case-insensitive
+            subnet: Only users in this network (e.g. 10.0.3.0/24)
+            status: in_call, available or a user status
+            cursor: nextCursor of the previous page
+            limit: Page size
+
+        Returns:
+            JSON with ``users``, the presence ``version`` and, for queries,
+            ``nextCursor``
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        if not request.args:
+            return app.response_class(
+                get_presence_snapshot().encoded, mimetype="application/json"
+            )
+
+        try:
+            page = query_online_users(
+                prefix=request.args.get("prefix", ""),
+                subnet=request.args.get("subnet"),
+                status=request.args.get("status"),
+                cursor=request.args.get("cursor"),
+                limit=request.args.get("limit"),
+            )
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        return jsonify({"success": True, **page})
+
+    @app.route("/api/presence/stats", methods=["GET", "OPTIONS"])
+    def presence_stats():
+        """
+        Coalescing metrics of presence broadcasts
+
+        Returns:
+            JSON with the flush window and rate limit, the number of
+            flushes and how many changes each one absorbed
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        return jsonify({"success": True, **get_presence_broadcaster().stats()})
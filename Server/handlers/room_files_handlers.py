@@ -0,0 +1,68 @@
+"""
+Room files handlers
+Gallery of the files shared into a room, for clients that join late or
+reload and missed the ``file_received`` notifications
+"""
+
+from flask import request, jsonify
+
+from services.room_files_service import get_room_file_index
+
+MAX_PAGE_SIZE = 200
+
+
+def register_room_files_handlers(app):
+    """
+    Register room files endpoints
+
+    Args:
+        app: Flask application instance
+    """
+
+    @app.route("/api/rooms/<room_id>/files", methods=["GET", "OPTIONS"])
+    def list_room_files(room_id):
+        """
+        List the files shared into a room
+
+        Query parameters:
+            cursor: ``nextCursor`` of the previous page
+            limit: Page size (1-200, default 50)
+            category: Only files of this category (image, video, ...)
+            sort: "time" (newest first, default) or "size" (largest first)
+
+        Returns:
+            JSON with ``files`` and ``nextCursor`` (null on the last page)
+        """
+        # Handle preflight OPTIONS request
+        if request.method == "OPTIONS":
+            return "", 204
+
+        try:
+            limit = int(request.args.get("limit", 50))
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                return (
+                    jsonify(
+                        {
+                            "success": False,
+                            "error": f"limit must be between 1 and {MAX_PAGE_SIZE}",
+                        }
+                    ),
+                    400,
+                )
+
+            page = get_room_file_index().list(
+                room_id,
+                cursor=request.args.get("cursor"),
+                limit=limit,
+                category=request.args.get("category"),
+                sort=request.args.get("sort", "time"),
+            )
+
+            return jsonify({"success": True, "roomId": room_id, **page})
+
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        except Exception as e:
+            print(f"Room files error: {str(e)}")
+            return jsonify({"success": False, "error": str(e)}), 500
@@ -3,13 +3,27 @@ Server\handlers\socket_handlers.py
 Socket event handlers for real-time communication
 """
 
-from flask import request
+from flask import current_app, request
 from flask_socketio import SocketIO, emit, join_room, leave_room
 from datetime import datetime
 import uuid
 
-from models.data_models import connected_users, pending_requests, active_calls
-from services.user_service import broadcast_user_list, get_user_list
+from models.data_models import user_registry, pending_requests, active_calls
+from services.user_service import (
+    PRESENCE_ROOM,
+    broadcast_presence,
+    get_presence_snapshot,
+    get_user_chat,
+    query_online_users,
+    remove_user,
+    resume_user,
+    subscribe_presence,
+    suspend_user,
+    unsubscribe_presence,
+)
+from services.session_service import current_sid, emit_to_user
+from services.heartbeat_service import mark_active, record_heartbeat
+from services.message_history_service import get_history, record_message
 
 import logging
 
@@ -60,35 +74,50 @@ def register_socket_handlers(app, socketio: SocketIO):
     """
 
     @socketio.on("connect")
-    def handle_connect():
+    def handle_connect(auth=None):
         """
-        Handle new socket connection
+        Handle new socket connection, resuming the session of a
+        reconnecting user when its token is presented
         """
         # Get client IP using improved detection
         client_ip = get_client_ip()
-        existing_user = None
-        for _, user_info in connected_users.items():
-            if user_info["ip"] == client_ip:
-                existing_user = user_info
-                break
+        transport = request.environ.get("HTTP_UPGRADE", "polling").lower()
 
-        if existing_user:
-            del connected_users[existing_user["sid"]]
+        token = auth.get("resume_token") if isinstance(auth, dict) else None
+        user = user_registry.find_by_token(token) if token else None
+        # A reloaded page may reconnect before its old socket is gone: the
+        # token holder takes the session over either way
+        if user is not None:
+            logger.info(
+                f"Resumed session {user.sid} on {request.sid} via {transport} "
+                f"from {client_ip}"
+            )
+            emit(
+                "connection_established",
+                {
+                    "sid": user.sid,
+                    "ip": user.ip,
+                    "username": user.username,
+                    "resume_token": user.token,
+                    "resumed": True,
+                    "chat": get_user_chat(user),
+                },
+            )
+            # Rejoin the session's rooms, then replay what it missed
+            resume_user(socketio, user, request.sid)
+            broadcast_presence(socketio)
+            return
 
-        transport = request.environ.get("HTTP_UPGRADE", "polling").lower()
+        existing_sid = user_registry.sid_for_ip(client_ip)
+        if existing_sid:
+            remove_user(socketio, existing_sid)
 
         logger.info(f"New connection: {request.sid} via {transport} from {client_ip}")
 
         # Store connection info
-        connected_users[request.sid] = {
-            "sid": request.sid,
-            "ip": client_ip,
-            "username": f'User_{client_ip.split(".")[-1]}',
-            "status": "online",
-            "connected_at": datetime.now().isoformat(),
-            "current_room": None,
-            "in_call": False,
-        }
+        user = user_registry.add(
+            request.sid, client_ip, f'User_{client_ip.split(".")[-1]}'
+        )
 
         # Notify client of successful connection
         emit(
@@ -96,36 +125,37 @@ def register_socket_handlers(app, socketio: SocketIO):
             {
                 "sid": request.sid,
                 "ip": client_ip,
-                "username": connected_users[request.sid]["username"],
+                "username": user.username,
+                "resume_token": user.token,
+                "resumed": False,
             },
         )
 
-        # Broadcast updated user list to all clients
-        broadcast_user_list(socketio)
+        # Receive every presence change until subscribing to some users
+        join_room(PRESENCE_ROOM)
+
+        # Broadcast the join (and any eviction) to all clients
+        broadcast_presence(socketio)
 
     @socketio.on("disconnect")
     def handle_disconnect():
         """
         Handle socket disconnection
         """
-        if request.sid in connected_users:
-            user_info = connected_users[request.sid]
-
-            # Leave any active rooms
-            if user_info.get("current_room"):
-                leave_room(user_info["current_room"])
-                # Notify room participants
-                emit(
-                    "user_left_room",
-                    {"user": user_info["username"], "sid": request.sid},
-                    room=user_info["current_room"],
-                )
+        user = user_registry.get(current_sid())
+        # Unknown, or an old socket of a session resumed elsewhere
+        if user is None or user.socket_sid != request.sid:
+            return
 
-            # Remove from connected users
-            del connected_users[request.sid]
+        if current_app.config["RECONNECT_GRACE"] > 0:
+            # Keep the session for a while in case the client comes back
+            suspend_user(socketio, user.sid)
+        else:
+            # End the user's chat and call, drop its requests and transfers
+            remove_user(socketio, user.sid)
 
-            # Broadcast updated user list
-            broadcast_user_list(socketio)
+        # One presence update for the whole cascade
+        broadcast_presence(socketio)
 
     @socketio.on("set_username")
     def handle_set_username(data):
@@ -133,19 +163,78 @@ def register_socket_handlers(app, socketio: SocketIO):
         Set custom username for user
         """
         username = data.get("username", "").strip()
-        if username and request.sid in connected_users:
-            connected_users[request.sid]["username"] = username
+        sid = current_sid()
+        if username and sid in user_registry:
+            user_registry.set_username(sid, username)
             emit("username_updated", {"username": username})
-            broadcast_user_list(socketio)
+            broadcast_presence(socketio)
 
     @socketio.on("get_online_users")
     def handle_get_online_users(data=None):
         """
-        Get list of all online users
+        Get a snapshot of all online users and its presence version
         """
-        users_list = get_user_list(exclude_sid=request.sid)
+        snapshot = get_presence_snapshot()
 
-        emit("online_users_list", {"users": users_list})
+        emit(
+            "online_users_list",
+            {
+                "users": snapshot.users_excluding(current_sid()),
+                "version": snapshot.version,
+            },
+        )
+
+    @socketio.on("query_online_users")
+    def handle_query_online_users(data=None):
+        """
+        Get one page of online users, filtered by username prefix, subnet
+        and status (see services.user_service.query_online_users)
+        """
+        data = data or {}
+        try:
+            page = query_online_users(
+                prefix=data.get("prefix", ""),
+                subnet=data.get("subnet"),
+                status=data.get("status"),
+                cursor=data.get("cursor"),
+                limit=data.get("limit"),
+                exclude_sid=current_sid(),
+            )
+        except ValueError as e:
+            emit("query_failed", {"error": str(e)})
+            return
+
+        emit("online_users_page", page)
+
+    @socketio.on("subscribe_presence")
+    def handle_subscribe_presence(data=None):
+        """
+        Only receive presence changes of the given users (the ones on
+        screen); without users, receive every change again
+        """
+        sids = (data or {}).get("sids") or []
+        if not sids:
+            unsubscribe_presence(request.sid, rejoin=True)
+            handle_get_online_users()
+            return
+
+        try:
+            emit("presence_subscribed", subscribe_presence(request.sid, sids))
+        except ValueError as e:
+            emit("query_failed", {"error": str(e)})
+
+    @socketio.on("heartbeat")
+    def handle_heartbeat(data=None):
+        """
+        Application heartbeat; ``active`` tells whether the user interacted
+        since the previous one
+
+        Returns:
+            dict: Acknowledgement with the ``interval`` in seconds until the
+            next heartbeat
+        """
+        active = bool((data or {}).get("active", True))
+        return record_heartbeat(current_app, socketio, current_sid(), active)
 
     @socketio.on("send_chat_request")
     def handle_chat_request(data):
@@ -154,35 +243,50 @@ def register_socket_handlers(app, socketio: SocketIO):
         """
         target_sid = data.get("target_sid")
 
-        if target_sid not in connected_users:
+        target = user_registry.get(target_sid)
+        if target is None:
             emit("request_failed", {"error": "User not found or offline"})
             return
 
+        sender = user_registry.get(current_sid())
+        mark_active(socketio, sender.sid)
+
         # Create unique request ID
         request_id = str(uuid.uuid4())
 
         # Store pending request
-        pending_requests[request_id] = {
-            "id": request_id,
-            "from_sid": request.sid,
-            "from_username": connected_users[request.sid]["username"],
-            "from_ip": connected_users[request.sid]["ip"],
-            "to_sid": target_sid,
-            "type": "chat",
-            "timestamp": datetime.now().isoformat(),
-        }
+        req = pending_requests.add(
+            {
+                "id": request_id,
+                "from_sid": sender.sid,
+                "from_username": sender.username,
+                "from_ip": sender.ip,
+                "to_sid": target_sid,
+                "type": "chat",
+                "timestamp": datetime.now().isoformat(),
+            },
+            current_app.config["CHAT_REQUEST_TTL"],
+        )
+        if req["id"] != request_id:
+            # Same request still pending: confirm it without notifying again
+            emit(
+                "request_sent",
+                {"request_id": req["id"], "to_username": target.username},
+            )
+            return
 
         # Send request notification to target user
-        emit(
+        emit_to_user(
+            socketio,
+            target_sid,
             "incoming_chat_request",
             {
                 "request_id": request_id,
-                "from_sid": request.sid,
-                "from_username": connected_users[request.sid]["username"],
-                "from_ip": connected_users[request.sid]["ip"],
+                "from_sid": sender.sid,
+                "from_username": sender.username,
+                "from_ip": sender.ip,
                 "type": "chat",
             },
-            room=target_sid,
         )
 
         # Confirm request sent to sender
@@ -190,7 +294,7 @@ def register_socket_handlers(app, socketio: SocketIO):
             "request_sent",
             {
                 "request_id": request_id,
-                "to_username": connected_users[target_sid]["username"],
+                "to_username": target.username,
             },
         )
 
@@ -205,7 +309,7 @@ def register_socket_handlers(app, socketio: SocketIO):
             emit("request_error", {"error": "Request not found"})
             return
 
-        req = pending_requests[request_id]
+        req = pending_requests.get(request_id)
         from_sid = req["from_sid"]
         to_sid = req["to_sid"]
 
@@ -214,22 +318,23 @@ def register_socket_handlers(app, socketio: SocketIO):
 
         # Add both users to room
         join_room(room_id)
-        if from_sid in connected_users:
-            connected_users[from_sid]["current_room"] = room_id
-            socketio.server.enter_room(from_sid, room_id)
+        if from_sid in user_registry:
+            user_registry.set_room(from_sid, room_id)
+            socketio.server.enter_room(user_registry.get(from_sid).socket_sid, room_id)
 
-        connected_users[to_sid]["current_room"] = room_id
+        user_registry.set_room(to_sid, room_id)
 
         # Notify both users
-        emit(
+        emit_to_user(
+            socketio,
+            from_sid,
             "chat_request_accepted",
             {
                 "room_id": room_id,
                 "partner_sid": to_sid,
-                "partner_username": connected_users[to_sid]["username"],
-                "partner_ip": connected_users[to_sid]["ip"],
+                "partner_username": user_registry.get(to_sid).username,
+                "partner_ip": user_registry.get(to_sid).ip,
             },
-            room=from_sid,
         )
 
         emit(
@@ -237,13 +342,13 @@ def register_socket_handlers(app, socketio: SocketIO):
             {
                 "room_id": room_id,
                 "partner_sid": from_sid,
-                "partner_username": connected_users[from_sid]["username"],
-                "partner_ip": connected_users[from_sid]["ip"],
+                "partner_username": user_registry.get(from_sid).username,
+                "partner_ip": user_registry.get(from_sid).ip,
             },
         )
 
         # Remove pending request
-        del pending_requests[request_id]
+        pending_requests.pop(request_id)
 
     @socketio.on("reject_chat_request")
     def handle_reject_chat_request(data):
@@ -255,18 +360,19 @@ def register_socket_handlers(app, socketio: SocketIO):
         if request_id not in pending_requests:
             return
 
-        req = pending_requests[request_id]
+        req = pending_requests.get(request_id)
         from_sid = req["from_sid"]
 
         # Notify requester
-        emit(
+        emit_to_user(
+            socketio,
+            from_sid,
             "chat_request_rejected",
-            {"by_username": connected_users[request.sid]["username"]},
-            room=from_sid,
+            {"by_username": user_registry.get(current_sid()).username},
         )
 
         # Remove pending request
-        del pending_requests[request_id]
+        pending_requests.pop(request_id)
 
     @socketio.on("send_private_message")
     def handle_private_message(data):
@@ -280,18 +386,54 @@ def register_socket_handlers(app, socketio: SocketIO):
         if not room_id or not message:
             return
 
+        sid = current_sid()
+        mark_active(socketio, sid)
+        user = user_registry.get(sid)
+        payload = {
+            "from_sid": sid,
+            "from_username": user.username,
+            "message": message,
+            "timestamp": timestamp,
+            "message_id": data.get("messageId"),
+        }
+        # Only members' messages go into the room's history
+        if user.current_room == room_id:
+            payload["seq"] = record_message(room_id, payload)
+
         # Send to room (excluding sender)
-        emit(
-            "receive_private_message",
-            {
-                "from_sid": request.sid,
-                "from_username": connected_users[request.sid]["username"],
-                "message": message,
-                "timestamp": timestamp,
-            },
-            room=room_id,
-            include_self=False,
-        )
+        emit("receive_private_message", payload, room=room_id, include_self=False)
+
+        # Keep it for a partner that is reconnecting
+        for member in user_registry.room_members(room_id):
+            if member != sid:
+                emit_to_user(
+                    socketio,
+                    member,
+                    "receive_private_message",
+                    payload,
+                    queue_only=True,
+                )
+
+    @socketio.on("get_history")
+    def handle_get_history(data=None):
+        """
+        Get one page of the current room's message history, newest first;
+        ``before_seq`` (the previous page's ``nextBeforeSeq``) pages back
+        """
+        data = data or {}
+        room_id = data.get("room_id")
+        user = user_registry.get(current_sid())
+        if not room_id or user is None or user.current_room != room_id:
+            emit("query_failed", {"error": "Not in this room"})
+            return
+
+        try:
+            page = get_history(room_id, data.get("before_seq"), data.get("limit"))
+        except ValueError as e:
+            emit("query_failed", {"error": str(e)})
+            return
+
+        emit("history_page", page)
 
     @socketio.on("start_call")
     def handle_start_call(data):
@@ -301,41 +443,53 @@ def register_socket_handlers(app, socketio: SocketIO):
         target_sid = data.get("target_sid")
         call_type = data.get("call_type", "video")  # 'video' or 'audio'
 
-        if target_sid not in connected_users:
+        target = user_registry.get(target_sid)
+        if target is None:
             emit("call_failed", {"error": "User not available"})
             return
 
         # Check if target is already in a call
-        if connected_users[target_sid].get("in_call"):
+        if target.in_call:
             emit("call_failed", {"error": "User is busy"})
             return
 
+        sender = user_registry.get(current_sid())
+        mark_active(socketio, sender.sid)
+
         # Create call request
         request_id = str(uuid.uuid4())
 
-        pending_requests[request_id] = {
-            "id": request_id,
-            "from_sid": request.sid,
-            "from_username": connected_users[request.sid]["username"],
-            "to_sid": target_sid,
-            "type": call_type,
-            "timestamp": datetime.now().isoformat(),
-        }
+        req = pending_requests.add(
+            {
+                "id": request_id,
+                "from_sid": sender.sid,
+                "from_username": sender.username,
+                "to_sid": target_sid,
+                "type": call_type,
+                "timestamp": datetime.now().isoformat(),
+            },
+            current_app.config["CALL_RING_TIMEOUT"],
+        )
+        if req["id"] != request_id:
+            # Already ringing
+            emit("call_ringing", {"to_username": target.username})
+            return
 
         # Send call request
-        emit(
+        emit_to_user(
+            socketio,
+            target_sid,
             "incoming_call",
             {
                 "request_id": request_id,
-                "from_sid": request.sid,
-                "from_username": connected_users[request.sid]["username"],
-                "from_ip": connected_users[request.sid]["ip"],
+                "from_sid": sender.sid,
+                "from_username": sender.username,
+                "from_ip": sender.ip,
                 "call_type": call_type,
             },
-            room=target_sid,
         )
 
-        emit("call_ringing", {"to_username": connected_users[target_sid]["username"]})
+        emit("call_ringing", {"to_username": target.username})
 
     @socketio.on("accept_call")
     def handle_accept_call(data):
@@ -348,17 +502,18 @@ def register_socket_handlers(app, socketio: SocketIO):
             emit("call_error", {"error": "Call request not found"})
             return
 
-        req = pending_requests[request_id]
+        req = pending_requests.get(request_id)
         from_sid = req["from_sid"]
         to_sid = req["to_sid"]
         call_type = req["type"]
+        mark_active(socketio, to_sid)
 
         # Create call room
         room_id = f"call_{from_sid}_{to_sid}"
 
         # Mark users as in call
-        connected_users[from_sid]["in_call"] = True
-        connected_users[to_sid]["in_call"] = True
+        user_registry.set_call(from_sid, room_id)
+        user_registry.set_call(to_sid, room_id)
 
         # Add to active calls
         active_calls[room_id] = {
@@ -369,13 +524,14 @@ def register_socket_handlers(app, socketio: SocketIO):
 
         # Join call room
         join_room(room_id)
-        socketio.server.enter_room(from_sid, room_id)
+        socketio.server.enter_room(user_registry.get(from_sid).socket_sid, room_id)
 
         # Notify both parties
-        emit(
+        emit_to_user(
+            socketio,
+            from_sid,
             "call_accepted",
             {"room_id": room_id, "partner_sid": to_sid, "call_type": call_type},
-            room=from_sid,
         )
 
         emit(
@@ -384,10 +540,10 @@ def register_socket_handlers(app, socketio: SocketIO):
         )
 
         # Remove pending request
-        del pending_requests[request_id]
+        pending_requests.pop(request_id)
 
-        # Broadcast updated user list
-        broadcast_user_list(socketio)
+        # Broadcast presence changes
+        broadcast_presence(socketio)
 
     @socketio.on("reject_call")
     def handle_reject_call(data):
@@ -399,18 +555,19 @@ def register_socket_handlers(app, socketio: SocketIO):
         if request_id not in pending_requests:
             return
 
-        req = pending_requests[request_id]
+        req = pending_requests.get(request_id)
         from_sid = req["from_sid"]
 
         # Notify caller
-        emit(
+        emit_to_user(
+            socketio,
+            from_sid,
             "call_rejected",
-            {"by_username": connected_users[request.sid]["username"]},
-            room=from_sid,
+            {"by_username": user_registry.get(current_sid()).username},
         )
 
         # Remove pending request
-        del pending_requests[request_id]
+        pending_requests.pop(request_id)
 
     @socketio.on("webrtc_offer")
     def handle_webrtc_offer(data):
@@ -420,11 +577,12 @@ def register_socket_handlers(app, socketio: SocketIO):
         target_sid = data.get("target_sid")
         offer = data.get("offer")
 
-        if target_sid in connected_users:
-            emit(
+        if target_sid in user_registry:
+            emit_to_user(
+                socketio,
+                target_sid,
                 "webrtc_offer",
-                {"from_sid": request.sid, "offer": offer},
-                room=target_sid,
+                {"from_sid": current_sid(), "offer": offer},
             )
 
     @socketio.on("webrtc_answer")
@@ -435,11 +593,12 @@ def register_socket_handlers(app, socketio: SocketIO):
         target_sid = data.get("target_sid")
         answer = data.get("answer")
 
-        if target_sid in connected_users:
-            emit(
+        if target_sid in user_registry:
+            emit_to_user(
+                socketio,
+                target_sid,
                 "webrtc_answer",
-                {"from_sid": request.sid, "answer": answer},
-                room=target_sid,
+                {"from_sid": current_sid(), "answer": answer},
             )
 
     @socketio.on("webrtc_ice_candidate")
@@ -450,11 +609,12 @@ def register_socket_handlers(app, socketio: SocketIO):
         target_sid = data.get("target_sid")
         candidate = data.get("candidate")
 
-        if target_sid in connected_users:
-            emit(
+        if target_sid in user_registry:
+            emit_to_user(
+                socketio,
+                target_sid,
                 "webrtc_ice_candidate",
-                {"from_sid": request.sid, "candidate": candidate},
-                room=target_sid,
+                {"from_sid": current_sid(), "candidate": candidate},
             )
 
     @socketio.on("end_call")
@@ -469,21 +629,21 @@ def register_socket_handlers(app, socketio: SocketIO):
 
             # Mark users as not in call
             for sid in participants:
-                if sid in connected_users:
-                    connected_users[sid]["in_call"] = False
+                if sid in user_registry:
+                    user_registry.set_call(sid, None)
 
             # Notify all participants
             emit(
                 "call_ended",
-                {"ended_by": connected_users[request.sid]["username"]},
+                {"ended_by": user_registry.get(current_sid()).username},
                 room=room_id,
             )
 
             # Remove from active calls
             del active_calls[room_id]
 
-            # Broadcast updated user list
-            broadcast_user_list(socketio)
+            # Broadcast presence changes
+            broadcast_presence(socketio)
 
     @socketio.on("webrtc_end_call")
     def handle_webrtc_end_call(data):
@@ -491,8 +651,8 @@ def register_socket_handlers(app, socketio: SocketIO):
         Notify peer that call has ended
         """
         target_sid = data.get("target_sid")
-        if target_sid:
-            emit("webrtc_call_ended", room=target_sid)
+        if target_sid in user_registry:
+            emit_to_user(socketio, target_sid, "webrtc_call_ended", {})
 
     @socketio.on("leave_chat")
     def handle_leave_chat(data):
@@ -500,15 +660,16 @@ def register_socket_handlers(app, socketio: SocketIO):
         Leave private chat room
         """
         room_id = data.get("room_id")
+        sid = current_sid()
 
-        if room_id and request.sid in connected_users:
+        if room_id and sid in user_registry:
             # Leave room
             leave_room(room_id)
-            connected_users[request.sid]["current_room"] = None
+            user_registry.set_room(sid, None)
 
             # Notify other participant
             emit(
                 "partner_left_chat",
-                {"username": connected_users[request.sid]["username"]},
+                {"username": user_registry.get(sid).username},
                 room=room_id,
             )
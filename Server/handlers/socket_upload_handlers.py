@@ -0,0 +1,237 @@
+"""
+Socket.IO upload handlers
+Streams file chunks as binary frames over the existing socket connection,
+feeding the same upload session store as the HTTP endpoints
+"""
+
+from flask import request, current_app
+from flask_socketio import SocketIO
+
+from models.data_models import socket_uploads
+from services.session_service import current_sid
+from services.chunk_upload_service import (
+    upload_chunk_bytes_service,
+    upload_session_exists,
+    complete_upload_in_thread,
+    complete_upload_async,
+    check_upload_complete,
+    schedule_post_upload_jobs,
+    notify_file_received,
+    try_instant_upload,
+    get_download_url,
+)
+from utils.files.metadata_manager import create_metadata, load_metadata
+from utils.files.file_validation import validate_init_payload
+from utils.files.constants import MAX_CHUNK_SIZE
+
+
+def register_socket_upload_handlers(app, socketio: SocketIO):
+    """
+    Register Socket.IO upload events
+
+    Flow control is ack based: the client keeps at most ``window`` chunks
+    un-acked, sending the next chunk whenever an ack comes back. Chunk
+    writes yield to the event loop, so the server sees every chunk received
+    but not yet acked and turns away the ones beyond the window
+
+    Args:
+        app: Flask application instance
+        socketio: SocketIO instance
+    """
+
+    def open_window(file_id, total_chunks, requested=None):
+        window = current_app.config["SOCKET_UPLOAD_WINDOW"]
+        if requested:
+            window = max(1, min(int(requested), window))
+
+        socket_uploads[file_id] = {
+            "sid": request.sid,
+            "window": window,
+            "total_chunks": total_chunks,
+            "in_flight": 0,
+        }
+        return window
+
+    @socketio.on("file_upload_init")
+    def handle_file_upload_init(data):
+        """
+        Initialize an upload session over Socket.IO
+
+        Expected payload: same as ``POST /api/files/init`` plus an optional
+        ``window`` (max in-flight chunks, capped by the server setting)
+
+        Returns:
+            Ack with success status, fileId and the granted window, or the
+            instant-upload response when the fingerprint is already known
+        """
+        try:
+            error = validate_init_payload(data)
+            if error:
+                return {"success": False, "error": error}
+
+            file_id = data["fileId"]
+            file_name = data["fileName"]
+            file_size = int(data["fileSize"])
+            total_chunks = int(data["totalChunks"])
+
+            # Content the server already holds needs no chunk traffic
+            instant = try_instant_upload(socketio, file_id, data, current_sid())
+            if instant:
+                return instant
+
+            create_metadata(file_id, file_name, file_size, total_chunks, data)
+            window = open_window(file_id, total_chunks, data.get("window"))
+            print(
+                f"Socket upload initialized: {file_name} ({file_size:,} bytes, {total_chunks} chunks, window {window})"
+            )
+
+            return {"success": True, "fileId": file_id, "window": window}
+
+        except ValueError as e:
+            print(f"Socket init upload error (Value): {str(e)}")
+            return {"success": False, "error": "Invalid data format"}
+
+        except Exception as e:
+            print(f"Socket init upload error: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    @socketio.on("file_chunk")
+    def handle_file_chunk(data):
+        """
+        Receive a single binary chunk
+
+        Expected payload:
+        {
+            "fileId": "unique-file-id",
+            "chunkIndex": 0,
+            "totalChunks": 10,
+            "chunk": <binary>
+        }
+
+        Returns:
+            Ack with progress information, or ``retry: True`` when the
+            client overran its window
+        """
+        try:
+            file_id = data.get("fileId")
+            chunk_index = data.get("chunkIndex")
+            chunk = data.get("chunk")
+
+            if not file_id or chunk_index is None or chunk is None:
+                return {"success": False, "error": "Missing required parameters"}
+
+            if not isinstance(chunk, (bytes, bytearray)):
+                return {"success": False, "error": "Chunk must be binary"}
+
+            if len(chunk) > MAX_CHUNK_SIZE:
+                return {"success": False, "error": "Chunk too large"}
+
+            if not upload_session_exists(file_id):
+                return {"success": False, "error": "Upload session not found"}
+
+            # Sessions initialized over HTTP get a default window
+            if file_id not in socket_uploads:
+                open_window(file_id, load_metadata(file_id)["totalChunks"])
+
+            state = socket_uploads[file_id]
+            total_chunks = state["total_chunks"]
+            chunk_index = int(chunk_index)
+            if not 0 <= chunk_index < total_chunks:
+                return {"success": False, "error": "Invalid chunk index"}
+
+            # Chunks received but not acked yet (still being written)
+            if state["in_flight"] >= state["window"]:
+                return {
+                    "success": False,
+                    "error": "Upload window exceeded",
+                    "chunkIndex": chunk_index,
+                    "retry": True,
+                }
+
+            state["in_flight"] += 1
+            try:
+                progress = upload_chunk_bytes_service(
+                    file_id, chunk_index, total_chunks, chunk
+                )
+            finally:
+                state["in_flight"] -= 1
+
+            return {"success": True, **progress}
+
+        except Exception as e:
+            print(f"Socket chunk upload error: {str(e)}")
+            return {"success": False, "error": str(e)}
+
+    @socketio.on("file_upload_complete")
+    def handle_file_upload_complete(data):
+        """
+        Merge the uploaded chunks and notify the recipient
+
+        Expected payload: same as ``POST /api/files/complete``
+
+        Returns:
+            Ack with file information and download URL; with
+            ASYNC_COMPLETE the merge is queued (``status: "processing"``)
+            and ``file_upload_completed`` follows
+        """
+        try:
+            if not data or "fileId" not in data:
+                return {"success": False, "error": "Missing fileId"}
+
+            file_id = data["fileId"]
+
+            notify_options = {
+                "partner_sid": data.get("partnerSid"),
+                "room_id": data.get("roomId"),
+                "recipients": data.get("recipients"),
+                "rooms": data.get("rooms"),
+            }
+
+            if current_app.config["ASYNC_COMPLETE"]:
+                metadata = load_metadata(file_id)
+                error = check_upload_complete(metadata)
+                if error:
+                    return {"success": False, "error": error}
+
+                socket_uploads.pop(file_id, None)
+                job = complete_upload_async(
+                    socketio, file_id, current_sid(), **notify_options
+                )
+                return {
+                    "success": True,
+                    "fileId": file_id,
+                    "status": "processing",
+                    "jobId": job.id if job else None,
+                    "fileName": metadata["fileName"],
+                    "fileSize": metadata["fileSize"],
+                    "fileCategory": metadata.get("fileCategory", "other"),
+                    "downloadUrl": get_download_url(metadata),
+                }
+
+            try:
+                metadata = complete_upload_in_thread(file_id)
+            except ValueError as e:
+                return {"success": False, "error": str(e)}
+
+            socket_uploads.pop(file_id, None)
+
+            schedule_post_upload_jobs(metadata)
+            notify_file_received(
+                socketio, metadata, sender_sid=current_sid(), **notify_options
+            )
+
+            return {
+                "success": True,
+                "fileId": file_id,
+                "fileName": metadata["fileName"],
+                "fileSize": metadata["fileSize"],
+                "fileCategory": metadata.get("fileCategory", "other"),
+                "downloadUrl": get_download_url(metadata),
+            }
+
+        except Exception as e:
+            print(f"Socket upload completion error: {str(e)}")
+            socket_uploads.pop(data.get("fileId"), None)
+            return {"success": False, "error": str(e)}
+
+    print("Socket upload handlers registered successfully")
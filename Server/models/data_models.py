@@ -2,21 +2,9 @@
 Data models and structures for the chat application
 """
 
-from typing import Dict, List, Optional, TypedDict
-
-
-class UserInfo(TypedDict):
-    """
-    User information structure
-    """
-
-    sid: str
-    ip: str
-    username: str
-    status: str
-    connected_at: str
-    current_room: Optional[str]
-    in_call: bool
+from typing import Dict, List, Set, TypedDict
+from models.pending_requests import PendingRequestStore
+from models.user_registry import UserRegistry
 
 
 class ChatRequest(TypedDict):
@@ -31,6 +19,7 @@ class ChatRequest(TypedDict):
     to_sid: str
     type: str  # 'chat', 'video', 'audio'
     timestamp: str
+    expires_at: float  # Epoch seconds, set by PendingRequestStore.add
 
 
 class ActiveCall(TypedDict):
@@ -43,7 +32,36 @@ class ActiveCall(TypedDict):
     started_at: str
 
 
+class SocketUpload(TypedDict):
+    """
+    Flow control state of an upload streamed over Socket.IO
+    """
+
+    sid: str
+    window: int
+    in_flight: int
+
+
+class P2PTransfer(TypedDict):
+    """
+    Peer-to-peer (WebRTC DataChannel) file transfer information structure
+    """
+
+    id: str
+    from_sid: str
+    to_sid: str
+    fileName: str
+    fileSize: int
+    fileType: str
+    state: str  # 'offered', 'negotiating', 'connected', 'completed', 'failed'
+    created_at: str
+
+
 # Global data stores
-connected_users: Dict[str, UserInfo] = {}
-pending_requests: Dict[str, ChatRequest] = {}
+user_registry = UserRegistry()
+pending_requests = PendingRequestStore()
 active_calls: Dict[str, ActiveCall] = {}
+socket_uploads: Dict[str, SocketUpload] = {}
+p2p_transfers: Dict[str, P2PTransfer] = {}
+# Transfer IDs each sid takes part in, as sender or receiver
+p2p_transfers_by_sid: Dict[str, Set[str]] = {}
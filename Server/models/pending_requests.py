@@ -0,0 +1,100 @@
+"""
+Pending chat and call requests
+Requests are indexed by sender and target, deduplicated by (from, to,
+type) and expire after a TTL: a min-heap of deadlines makes each expiry
+sweep proportional to the requests actually due
+"""
+
+import heapq
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class PendingRequestStore:
+    """
+    Pending requests by ID, with sender/target indexes and deadlines
+
+    Requests are ``ChatRequest`` dictionaries (see models/data_models.py);
+    ``add`` sets their ``expires_at``
+    """
+
+    def __init__(self):
+        self._requests: Dict[str, dict] = {}
+        self._by_sid: Dict[str, Set[str]] = {}
+        self._by_key: Dict[Tuple[str, str, str], str] = {}
+        self._deadlines: List[Tuple[float, str]] = []
+
+    def __contains__(self, request_id) -> bool:
+        return request_id in self._requests
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def get(self, request_id: str) -> Optional[dict]:
+        return self._requests.get(request_id)
+
+    def find(self, from_sid: str, to_sid: str, request_type: str) -> Optional[dict]:
+        request_id = self._by_key.get((from_sid, to_sid, request_type))
+        return self._requests.get(request_id) if request_id else None
+
+    def add(self, req: dict, ttl: float) -> dict:
+        """
+        Store a request unless the same one is already pending
+
+        Args:
+            req: Request with ``id``, ``from_sid``, ``to_sid`` and ``type``
+            ttl: Seconds before the request expires
+
+        Returns:
+            dict: The stored request, or the pending duplicate
+        """
+        existing = self.find(req["from_sid"], req["to_sid"], req["type"])
+        if existing:
+            return existing
+
+        req["expires_at"] = time.time() + ttl
+        self._requests[req["id"]] = req
+        self._by_key[(req["from_sid"], req["to_sid"], req["type"])] = req["id"]
+        for sid in (req["from_sid"], req["to_sid"]):
+            self._by_sid.setdefault(sid, set()).add(req["id"])
+        heapq.heappush(self._deadlines, (req["expires_at"], req["id"]))
+        return req
+
+    def pop(self, request_id: str) -> Optional[dict]:
+        """
+        Remove a request (accepted, rejected, expired or cancelled)
+
+        Its heap entry is left behind and skipped when it comes due
+        """
+        req = self._requests.pop(request_id, None)
+        if req is None:
+            return None
+
+        del self._by_key[(req["from_sid"], req["to_sid"], req["type"])]
+        for sid in (req["from_sid"], req["to_sid"]):
+            ids = self._by_sid.get(sid)
+            if ids is not None:
+                ids.discard(request_id)
+                if not ids:
+                    del self._by_sid[sid]
+        return req
+
+    def pop_for_sid(self, sid: str) -> List[dict]:
+        """
+        Remove every request sent by or to a user
+        """
+        return [self.pop(request_id) for request_id in list(self._by_sid.get(sid, ()))]
+
+    def pop_expired(self, now: float = None) -> List[dict]:
+        """
+        Remove the requests whose deadline passed, oldest first
+        """
+        now = time.time() if now is None else now
+        expired = []
+        while self._deadlines and self._deadlines[0][0] <= now:
+            expires_at, request_id = heapq.heappop(self._deadlines)
+            req = self._requests.get(request_id)
+            # Skip entries of requests already gone
+            if req is not None and req["expires_at"] == expires_at:
+                expired.append(self.pop(request_id))
+        return expired
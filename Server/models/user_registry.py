@@ -0,0 +1,445 @@
+"""
+Registry of connected users
+Compact per-user records plus secondary indexes, so presence lookups stay
+O(1) however many clients are connected
+
+Every change visible in user lists (join, leave, rename, call state) gets
+the next presence version and is queued until ``take_changes``, so clients
+can apply deltas in order and spot a gap. Full user lists are served
+from a snapshot rebuilt only when the version moved
+"""
+
+import bisect
+import ipaddress
+import json
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+
+class UserRecord:
+    """
+    Connected user
+
+    ``sid`` is the socket ID the user first connected with and identifies
+    the user for its whole session; ``socket_sid`` is the socket it is
+    currently connected through, which changes when the session is resumed
+    with ``token`` after a reconnect
+    """
+
+    __slots__ = (
+        "sid",
+        "ip",
+        "username",
+        "status",
+        "connected_at",
+        "current_room",
+        "in_call",
+        "current_call",
+        "socket_sid",
+        "token",
+        "disconnected_at",
+        "queued_events",
+        "last_active",
+        "heartbeat_at",
+        "heartbeat_interval",
+    )
+
+    def __init__(self, sid: str, ip: str, username: str):
+        self.sid = sid
+        self.ip = ip
+        self.username = username
+        self.status = "online"
+        self.connected_at = time.time()
+        self.current_room: Optional[str] = None
+        self.in_call = False
+        self.current_call: Optional[str] = None
+        self.socket_sid = sid
+        self.token = secrets.token_urlsafe(24)
+        # Set while the user is in its reconnect grace period
+        self.disconnected_at: Optional[float] = None
+        self.queued_events: List[tuple] = []
+        # Last user interaction, and last heartbeat (None for clients that
+        # send none)
+        self.last_active = self.connected_at
+        self.heartbeat_at: Optional[float] = None
+        # Interval the last heartbeat was answered with
+        self.heartbeat_interval: Optional[int] = None
+
+    def to_dict(self) -> dict:
+        # Public fields, as sent in user lists
+        return {
+            "sid": self.sid,
+            "ip": self.ip,
+            "username": self.username,
+            "status": self.status,
+            "in_call": self.in_call,
+        }
+
+    @property
+    def connected_at_iso(self) -> str:
+        return datetime.fromtimestamp(self.connected_at).isoformat()
+
+
+class PresenceSnapshot:
+    """
+    User list at one presence version, kept for every reader until the
+    next change: the public dicts, each user's position in them and the
+    JSON-encoded ``{"success", "users", "version"}`` HTTP body
+    """
+
+    __slots__ = ("version", "users", "positions", "encoded")
+
+    def __init__(self, version: int, users: List[dict]):
+        self.version = version
+        self.users = users
+        self.positions = {user["sid"]: i for i, user in enumerate(users)}
+        self.encoded = json.dumps(
+            {"success": True, "users": users, "version": version},
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    def users_excluding(self, sid: str) -> List[dict]:
+        # Shares the cached dicts, only the list itself is new
+        position = self.positions.get(sid)
+        if position is None:
+            return self.users
+        return self.users[:position] + self.users[position + 1 :]
+
+
+class UserRegistry:
+    """
+    Connected users by socket ID, indexed by IP, username, room and call
+    state. All mutations go through the registry so the indexes stay in
+    sync with the records and every presence change is versioned
+
+    Two sorted indexes back user queries: ``(casefolded username, sid)``
+    for prefix search and pagination, ``((IP version, IP as int), sid)``
+    for subnet filters. Users not away are also kept in order of last
+    activity, so finding the ones gone idle only visits those
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._changes: List[dict] = []
+        self._snapshot: Optional[PresenceSnapshot] = None
+        self._users: Dict[str, UserRecord] = {}
+        self._by_ip: Dict[str, str] = {}
+        self._by_username: Dict[str, Set[str]] = {}
+        self._rooms: Dict[str, Set[str]] = {}
+        self._in_call: Set[str] = set()
+        self._names: List[Tuple[str, str]] = []
+        self._ips: List[tuple] = []
+        self._by_token: Dict[str, str] = {}
+        self._aliases: Dict[str, str] = {}
+        self._activity: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, sid) -> bool:
+        return sid in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def __iter__(self) -> Iterator[UserRecord]:
+        return iter(self._users.values())
+
+    def get(self, sid: str) -> Optional[UserRecord]:
+        return self._users.get(sid)
+
+    def add(self, sid: str, ip: str, username: str) -> UserRecord:
+        """
+        Register a new connection
+
+        Args:
+            sid: Socket ID
+            ip: Client IP address
+            username: Initial display name
+
+        Returns:
+            UserRecord: The new record
+        """
+        self.remove(sid)
+
+        user = UserRecord(sid, ip, username)
+        self._users[sid] = user
+        self._by_ip[ip] = sid
+        self._by_username.setdefault(username, set()).add(sid)
+        self._by_token[user.token] = sid
+        self._activity[sid] = None
+        bisect.insort(self._names, (username.casefold(), sid))
+        ip_key = _ip_key(ip)
+        if ip_key:
+            bisect.insort(self._ips, (ip_key, sid))
+        self._record("user_joined", sid=sid, user=user.to_dict())
+        return user
+
+    def remove(self, sid: str) -> Optional[UserRecord]:
+        """
+        Unregister a connection
+
+        Returns:
+            UserRecord: The removed record, or None if it was not registered
+        """
+        user = self._users.pop(sid, None)
+        if user is None:
+            return None
+
+        if self._by_ip.get(user.ip) == sid:
+            del self._by_ip[user.ip]
+        del self._by_token[user.token]
+        self._activity.pop(sid, None)
+        self._aliases.pop(user.socket_sid, None)
+        self._discard(self._by_username, user.username, sid)
+        _remove_sorted(self._names, (user.username.casefold(), sid))
+        ip_key = _ip_key(user.ip)
+        if ip_key:
+            _remove_sorted(self._ips, (ip_key, sid))
+        if user.current_room:
+            self._discard(self._rooms, user.current_room, sid)
+        self._in_call.discard(sid)
+        self._record("user_left", sid=sid)
+        return user
+
+    def resolve(self, socket_sid: str) -> str:
+        """
+        Session sid of a socket (differs from the socket ID once the
+        session was resumed on a new socket)
+        """
+        return self._aliases.get(socket_sid, socket_sid)
+
+    def find_by_token(self, token: str) -> Optional[UserRecord]:
+        sid = self._by_token.get(token)
+        return self._users.get(sid) if sid else None
+
+    def attach(self, sid: str, socket_sid: str):
+        """
+        Move a user's session onto a new socket
+        """
+        user = self._users[sid]
+        self._aliases.pop(user.socket_sid, None)
+        user.socket_sid = socket_sid
+        if socket_sid != sid:
+            self._aliases[socket_sid] = sid
+
+    def sid_for_ip(self, ip: str) -> Optional[str]:
+        return self._by_ip.get(ip)
+
+    def sids_for_username(self, username: str) -> Set[str]:
+        return set(self._by_username.get(username, ()))
+
+    def room_members(self, room_id: str) -> Set[str]:
+        return set(self._rooms.get(room_id, ()))
+
+    def users_in_call(self) -> Set[str]:
+        return set(self._in_call)
+
+    def set_username(self, sid: str, username: str):
+        user = self._users[sid]
+        self._discard(self._by_username, user.username, sid)
+        _remove_sorted(self._names, (user.username.casefold(), sid))
+        user.username = username
+        self._by_username.setdefault(username, set()).add(sid)
+        bisect.insort(self._names, (username.casefold(), sid))
+        self._record("user_updated", sid=sid, user=user.to_dict())
+
+    def touch(self, sid: str, active: bool = True, heartbeat: bool = False):
+        """
+        Record a sign of life from a user
+
+        Args:
+            sid: Session sid of the user
+            active: The user interacted (an away user comes back online)
+            heartbeat: The sign of life is a heartbeat; once a client sent
+                one, any other sign of life counts as one too
+        """
+        user = self._users[sid]
+        now = time.time()
+        if heartbeat or user.heartbeat_at is not None:
+            user.heartbeat_at = now
+        if not active:
+            return
+
+        user.last_active = now
+        self._activity[sid] = None
+        self._activity.move_to_end(sid)
+        if user.status == "away":
+            self.set_status(sid, "online")
+
+    def pop_idle(self, idle_since: float) -> List[str]:
+        """
+        Users inactive since before ``idle_since``, oldest first; they are
+        dropped from the activity order until their next activity
+        """
+        idle = []
+        while self._activity:
+            sid = next(iter(self._activity))
+            if self._users[sid].last_active >= idle_since:
+                break
+            del self._activity[sid]
+            idle.append(sid)
+        return idle
+
+    def set_status(self, sid: str, status: str):
+        user = self._users[sid]
+        if user.status == status:
+            return
+        user.status = status
+        self._record("user_updated", sid=sid, user=user.to_dict())
+
+    def set_room(self, sid: str, room_id: Optional[str]):
+        user = self._users[sid]
+        if user.current_room:
+            self._discard(self._rooms, user.current_room, sid)
+        user.current_room = room_id
+        if room_id:
+            self._rooms.setdefault(room_id, set()).add(sid)
+
+    def set_call(self, sid: str, call_id: Optional[str]):
+        """
+        Record the call a user is in (None when it ended)
+
+        Joining or leaving a call counts as activity. Joining also restarts
+        the heartbeat clock: the client only learns the short in-call
+        interval with its next heartbeat ack
+        """
+        user = self._users[sid]
+        user.current_call = call_id
+        in_call = call_id is not None
+        if user.in_call == in_call:
+            return
+
+        now = time.time()
+        user.in_call = in_call
+        if in_call:
+            self._in_call.add(sid)
+            if user.heartbeat_at is not None:
+                user.heartbeat_at = now
+        else:
+            self._in_call.discard(sid)
+        user.last_active = now
+        self._activity[sid] = None
+        self._activity.move_to_end(sid)
+        self._record("user_updated", sid=sid, user=user.to_dict())
+
+    def query(
+        self,
+        prefix: str = "",
+        network=None,
+        status: str = None,
+        after: Tuple[str, str] = None,
+        limit: int = 50,
+        exclude_sid: str = None,
+    ) -> Tuple[List[UserRecord], Optional[Tuple[str, str]]]:
+        """
+        Users in username order, filtered
+
+        Args:
+            prefix: Username prefix, case-insensitive
+            network: ``ipaddress`` network the user's IP must be in
+            status: ``"in_call"``, ``"available"`` (not in a call) or a
+                user status
+            after: Sort key the page starts after (from a previous page)
+            limit: Page size
+            exclude_sid: Socket ID left out of the results
+
+        Returns:
+            tuple: (users, sort key to pass as ``after`` for the next page,
+            or None on the last page)
+        """
+        prefix = prefix.casefold()
+        lower = (prefix, "")
+        if after is not None and after > lower:
+            lower = after
+
+        if network is not None:
+            # Usually the smaller side: sort the subnet's users by name
+            keys = sorted(
+                (self._users[sid].username.casefold(), sid)
+                for sid in self._sids_in_network(network)
+            )
+            keys = keys[bisect.bisect_right(keys, lower) :]
+        else:
+            keys = self._names[bisect.bisect_right(self._names, lower) :]
+
+        page = []
+        for key in keys:
+            if not key[0].startswith(prefix):
+                break
+            if key[1] == exclude_sid:
+                continue
+            user = self._users[key[1]]
+            if status and not _has_status(user, status, self._in_call):
+                continue
+            if len(page) == limit:
+                return page, (page[-1].username.casefold(), page[-1].sid)
+            page.append(user)
+        return page, None
+
+    def snapshot(self) -> PresenceSnapshot:
+        """
+        User list at the current presence version, rebuilt only after a
+        change
+        """
+        if self._snapshot is None or self._snapshot.version != self.version:
+            users = [user.to_dict() for user in self._users.values()]
+            self._snapshot = PresenceSnapshot(self.version, users)
+        return self._snapshot
+
+    def to_list(self, exclude_sid: str = None) -> List[dict]:
+        return self.snapshot().users_excluding(exclude_sid)
+
+    def take_changes(self) -> List[dict]:
+        """
+        Presence changes recorded since the last call, oldest first
+
+        Returns:
+            list: ``{"type", "version", "sid"}`` dictionaries, plus the
+            public ``user`` fields for joins and updates
+        """
+        changes, self._changes = self._changes, []
+        return changes
+
+    def _record(self, change_type: str, **fields):
+        self.version += 1
+        self._changes.append({"type": change_type, "version": self.version, **fields})
+
+    def _sids_in_network(self, network) -> List[str]:
+        start = bisect.bisect_left(
+            self._ips, ((network.version, int(network.network_address)), "")
+        )
+        end = bisect.bisect_left(
+            self._ips, ((network.version, int(network.broadcast_address) + 1), "")
+        )
+        return [sid for _, sid in self._ips[start:end]]
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[str]], key: str, sid: str):
+        members = index.get(key)
+        if members is not None:
+            members.discard(sid)
+            if not members:
+                del index[key]
+
+
+def _ip_key(ip: str):
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    return (address.version, int(address))
+
+
+def _remove_sorted(index: list, key):
+    position = bisect.bisect_left(index, key)
+    if position < len(index) and index[position] == key:
+        del index[position]
+
+
+def _has_status(user: UserRecord, status: str, in_call: Set[str]) -> bool:
+    if status == "in_call":
+        return user.sid in in_call
+    if status == "available":
+        return user.sid not in in_call
+    return user.status == status
@@ -1,8 +1,37 @@
-from utils.files.paths import get_chunk_path
+import hashlib
+import os
+import shutil
+from datetime import datetime
+from eventlet import tpool
+from flask import current_app
+from models.data_models import user_registry
+from services.job_service import job_function, submit_job
+from services.room_files_service import record_room_files
+from services.session_service import emit_to_user
+from utils.files.paths import (
+    get_chunk_path,
+    get_completed_path,
+    get_final_path,
+    get_temp_dir,
+)
+from utils.files.delta import apply_delta
+from utils.files.archive_index import (
+    copy_archive_index,
+    index_archive,
+    indexing_archives,
+)
+from utils.files.text_preview import PREVIEW_CATEGORIES, NotTextError, get_preview
+from utils.files.dedup_store import get_dedup_store, uses_dedup
+from utils.files.blob_store import store_small_file
+from utils.files.content_index import find_content, record_content
+from utils.files.durability import sync_written_file, finalize_file
+from utils.files.storage import open_stored_file, stored_file_size
 from utils.files.metadata_manager import (
+    build_metadata,
     load_metadata,
     save_metadata,
     register_uploaded_chunk,
+    rehydrated_sessions,
 )
 
 
@@ -10,9 +39,31 @@ def upload_chunk_service(file_id, chunk_index, total_chunks, file_storage):
     # Save chunk to disk
     chunk_path = get_chunk_path(file_id, chunk_index)
     file_storage.save(chunk_path)
+    chunk_size = os.path.getsize(chunk_path)
+    sync_written_file(chunk_path, chunk_size)
+
+    return _record_chunk(file_id, chunk_index, total_chunks, chunk_size)
+
+
+def upload_chunk_bytes_service(file_id, chunk_index, total_chunks, chunk: bytes):
+    # Save raw chunk bytes (Socket.IO binary frame) to disk. The write runs
+    # on a tpool thread, so other chunks keep arriving meanwhile; the
+    # metadata update stays on the event loop, one chunk at a time
+    chunk_path = get_chunk_path(file_id, chunk_index)
+    tpool.execute(_write_file, chunk_path, chunk)
+    sync_written_file(chunk_path, len(chunk))
+
+    return _record_chunk(file_id, chunk_index, total_chunks, len(chunk))
+
 
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _record_chunk(file_id, chunk_index, total_chunks, chunk_size):
     metadata = load_metadata(file_id)
-    register_uploaded_chunk(metadata, chunk_index)
+    register_uploaded_chunk(metadata, chunk_index, chunk_size)
     save_metadata(file_id, metadata)
 
     progress = (len(metadata["uploadedChunks"]) / total_chunks) * 100
@@ -26,3 +77,526 @@ def upload_chunk_service(file_id, chunk_index, total_chunks, file_storage):
         "uploadedChunks": len(metadata["uploadedChunks"]),
         "progress": round(progress, 2),
     }
+
+
+def _iter_chunks(file_id, total_chunks):
+    # Yield the contents of every chunk of a session in order
+    for i in range(total_chunks):
+        chunk_path = get_chunk_path(file_id, i)
+
+        # Verify chunk exists
+        if not os.path.exists(chunk_path):
+            raise Exception(f"Missing chunk {i}")
+
+        with open(chunk_path, "rb") as infile:
+            yield infile.read()
+
+
+def upload_session_exists(file_id: str) -> bool:
+    return os.path.exists(get_temp_dir(file_id))
+
+
+def check_upload_complete(metadata: dict):
+    # Error message if some chunks were never uploaded, else None
+    missing = metadata["totalChunks"] - len(metadata["uploadedChunks"])
+    if missing:
+        return f"Missing {missing} chunks"
+    return None
+
+
+@job_function("merge")
+def complete_upload_service(file_id: str) -> dict:
+    """
+    Merge all uploaded chunks of a session into the final file
+    Follow-up work is queued by ``schedule_post_upload_jobs``
+
+    Args:
+        file_id: Unique file identifier
+
+    Returns:
+        dict: Session metadata with the final ``fileSize`` filled in
+
+    Raises:
+        ValueError: If some chunks were never uploaded
+    """
+    temp_dir = get_temp_dir(file_id)
+    metadata = load_metadata(file_id)
+
+    file_name = metadata["fileName"]
+    total_chunks = metadata["totalChunks"]
+
+    # Verify all chunks are uploaded
+    error = check_upload_complete(metadata)
+    if error:
+        raise ValueError(error)
+
+    delta = metadata.get("delta")
+    if delta:
+        print(
+            f"Rebuilding {file_name} from {delta['baseFile']} ({total_chunks} delta chunks)"
+        )
+    else:
+        print(f"Merging {total_chunks} chunks for: {file_name}")
+
+    # Create final file path
+    final_path = get_final_path(file_id, file_name)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+
+    # Merge all chunks into a partial file, published by atomic rename
+    part_path = final_path + ".part"
+    digest = hashlib.sha256()
+    try:
+        with open(part_path, "wb") as outfile:
+
+            def write(data):
+                digest.update(data)
+                outfile.write(data)
+
+            if delta:
+                with open_stored_file(delta["baseFile"]) as base:
+                    apply_delta(
+                        base,
+                        stored_file_size(delta["baseFile"]),
+                        delta["blockSize"],
+                        _iter_chunks(file_id, total_chunks),
+                        write,
+                    )
+            else:
+                for data in _iter_chunks(file_id, total_chunks):
+                    write(data)
+
+        # A delta rebuilt against the wrong base must not be published
+        if delta and delta.get("sha256") and delta["sha256"] != digest.hexdigest():
+            raise ValueError("Delta reconstruction does not match the sha256")
+        if (
+            delta
+            and not delta.get("sha256")
+            and os.path.getsize(part_path) != metadata["fileSize"]
+        ):
+            raise ValueError("Delta reconstruction does not match the file size")
+
+        finalize_file(part_path, final_path)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+    # Verify file size matches expected size
+    final_size = os.path.getsize(final_path)
+    expected_size = metadata["fileSize"]
+
+    if final_size != expected_size:
+        print(f"Warning: Size mismatch! Expected: {expected_size}, Got: {final_size}")
+
+    # Delete temporary directory and chunks
+    shutil.rmtree(temp_dir)
+    rehydrated_sessions.discard(file_id)
+
+    print(f"File upload completed: {file_name} ({final_size:,} bytes)")
+
+    return register_completed_file(metadata, final_path, digest.hexdigest())
+
+
+def register_completed_file(metadata: dict, final_path: str, sha256: str) -> dict:
+    """
+    Make a published file available to the features built on completed
+    files: the content index (instant uploads) and the small file store
+
+    Args:
+        metadata: Session metadata of the file
+        final_path: Path the file was published under
+        sha256: Hex digest of the file
+
+    Returns:
+        dict: ``metadata`` with the final ``fileSize`` and ``sha256``
+    """
+    metadata["fileSize"] = os.path.getsize(final_path)
+    metadata["sha256"] = sha256
+
+    # Make the content available for instant re-sends
+    try:
+        record_content(metadata, final_path)
+    except Exception as e:
+        print(f"Content index error: {str(e)}")
+
+    # Small files go to the blob store instead of their own file
+    try:
+        store_small_file(final_path)
+    except Exception as e:
+        print(f"Blob store error: {str(e)}")
+
+    return metadata
+
+
+@job_function("relay_publish")
+def publish_relay_job(metadata: dict, part_path: str, sha256: str) -> dict:
+    # Publish the tee file of a finished live relay like a merged upload
+    final_path = part_path[: -len(".part")]
+    finalize_file(part_path, final_path)
+    print(f"Relayed file stored: {metadata['fileName']}")
+    return register_completed_file(metadata, final_path, sha256)
+
+
+@job_function("dedup_ingest")
+def ingest_dedup_job(stored_name: str) -> dict:
+    # Move a completed file into the chunk-level dedup engine
+    path = get_completed_path(stored_name)
+    if not os.path.exists(path):
+        # Already ingested, or moved to another tier
+        return {}
+
+    result = get_dedup_store().ingest(stored_name, path)
+    os.remove(path)
+    print(
+        f"Deduplicated {stored_name}: {result['newChunks']}/{result['chunks']} new chunks "
+        f"({result['newBytes']:,} of {result['size']:,} bytes stored)"
+    )
+    return result
+
+
+@job_function("archive_index")
+def index_archive_job(file_id: str, stored_name: str) -> dict:
+    index = index_archive(file_id, stored_name)
+    print(
+        f"Indexed archive {stored_name}: {len(index['entries'])} entries"
+        + (f" ({index['error']})" if index["error"] else "")
+    )
+    return {"entries": len(index["entries"]), "error": index["error"]}
+
+
+@job_function("preview")
+def warm_preview_job(stored_name: str) -> bool:
+    # Build the cached preview ahead of the first request
+    try:
+        get_preview(stored_name)
+    except NotTextError:
+        return False
+    return True
+
+
+def schedule_post_upload_jobs(metadata: dict):
+    """
+    Queue the background work following a completed upload: dedup ingest,
+    archive indexing and preview generation, depending on the category
+    """
+    file_id = metadata["fileId"]
+    stored_name = f"{file_id}_{metadata['fileName']}"
+    category = metadata.get("fileCategory", "other")
+
+    # Chunking is CPU bound; the plain file is served until ingest finishes
+    if uses_dedup(category) and os.path.exists(get_completed_path(stored_name)):
+        submit_job("dedup_ingest", stored_name, key=f"dedup_ingest:{stored_name}")
+
+    # Index the entries of archives so they can be browsed without a download
+    if category == "archives":
+        indexing_archives.add(file_id)
+        submit_job(
+            "archive_index",
+            file_id,
+            stored_name,
+            key=f"archive_index:{file_id}",
+            on_success=lambda _: indexing_archives.discard(file_id),
+            on_failure=lambda _: indexing_archives.discard(file_id),
+        )
+
+    if category in PREVIEW_CATEGORIES:
+        submit_job("preview", stored_name, key=f"preview:{stored_name}")
+
+
+def complete_upload_async(socketio, file_id: str, sender_sid=None, **notify_options):
+    """
+    Queue the merge of an upload session; recipients get ``file_received``
+    and the uploader ``file_upload_completed`` (or ``file_upload_failed``)
+    once it finished
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        file_id: Unique file identifier
+        sender_sid: Session sid (or socket ID) of the uploader
+        **notify_options: ``partner_sid``, ``room_id``, ``recipients``,
+            ``rooms`` for ``notify_file_received``
+
+    Returns:
+        Job: The merge job (an already queued one for the same session)
+    """
+    # The outcome is queued if the uploader is reconnecting meanwhile
+    if sender_sid:
+        sender_sid = user_registry.resolve(sender_sid)
+
+    def on_success(metadata):
+        schedule_post_upload_jobs(metadata)
+        notify_file_received(
+            socketio, metadata, sender_sid=sender_sid, **notify_options
+        )
+        if sender_sid:
+            emit_to_user(
+                socketio,
+                sender_sid,
+                "file_upload_completed",
+                {
+                    "fileId": file_id,
+                    "fileName": metadata["fileName"],
+                    "fileSize": metadata["fileSize"],
+                    "downloadUrl": get_download_url(metadata),
+                },
+            )
+
+    def on_failure(error):
+        if sender_sid:
+            emit_to_user(
+                socketio,
+                sender_sid,
+                "file_upload_failed",
+                {"fileId": file_id, "error": error},
+            )
+
+    return submit_job(
+        "merge",
+        file_id,
+        key=f"merge:{file_id}",
+        on_success=on_success,
+        on_failure=on_failure,
+    )
+
+
+def complete_upload_in_thread(file_id: str) -> dict:
+    """
+    Merge an upload session on a tpool thread and wait for it, for callers
+    that answer only once the file is published (ASYNC_COMPLETE off)
+
+    Raises:
+        ValueError: If the session is incomplete or invalid
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return complete_upload_service(file_id)
+
+    return tpool.execute(run)
+
+
+def instant_upload_service(file_id: str, data: dict):
+    """
+    Complete an upload without any chunk traffic when the server already
+    holds a file with the same fingerprint and size
+
+    Args:
+        file_id: Unique file identifier of the new upload
+        data: Init payload including ``fingerprint``
+
+    Returns:
+        tuple: ("match", metadata) when the upload was completed,
+        ("challenge", challenge) when the client must prove it holds the
+        content, ("sample", None) when the client must confirm with a full
+        hash, (None, None) when a regular upload is needed
+    """
+    file_size = int(data["fileSize"])
+    status, entry = find_content(data.get("fingerprint") or {}, file_size)
+    if status == "challenge":
+        return status, entry
+    if status != "match":
+        return status, None
+
+    metadata = build_metadata(
+        file_id, data["fileName"], file_size, int(data["totalChunks"]), data
+    )
+    metadata["sha256"] = entry["sha256"]
+    metadata["instant"] = True
+
+    # Hard link under the new name; share the existing file where links
+    # are not supported or it is not a plain file (blob or dedup tier)
+    stored_name = f"{file_id}_{metadata['fileName']}"
+    source_name = f"{entry['fileId']}_{entry['fileName']}"
+    try:
+        final_path = get_final_path(file_id, metadata["fileName"])
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.link(get_completed_path(source_name), final_path)
+    except OSError:
+        stored_name = source_name
+        metadata["downloadUrl"] = f"/api/files/download/{stored_name}"
+
+    if metadata["fileCategory"] == "archives":
+        try:
+            copy_archive_index(entry["fileId"], file_id, stored_name)
+        except Exception as e:
+            print(f"Archive index error: {str(e)}")
+
+    print(f"Instant upload: {metadata['fileName']} matches {entry['fileId']}")
+    return status, metadata
+
+
+def try_instant_upload(socketio, file_id: str, data: dict, sender_sid=None):
+    """
+    Handle the ``fingerprint`` of an init payload
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        file_id: Unique file identifier of the new upload
+        data: Init payload
+        sender_sid: Socket ID of the uploader
+
+    Returns:
+        dict: Response for the client, or None when a regular upload
+        session has to be created
+    """
+    if not data.get("fingerprint"):
+        return None
+
+    status, result = instant_upload_service(file_id, data)
+
+    if status == "sample":
+        return {
+            "success": True,
+            "fileId": file_id,
+            "needsFullHash": True,
+            "message": "Sample hash matches, confirm with the full hash",
+        }
+
+    if status == "challenge":
+        return {
+            "success": True,
+            "fileId": file_id,
+            "challenge": result,
+            "message": "Send the init again with the challenge proof",
+        }
+
+    if status != "match":
+        return None
+
+    metadata = result
+    notify_file_received(
+        socketio,
+        metadata,
+        partner_sid=data.get("partnerSid"),
+        room_id=data.get("roomId"),
+        sender_sid=sender_sid,
+    )
+    return {
+        "success": True,
+        "fileId": file_id,
+        "instant": True,
+        "fileName": metadata["fileName"],
+        "fileSize": metadata["fileSize"],
+        "fileCategory": metadata.get("fileCategory", "other"),
+        "downloadUrl": get_download_url(metadata),
+    }
+
+
+def get_download_url(metadata: dict) -> str:
+    return (
+        metadata.get("downloadUrl")
+        or f"/api/files/download/{metadata['fileId']}_{metadata['fileName']}"
+    )
+
+
+def build_file_received_payload(metadata: dict, from_sid) -> dict:
+    """
+    Build the ``file_received`` event payload for a completed upload
+
+    Args:
+        metadata: Completed session metadata
+        from_sid: Socket ID reported as the sender
+
+    Returns:
+        dict: Event payload
+    """
+    file_id = metadata["fileId"]
+    file_name = metadata["fileName"]
+    return {
+        "fileId": file_id,
+        "fileName": file_name,
+        "originalName": metadata.get("originalName", file_name),
+        "fileSize": metadata["fileSize"],
+        "fileType": metadata["fileType"],
+        "fileCategory": metadata.get("fileCategory", "other"),
+        "fileIcon": metadata.get("fileIcon", "📁"),
+        "downloadUrl": get_download_url(metadata),
+        "thumbnail": metadata.get("thumbnail"),
+        "timestamp": datetime.now().isoformat(),
+        "from_sid": from_sid,
+    }
+
+
+def notify_file_received(
+    socketio,
+    metadata: dict,
+    partner_sid=None,
+    room_id=None,
+    sender_sid=None,
+    recipients=None,
+    rooms=None,
+):
+    """
+    Notify the recipients of a completed upload
+
+    A list of recipients and/or rooms (from the call or the session
+    metadata) fans out one ``file_received`` per target from a single
+    upload. Otherwise the partner is notified directly when known, else
+    the whole room is. The file is also added to the gallery of every
+    room involved
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        metadata: Completed session metadata
+        partner_sid: Socket ID of the direct recipient
+        room_id: Room to notify when no partner is given
+        sender_sid: Socket ID of the uploader
+        recipients: Socket IDs to notify
+        rooms: Rooms to notify
+    """
+    recipients = recipients or metadata.get("recipients") or []
+    rooms = rooms or metadata.get("rooms") or []
+
+    if recipients or rooms:
+        # skip_sid takes the uploader's current socket, not its session sid
+        sender = user_registry.get(sender_sid) if sender_sid else None
+        skip_sid = sender.socket_sid if sender else sender_sid
+        # Dedupe while keeping order; every target gets the same payload
+        targets = list(dict.fromkeys([*recipients, *rooms]))
+        socketio.emit(
+            "file_received",
+            build_file_received_payload(metadata, sender_sid),
+            to=targets,
+            skip_sid=skip_sid,
+        )
+        print(f"File notification fanned out to {len(targets)} targets")
+
+    elif partner_sid:
+        socketio.emit(
+            "file_received",
+            build_file_received_payload(metadata, partner_sid),
+            to=partner_sid,
+        )
+        print(f"File notification sent to partner: {partner_sid}")
+
+    elif room_id:
+        socketio.emit(
+            "file_received",
+            build_file_received_payload(metadata, sender_sid),
+            room=room_id,
+        )
+
+    # Keep the file listed in each room's gallery for clients that missed
+    # the notification
+    add_to_galleries(metadata, sender_sid, room_id, rooms)
+
+
+def add_to_galleries(metadata: dict, sender_sid=None, room_id=None, rooms=None):
+    """
+    List a completed file in the gallery of every room it was shared into
+    (the given ones and those of the session metadata)
+    """
+    rooms = rooms or metadata.get("rooms") or []
+    gallery_rooms = list(
+        dict.fromkeys(
+            room for room in [*rooms, room_id, metadata.get("roomId")] if room
+        )
+    )
+    if gallery_rooms:
+        try:
+            record_room_files(
+                gallery_rooms, build_file_received_payload(metadata, sender_sid)
+            )
+        except Exception as e:
+            print(f"Room gallery error: {str(e)}")
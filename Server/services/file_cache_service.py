@@ -0,0 +1,98 @@
+"""
+Shared read cache for completed files
+Keeps recently downloaded small/medium files in a bounded in-memory LRU so
+concurrent downloads of the same hot file (e.g. a fan-out to a whole room)
+are served from memory; large files only get kernel readahead hints
+"""
+
+import os
+import zlib
+from collections import OrderedDict
+from typing import Optional
+
+# Bytes of a large file to ask the kernel to prefetch ahead of send_file
+READAHEAD_BYTES = 8 * 1024 * 1024
+
+
+class FileCache:
+    """
+    Size-bounded LRU of file contents keyed by path
+
+    Entries are validated against the file's size and mtime on every hit,
+    so a replaced file is never served stale
+    """
+
+    def __init__(self, max_bytes: int, max_file_size: int):
+        self.max_bytes = max_bytes
+        self.max_file_size = max_file_size
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, path: str, stat: os.stat_result) -> Optional[bytes]:
+        """
+        Return cached contents of ``path`` (loading them on a miss), or None
+        if the file is too large to be cached
+        """
+        if stat.st_size > self.max_file_size or stat.st_size > self.max_bytes:
+            return None
+
+        version = (stat.st_size, stat.st_mtime_ns)
+        entry = self._entries.get(path)
+        if entry and entry[0] == version:
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        with open(path, "rb") as f:
+            data = f.read()
+
+        self._store(path, version, data)
+        return data
+
+    def invalidate(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry:
+            self.current_bytes -= len(entry[1])
+
+    def _store(self, path, version, data: bytes):
+        self.invalidate(path)
+        self._entries[path] = (version, data)
+        self.current_bytes += len(data)
+
+        # Evict least recently used entries
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.current_bytes -= len(evicted)
+
+
+def file_etag(path: str, stat: os.stat_result) -> str:
+    """
+    ETag for a cached file, identical to the one ``send_file`` generates
+    for the same path, so a download resumed with If-Range still matches
+    whether it is served from the cache or from disk
+    """
+    check = zlib.adler32(path.encode()) & 0xFFFFFFFF
+    return f"{stat.st_mtime}-{stat.st_size}-{check}"
+
+
+def advise_readahead(path: str, size: int):
+    """
+    Hint the kernel to prefetch the head of a large file before streaming it
+
+    No-op on platforms without ``posix_fadvise`` (e.g. Windows)
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            os.posix_fadvise(fd, 0, min(size, READAHEAD_BYTES), os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print(f"Readahead hint failed: {e}")
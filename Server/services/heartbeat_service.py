@@ -0,0 +1,118 @@
+"""
+Application heartbeats and idle detection
+Clients send ``heartbeat`` events at an interval picked per user: short
+while in a call, so a vanished peer ends the call within CALL_DEAD_AFTER
+seconds instead of waiting for the Engine.IO ping timeout, and long once
+the user is idle. Users without activity for AWAY_AFTER seconds become
+"away"; status changes go out through the presence broadcaster
+"""
+
+import time
+from flask_socketio import SocketIO
+from models.data_models import user_registry
+from services.user_service import broadcast_presence, end_user_call
+
+
+def heartbeat_interval(app, user) -> int:
+    """
+    Seconds the client of a user should wait before its next heartbeat
+    """
+    if user.in_call:
+        return app.config["HEARTBEAT_CALL_INTERVAL"]
+    if user.status == "away":
+        return app.config["HEARTBEAT_IDLE_INTERVAL"]
+    return app.config["HEARTBEAT_INTERVAL"]
+
+
+def mark_active(socketio: SocketIO, sid: str, heartbeat: bool = False):
+    """
+    Record an interaction of a user, bringing it back online if away
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        sid: Session sid of the user
+        heartbeat: The interaction came with a heartbeat
+    """
+    was_away = user_registry.get(sid).status == "away"
+    user_registry.touch(sid, heartbeat=heartbeat)
+    if was_away:
+        broadcast_presence(socketio)
+
+
+def record_heartbeat(app, socketio: SocketIO, sid: str, active: bool) -> dict:
+    """
+    Record a heartbeat from a user
+
+    Args:
+        app: Flask application instance
+        socketio: SocketIO instance for emitting events
+        sid: Session sid of the user
+        active: The user interacted since its previous heartbeat
+
+    Returns:
+        dict: ``{"interval": seconds}`` until the next heartbeat
+    """
+    if active:
+        mark_active(socketio, sid, heartbeat=True)
+    else:
+        user_registry.touch(sid, active=False, heartbeat=True)
+
+    user = user_registry.get(sid)
+    user.heartbeat_interval = heartbeat_interval(app, user)
+    return {"interval": user.heartbeat_interval}
+
+
+def sweep(app, socketio: SocketIO, now: float = None):
+    """
+    End the calls of users whose heartbeats stopped and mark idle users
+    away
+    """
+    now = time.time() if now is None else now
+    dead_before = now - app.config["CALL_DEAD_AFTER"]
+    call_interval = app.config["HEARTBEAT_CALL_INTERVAL"]
+    changed = False
+
+    # Only clients already told to beat at the call cadence are judged
+    for sid in user_registry.users_in_call():
+        user = user_registry.get(sid)
+        if user.heartbeat_interval != call_interval:
+            continue
+        if user.heartbeat_at is None or user.heartbeat_at >= dead_before:
+            continue
+        if user.status == "reconnecting":
+            continue
+        print(f"No heartbeat from {user.username} in a call, disconnecting")
+        end_user_call(socketio, user)
+        socketio.server.disconnect(user.socket_sid)
+        changed = True
+
+    # Users in a call are not away; leaving the call restarts their clock
+    for sid in user_registry.pop_idle(now - app.config["AWAY_AFTER"]):
+        user = user_registry.get(sid)
+        if user.status == "online" and not user.in_call:
+            user_registry.set_status(sid, "away")
+            changed = True
+
+    if changed:
+        broadcast_presence(socketio)
+
+
+def monitor_heartbeats(app, socketio: SocketIO):
+    """
+    Background task: sweep every HEARTBEAT_SWEEP_TICK seconds
+    """
+    tick = app.config["HEARTBEAT_SWEEP_TICK"]
+    while True:
+        socketio.sleep(tick)
+        try:
+            with app.app_context():
+                sweep(app, socketio)
+        except Exception as e:
+            print(f"Heartbeat monitor error: {str(e)}")
+
+
+def start_heartbeat_monitor(app, socketio: SocketIO):
+    """
+    Start the heartbeat monitor loop
+    """
+    socketio.start_background_task(monitor_heartbeats, app, socketio)
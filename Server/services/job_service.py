@@ -0,0 +1,382 @@
+"""
+Background job engine for post-upload work
+
+Jobs wait in one priority queue (lower number first) and start while both
+the global JOB_MAX_WORKERS and their type's concurrency limit allow it.
+Scheduling, retries and callbacks run on the event loop; the job itself
+runs either on an eventlet tpool thread ("thread") or in a fresh Python
+process ("process", for CPU-heavy jobs that only talk to other code
+through files or SQLite), so heavy work cannot starve the eventlet hub
+
+Job functions are registered by name with ``@job_function`` and run inside
+an application context. Callbacks (``on_success(result)``,
+``on_failure(error)``) run on the event loop and may emit Socket.IO events
+or submit follow-up jobs; job functions themselves must not
+"""
+
+import heapq
+import itertools
+import os
+import pickle
+import sys
+import time
+import uuid
+from collections import OrderedDict
+from eventlet import patcher, tpool
+from flask_socketio import SocketIO
+
+JOB_STATES = ("queued", "running", "retrying", "succeeded", "failed", "cancelled")
+FINISHED_STATES = ("succeeded", "failed", "cancelled")
+
+# Job type name -> function, filled by the modules defining the jobs
+job_functions = {}
+
+_original_subprocess = patcher.original("subprocess")
+_server_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def job_function(name: str):
+    """
+    Register a function as the body of a job type
+    """
+
+    def decorator(func):
+        job_functions[name] = func
+        return func
+
+    return decorator
+
+
+class JobCancelled(Exception):
+    """
+    Raised inside the runner when a process job is cancelled
+    """
+
+
+class Job:
+    """
+    One unit of background work and its bookkeeping
+    """
+
+    def __init__(self, job_type, args, priority, key, on_success, on_failure):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.args = args
+        self.priority = priority
+        self.key = key
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+        self.state = "queued"
+        self.attempts = 0
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.process = None
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "state": self.state,
+            "priority": self.priority,
+            "attempts": self.attempts,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+class JobEngine:
+    """
+    Priority queue of jobs with per-type concurrency limits
+
+    Args:
+        app: Flask application instance (jobs run in its context)
+        socketio: SocketIO instance, for background tasks
+        max_workers: Jobs running at the same time, all types together
+        job_types: ``{name: {"concurrency", "priority", "retries",
+            "executor"}}``
+        history: Finished jobs kept for the status API
+        retry_delay: Seconds before a retry, multiplied by the attempt
+    """
+
+    def __init__(
+        self,
+        app,
+        socketio: SocketIO,
+        max_workers: int,
+        job_types: dict,
+        history: int,
+        retry_delay: float,
+    ):
+        self.app = app
+        self.socketio = socketio
+        self.max_workers = max_workers
+        self.job_types = job_types
+        self.history = history
+        self.retry_delay = retry_delay
+
+        self.jobs = OrderedDict()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._running = {name: 0 for name in job_types}
+        self._running_total = 0
+        self._active_keys = {}
+
+    def submit(
+        self,
+        job_type: str,
+        *args,
+        priority=None,
+        key=None,
+        on_success=None,
+        on_failure=None,
+    ) -> Job:
+        """
+        Queue a job
+
+        Args:
+            job_type: Registered job type name
+            *args: Arguments of the job function (picklable for process jobs)
+            priority: Overrides the type's default priority
+            key: Deduplication key; while a job with the same key is
+                queued or running it is returned instead of a new one
+            on_success: Called with the job function's result
+            on_failure: Called with the error message of the last attempt
+
+        Returns:
+            Job: The queued (or already active) job
+        """
+        if job_type not in self.job_types or job_type not in job_functions:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+        if key is not None and key in self._active_keys:
+            return self._active_keys[key]
+
+        if priority is None:
+            priority = self.job_types[job_type]["priority"]
+
+        job = Job(job_type, args, priority, key, on_success, on_failure)
+        self.jobs[job.id] = job
+        if key is not None:
+            self._active_keys[key] = job
+
+        self._push(job)
+        self._dispatch()
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a queued job, or a running process job
+
+        Returns:
+            bool: Whether the job was (or will be) cancelled. Running thread
+            jobs cannot be interrupted
+        """
+        job = self.jobs.get(job_id)
+        if not job or job.state in FINISHED_STATES:
+            return False
+
+        if job.state in ("queued", "retrying"):
+            # Lazily dropped from the heap by _dispatch
+            self._finish(job, "cancelled")
+            return True
+
+        if job.process is not None:
+            job.cancel_requested = True
+            job.process.kill()
+            return True
+
+        return False
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def list(self, state=None, job_type=None) -> list:
+        return [
+            job.to_dict()
+            for job in reversed(self.jobs.values())
+            if (state is None or job.state == state)
+            and (job_type is None or job.type == job_type)
+        ]
+
+    def stats(self) -> dict:
+        states = {state: 0 for state in JOB_STATES}
+        for job in self.jobs.values():
+            states[job.state] += 1
+        return {
+            "maxWorkers": self.max_workers,
+            "running": dict(self._running),
+            "states": states,
+        }
+
+    def _push(self, job: Job):
+        heapq.heappush(self._queue, (job.priority, next(self._sequence), job))
+
+    def _dispatch(self):
+        # Start every queued job its limits allow, highest priority first
+        blocked = []
+        while self._queue and self._running_total < self.max_workers:
+            entry = heapq.heappop(self._queue)
+            job = entry[2]
+            if job.state != "queued":
+                continue
+
+            limit = self.job_types[job.type]["concurrency"]
+            if self._running[job.type] >= limit:
+                blocked.append(entry)
+                continue
+
+            job.state = "running"
+            job.started_at = time.time()
+            job.attempts += 1
+            self._running[job.type] += 1
+            self._running_total += 1
+            self.socketio.start_background_task(self._run, job)
+
+        for entry in blocked:
+            heapq.heappush(self._queue, entry)
+
+    def _run(self, job: Job):
+        try:
+            if self.job_types[job.type]["executor"] == "process":
+                result = self._run_in_process(job)
+            else:
+                result = tpool.execute(self._run_in_thread, job)
+            error = None
+        except JobCancelled:
+            error = "Cancelled"
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e)}"
+        finally:
+            job.process = None
+            self._running[job.type] -= 1
+            self._running_total -= 1
+
+        if error is None:
+            self._finish(job, "succeeded")
+            self._callback(job, job.on_success, result)
+        elif job.cancel_requested:
+            self._finish(job, "cancelled")
+        elif job.attempts <= self.job_types[job.type]["retries"]:
+            print(f"Job {job.type} {job.id} failed ({error}), retrying")
+            job.state = "retrying"
+            job.error = error
+            self._dispatch()
+            self.socketio.sleep(self.retry_delay * job.attempts)
+            if job.state == "retrying":
+                job.state = "queued"
+                self._push(job)
+        else:
+            print(f"Job {job.type} {job.id} failed: {error}")
+            job.error = error
+            self._finish(job, "failed")
+            self._callback(job, job.on_failure, error)
+
+        self._dispatch()
+
+    def _run_in_thread(self, job: Job):
+        with self.app.app_context():
+            return job_functions[job.type](*job.args)
+
+    def _run_in_process(self, job: Job):
+        func = job_functions[job.type]
+        config = {}
+        for name, value in self.app.config.items():
+            try:
+                pickle.dumps(value)
+                config[name] = value
+            except Exception:
+                continue
+
+        job.process = _original_subprocess.Popen(
+            [sys.executable, "-m", "services.job_worker"],
+            stdin=_original_subprocess.PIPE,
+            stdout=_original_subprocess.PIPE,
+            env={**os.environ, "PYTHONPATH": _server_dir},
+        )
+        payload = pickle.dumps((func.__module__, func.__name__, job.args, config))
+        output, _ = tpool.execute(job.process.communicate, payload)
+
+        if job.cancel_requested:
+            raise JobCancelled()
+        if job.process.returncode != 0:
+            raise RuntimeError(f"Job process exited with {job.process.returncode}")
+
+        ok, value = pickle.loads(output)
+        if not ok:
+            raise RuntimeError(value)
+        return value
+
+    def _callback(self, job: Job, callback, value):
+        if callback is None:
+            return
+        try:
+            with self.app.app_context():
+                callback(value)
+        except Exception as e:
+            print(f"Job {job.type} {job.id} callback error: {str(e)}")
+
+    def _finish(self, job: Job, state: str):
+        job.state = state
+        job.finished_at = time.time()
+        if job.key is not None and self._active_keys.get(job.key) is job:
+            del self._active_keys[job.key]
+
+        # Forget the oldest finished jobs beyond the history size
+        finished = [j for j in self.jobs.values() if j.state in FINISHED_STATES]
+        for old in finished[: max(0, len(finished) - self.history)]:
+            del self.jobs[old.id]
+
+
+_engine = None
+
+
+def init_job_engine(app, socketio: SocketIO) -> JobEngine:
+    """
+    Create the application's job engine
+    """
+    global _engine
+    _engine = JobEngine(
+        app,
+        socketio,
+        app.config["JOB_MAX_WORKERS"],
+        app.config["JOB_TYPES"],
+        app.config["JOB_HISTORY"],
+        app.config["JOB_RETRY_DELAY"],
+    )
+    return _engine
+
+
+def get_job_engine():
+    return _engine
+
+
+def submit_job(job_type: str, *args, **options):
+    """
+    Submit a job to the application's engine
+
+    Without an engine (scripts, benchmarks) the job runs inline and its
+    callbacks are called right away
+
+    Returns:
+        Job: The job, or None when it ran inline
+    """
+    if _engine is not None:
+        return _engine.submit(job_type, *args, **options)
+
+    try:
+        result = job_functions[job_type](*args)
+    except Exception as e:
+        if options.get("on_failure"):
+            options["on_failure"](str(e))
+        else:
+            raise
+    else:
+        if options.get("on_success"):
+            options["on_success"](result)
+    return None
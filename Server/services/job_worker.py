@@ -0,0 +1,37 @@
+"""
+Entry point of "process" jobs (see services/job_service.py)
+
+Reads ``(module, function, args, config)`` pickled on stdin, runs the
+function inside an application context built from ``config`` and writes
+``(ok, result or error message)`` pickled on stdout. Anything the job
+prints goes to stderr, i.e. the server log
+"""
+
+import importlib
+import pickle
+import sys
+
+from flask import Flask
+
+
+def main():
+    output = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    module, name, args, config = pickle.load(sys.stdin.buffer)
+    app = Flask(__name__)
+    app.config.update(config)
+
+    try:
+        with app.app_context():
+            func = getattr(importlib.import_module(module), name)
+            result = (True, func(*args))
+    except Exception as e:
+        result = (False, f"{type(e).__name__}: {str(e)}")
+
+    pickle.dump(result, output)
+    output.flush()
+
+
+if __name__ == "__main__":
+    main()
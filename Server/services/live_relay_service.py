@@ -0,0 +1,253 @@
+"""
+Live relay between an online sender and receiver
+Pipes the uploader's chunk stream straight into the receiver's download
+stream through a bounded in-memory buffer, without touching the disk
+(unless tee-to-disk is requested for later re-download)
+"""
+
+import hashlib
+import os
+import threading
+from collections import deque
+from typing import Dict, Optional, Set
+
+
+class RelayError(Exception):
+    """
+    Raised when a relay is aborted or one side stalls past the timeout
+    """
+
+
+class LiveRelay:
+    """
+    Bounded single-producer / single-consumer byte buffer
+
+    ``put`` blocks while the buffer is full (backpressure to the uploader),
+    ``get`` blocks while it is empty (backpressure to the downloader)
+    """
+
+    def __init__(
+        self,
+        file_id: str,
+        metadata: dict,
+        capacity: int,
+        tee_path=None,
+        sender_sid=None,
+        receiver_sid=None,
+    ):
+        self.file_id = file_id
+        self.metadata = metadata
+        self.capacity = capacity
+        self.tee_path = tee_path
+        self.sender_sid = sender_sid
+        self.receiver_sid = receiver_sid
+
+        self._chunks = deque()
+        self._buffered = 0
+        self._closed = False
+        self._error: Optional[str] = None
+        self._cond = threading.Condition()
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.reader_attached = False
+        self._tee = open(tee_path + ".part", "wb") if tee_path else None
+        self._digest = hashlib.sha256()
+
+    @property
+    def completed(self) -> bool:
+        """
+        True once the sender pushed its last chunk
+        """
+        return self._closed
+
+    @property
+    def drained(self) -> bool:
+        """
+        True once the sender completed and the receiver read every byte
+        """
+        return self._closed and not self._chunks
+
+    def put(self, chunk: bytes, timeout: float):
+        """
+        Append a chunk, waiting for the receiver to drain the buffer if full
+
+        Raises:
+            RelayError: If the relay was aborted or the receiver stalled
+        """
+        with self._cond:
+            # A chunk larger than the whole buffer is accepted once it is empty
+            ready = self._cond.wait_for(
+                lambda: self._error
+                or self._buffered == 0
+                or self._buffered + len(chunk) <= self.capacity,
+                timeout,
+            )
+            if self._error:
+                raise RelayError(self._error)
+            if not ready:
+                raise RelayError("Receiver stalled")
+            if self._closed:
+                raise RelayError("Relay already completed")
+
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+            self.bytes_in += len(chunk)
+            self._cond.notify_all()
+
+        if self._tee:
+            self._tee.write(chunk)
+            self._digest.update(chunk)
+
+    @property
+    def sha256(self) -> str:
+        # Hex digest of the teed stream
+        return self._digest.hexdigest()
+
+    def get(self, timeout: float) -> Optional[bytes]:
+        """
+        Pop the next chunk, waiting for the sender if the buffer is empty
+
+        Returns:
+            bytes: Next chunk, or None once the sender completed the stream
+
+        Raises:
+            RelayError: If the relay was aborted or the sender stalled
+        """
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._error or self._chunks or self._closed, timeout
+            )
+            if self._error:
+                raise RelayError(self._error)
+            if not ready:
+                raise RelayError("Sender stalled")
+            if not self._chunks:
+                return None
+
+            chunk = self._chunks.popleft()
+            self._buffered -= len(chunk)
+            self.bytes_out += len(chunk)
+            self._cond.notify_all()
+            return chunk
+
+    def close(self):
+        """
+        Mark the end of the stream; closes the tee file if any, which is
+        left as ``tee_path + ".part"`` for the caller to publish
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        if self._tee:
+            self._tee.close()
+            self._tee = None
+
+    def abort(self, reason: str):
+        """
+        Fail both sides of the relay and discard the tee file
+        """
+        with self._cond:
+            self._error = reason
+            self._cond.notify_all()
+
+        if self._tee:
+            self._tee.close()
+            self._tee = None
+            try:
+                os.remove(self.tee_path + ".part")
+            except OSError:
+                pass
+
+
+# Active relays by file ID
+live_relays: Dict[str, LiveRelay] = {}
+# File IDs of the relays each sid sends or receives
+relays_by_sid: Dict[str, Set[str]] = {}
+
+
+def _forget(relay: LiveRelay):
+    if live_relays.get(relay.file_id) is relay:
+        del live_relays[relay.file_id]
+
+    for sid in (relay.sender_sid, relay.receiver_sid):
+        file_ids = relays_by_sid.get(sid)
+        if file_ids is not None:
+            file_ids.discard(relay.file_id)
+            if not file_ids:
+                del relays_by_sid[sid]
+
+
+def create_relay(
+    file_id: str,
+    metadata: dict,
+    capacity: int,
+    tee_path=None,
+    sender_sid=None,
+    receiver_sid=None,
+):
+    """
+    Register a new live relay, replacing any stale one for the same file ID
+    """
+    stale = live_relays.get(file_id)
+    if stale:
+        _forget(stale)
+        stale.abort("Relay replaced")
+
+    relay = LiveRelay(file_id, metadata, capacity, tee_path, sender_sid, receiver_sid)
+    live_relays[file_id] = relay
+    for sid in (sender_sid, receiver_sid):
+        if sid:
+            relays_by_sid.setdefault(sid, set()).add(file_id)
+    return relay
+
+
+def finish_relay(file_id: str):
+    """
+    Close a relay after the sender pushed its last chunk
+
+    The relay stays registered until the receiver drained it
+
+    Returns:
+        LiveRelay: The finished relay, or None if unknown
+    """
+    relay = live_relays.get(file_id)
+    if relay:
+        relay.close()
+    return relay
+
+
+def release_relay(relay: LiveRelay):
+    """
+    Forget a relay once its receiver is done with it
+    """
+    _forget(relay)
+
+
+def abort_relay(file_id: str, reason: str):
+    """
+    Abort and forget a relay
+    """
+    relay = live_relays.get(file_id)
+    if relay:
+        _forget(relay)
+        relay.abort(reason)
+
+
+def abort_relays_for_sid(sid: str):
+    """
+    Abort the relays a departing user sends or receives
+
+    A relay whose sender already completed is left for its receiver to
+    drain
+
+    Args:
+        sid: Session sid of the user that went away
+    """
+    for file_id in list(relays_by_sid.get(sid, ())):
+        relay = live_relays[file_id]
+        if sid == relay.receiver_sid:
+            abort_relay(file_id, "Receiver disconnected")
+        elif not relay.completed:
+            abort_relay(file_id, "Sender disconnected")
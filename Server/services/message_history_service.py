@@ -0,0 +1,263 @@
+"""
+Persistent private message history
+Messages get a per-room sequence number when they are sent and are queued
+for a background writer that inserts them into SQLite in batches, one
+transaction each, so sending a message never waits on the database.
+History is read in pages of sequence numbers, newest first; messages
+still queued are merged into the pages so they are never missing
+"""
+
+import os
+import sqlite3
+import time
+from eventlet import patcher
+from flask import current_app
+
+# The writer is a native thread, so its SQLite work never blocks the hub;
+# the lock is only held for list operations
+_threading = patcher.original("threading")
+
+COLUMNS = (
+    "room_id",
+    "seq",
+    "message_id",
+    "from_sid",
+    "from_username",
+    "message",
+    "timestamp",
+    "created_at",
+)
+
+
+class MessageStore:
+    """
+    Append-only SQLite (WAL) message log keyed by ``(room_id, seq)``
+
+    Args:
+        db_path: Database file
+        batch_size: Queued messages that trigger a write right away
+        batch_interval: Seconds a queued message may wait for its batch
+    """
+
+    def __init__(self, db_path: str, batch_size: int, batch_interval: float):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+        self.db = self._connect()
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "room_id TEXT, seq INTEGER, message_id TEXT, from_sid TEXT,"
+            "from_username TEXT, message TEXT, timestamp TEXT, created_at REAL,"
+            "PRIMARY KEY (room_id, seq)) WITHOUT ROWID"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS messages_from_sid "
+            "ON messages (from_sid, created_at)"
+        )
+        self.db.commit()
+        # The writer has its own connection: WAL lets reads go on meanwhile
+        self._writer_db = self._connect()
+
+        self.batches = 0
+        self.written = 0
+
+        self._next_seq = {}
+        # Queued, then being written: both still visible to readers
+        self._queued = []
+        self._writing = []
+        self._lock = _threading.Lock()
+        self._wake = _threading.Event()
+        self._thread = None
+
+    def append(self, room_id: str, payload: dict) -> int:
+        """
+        Queue a message of a room
+
+        Args:
+            room_id: Room the message was sent to
+            payload: ``receive_private_message`` payload (``from_sid``,
+                ``from_username``, ``message``, ``timestamp`` and the
+                optional ``message_id``)
+
+        Returns:
+            int: Sequence number of the message in its room
+        """
+        with self._lock:
+            seq = self._next_seq.get(room_id)
+            if seq is None:
+                seq = self._last_seq(room_id) + 1
+            self._next_seq[room_id] = seq + 1
+
+            self._queued.append(
+                (
+                    room_id,
+                    seq,
+                    payload.get("message_id"),
+                    payload["from_sid"],
+                    payload["from_username"],
+                    payload["message"],
+                    payload["timestamp"],
+                    time.time(),
+                )
+            )
+            due = len(self._queued) >= self.batch_size
+
+        self._ensure_writer()
+        if due:
+            self._wake.set()
+        return seq
+
+    def history(self, room_id: str, before_seq: int = None, limit: int = 50):
+        """
+        Get one page of a room's messages
+
+        Args:
+            room_id: Room to read
+            before_seq: Only messages older than this sequence number
+                (the newest ones without it)
+            limit: Page size
+
+        Returns:
+            dict: ``{"room_id", "messages" (oldest first), "nextBeforeSeq"}``,
+            ``nextBeforeSeq`` being None on the oldest page
+        """
+        # Snapshot the unwritten messages first: one written meanwhile then
+        # shows up twice at worst, never not at all
+        with self._lock:
+            unwritten = [
+                row
+                for row in self._writing + self._queued
+                if row[0] == room_id and (before_seq is None or row[1] < before_seq)
+            ]
+
+        query = "SELECT * FROM messages WHERE room_id = ?"
+        params = [room_id]
+        if before_seq is not None:
+            query += " AND seq < ?"
+            params.append(before_seq)
+        query += " ORDER BY seq DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = {row[1]: row for row in self.db.execute(query, params)}
+        rows.update((row[1], row) for row in unwritten)
+        page = sorted(rows.values(), key=lambda row: row[1], reverse=True)
+
+        messages = [_row_to_message(row) for row in reversed(page[:limit])]
+        next_before_seq = messages[0]["seq"] if len(page) > limit else None
+        return {
+            "room_id": room_id,
+            "messages": messages,
+            "nextBeforeSeq": next_before_seq,
+        }
+
+    def flush(self):
+        """
+        Write the queued messages as one transaction
+        """
+        with self._lock:
+            if not self._queued or self._writing:
+                return
+            self._writing, self._queued = self._queued, []
+
+        try:
+            self._write(self._writing)
+        except Exception as e:
+            # Put them back in front, a later batch retries
+            print(f"Message history write error: {str(e)}")
+            with self._lock:
+                self._queued = self._writing + self._queued
+                self._writing = []
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.written += len(self._writing)
+            self._writing = []
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._queued) + len(self._writing)
+
+    def _write(self, rows: list):
+        with self._writer_db:
+            self._writer_db.executemany(
+                f"INSERT OR IGNORE INTO messages VALUES "
+                f"({', '.join('?' * len(COLUMNS))})",
+                rows,
+            )
+
+    def _last_seq(self, room_id: str) -> int:
+        row = self.db.execute(
+            "SELECT MAX(seq) FROM messages WHERE room_id = ?", (room_id,)
+        ).fetchone()
+        return row[0] or 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        # WAL commits are atomic either way; NORMAL skips the fsync per commit
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def _ensure_writer(self):
+        if self._thread and self._thread.is_alive():
+            return
+
+        self._thread = _threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.batch_interval)
+            self._wake.clear()
+            self.flush()
+
+
+def _row_to_message(row) -> dict:
+    return dict(zip(COLUMNS[1:7], row[1:7]))
+
+
+_store = None
+
+
+def get_message_store() -> MessageStore:
+    global _store
+    if _store is None:
+        _store = MessageStore(
+            current_app.config["MESSAGE_HISTORY_DB"],
+            current_app.config["MESSAGE_HISTORY_BATCH_SIZE"],
+            current_app.config["MESSAGE_HISTORY_BATCH_INTERVAL_MS"] / 1000,
+        )
+    return _store
+
+
+def record_message(room_id: str, payload: dict) -> int:
+    """
+    Queue a private message for the room's history
+
+    Returns:
+        int: Sequence number of the message in its room
+    """
+    return get_message_store().append(room_id, payload)
+
+
+def get_history(room_id: str, before_seq=None, limit=None) -> dict:
+    """
+    Get one page of a room's history
+
+    Raises:
+        ValueError: If ``before_seq`` or ``limit`` is not a positive integer
+    """
+    default_limit = current_app.config["MESSAGE_HISTORY_PAGE_LIMIT"]
+    max_limit = current_app.config["MESSAGE_HISTORY_MAX_LIMIT"]
+    try:
+        limit = default_limit if limit is None else int(limit)
+        before_seq = None if before_seq is None else int(before_seq)
+    except (TypeError, ValueError):
+        raise ValueError("before_seq and limit must be integers")
+    if limit < 1 or (before_seq is not None and before_seq < 1):
+        raise ValueError("before_seq and limit must be positive")
+
+    return get_message_store().history(room_id, before_seq, min(limit, max_limit))
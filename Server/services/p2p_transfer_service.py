@@ -0,0 +1,175 @@
+"""
+Peer-to-peer file transfer bookkeeping
+Tracks WebRTC DataChannel transfers and falls back to the chunked HTTP
+upload path when the peers fail to connect in time
+"""
+
+import uuid
+from datetime import datetime
+from flask_socketio import SocketIO
+from models.data_models import p2p_transfers, p2p_transfers_by_sid
+
+# States in which the peers have not yet opened the DataChannel
+PENDING_STATES = ("offered", "negotiating")
+
+
+def create_transfer(from_sid: str, to_sid: str, data: dict) -> dict:
+    """
+    Register a new peer-to-peer transfer
+
+    Args:
+        from_sid: Socket ID of the sender
+        to_sid: Socket ID of the receiver
+        data: Offer payload with file information
+
+    Returns:
+        dict: The stored transfer, with a server generated ``id`` (client
+        chosen IDs could collide with, and take over, other transfers)
+
+    Raises:
+        ValueError: If ``fileSize`` is not a non-negative integer
+    """
+    try:
+        file_size = int(data.get("fileSize", 0))
+    except (TypeError, ValueError):
+        raise ValueError("fileSize must be an integer")
+    if file_size < 0:
+        raise ValueError("fileSize must not be negative")
+
+    transfer_id = str(uuid.uuid4())
+    transfer = {
+        "id": transfer_id,
+        "from_sid": from_sid,
+        "to_sid": to_sid,
+        "fileName": data.get("fileName", ""),
+        "fileSize": file_size,
+        "fileType": data.get("fileType", ""),
+        "state": "offered",
+        "created_at": datetime.now().isoformat(),
+    }
+    p2p_transfers[transfer_id] = transfer
+    for sid in (from_sid, to_sid):
+        p2p_transfers_by_sid.setdefault(sid, set()).add(transfer_id)
+    return transfer
+
+
+def remove_transfer(transfer_id: str):
+    """
+    Forget a finished or failed transfer
+
+    Returns:
+        dict: The removed transfer, or None if unknown
+    """
+    transfer = p2p_transfers.pop(transfer_id, None)
+    if not transfer:
+        return None
+
+    for sid in (transfer["from_sid"], transfer["to_sid"]):
+        transfer_ids = p2p_transfers_by_sid.get(sid)
+        if transfer_ids is not None:
+            transfer_ids.discard(transfer_id)
+            if not transfer_ids:
+                del p2p_transfers_by_sid[sid]
+    return transfer
+
+
+def get_peer_sid(transfer: dict, sid: str):
+    """
+    Get the other party of a transfer
+
+    Returns:
+        str: Peer socket ID, or None if ``sid`` is not part of the transfer
+    """
+    if sid == transfer["from_sid"]:
+        return transfer["to_sid"]
+    if sid == transfer["to_sid"]:
+        return transfer["from_sid"]
+    return None
+
+
+def fall_back_to_server(
+    socketio: SocketIO, transfer_id: str, reason: str, departed_sid=None
+):
+    """
+    Abort a peer-to-peer transfer and tell both sides to use the server path
+
+    The sender receives ``p2p_file_fallback`` with the partner sid to pass to
+    ``/api/files/init``; the receiver is told to expect ``file_received``.
+    When the sender itself is gone nothing will be sent, so the receiver
+    gets ``p2p_file_failed`` instead
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        transfer_id: Transfer to abort
+        reason: Human readable failure reason
+        departed_sid: Side that disconnected and is not notified
+    """
+    transfer = remove_transfer(transfer_id)
+    if not transfer:
+        return
+
+    if departed_sid == transfer["from_sid"]:
+        print(f"P2P transfer {transfer_id} failed: {reason}")
+        socketio.emit(
+            "p2p_file_failed",
+            {"transferId": transfer_id, "reason": reason},
+            to=transfer["to_sid"],
+        )
+        return
+
+    print(f"P2P transfer {transfer_id} falling back to server: {reason}")
+
+    payload = {"transferId": transfer_id, "reason": reason, "fallback": "http"}
+    socketio.emit(
+        "p2p_file_fallback",
+        {**payload, "partnerSid": transfer["to_sid"]},
+        to=transfer["from_sid"],
+    )
+    if departed_sid != transfer["to_sid"]:
+        socketio.emit(
+            "p2p_file_fallback",
+            {**payload, "partnerSid": transfer["from_sid"]},
+            to=transfer["to_sid"],
+        )
+
+
+def watch_transfer(
+    socketio: SocketIO, transfer_id: str, timeout: float, transfer_timeout: float
+):
+    """
+    Background task: fall back if the DataChannel is not open in time, or
+    if the transfer is still not complete ``transfer_timeout`` seconds
+    after that (a peer stalled after connecting)
+
+    Args:
+        socketio: SocketIO instance
+        transfer_id: Transfer to watch
+        timeout: Seconds to wait for the peers to connect
+        transfer_timeout: Seconds a connected transfer may take
+    """
+    socketio.sleep(timeout)
+
+    transfer = p2p_transfers.get(transfer_id)
+    if not transfer:
+        return
+    if transfer["state"] in PENDING_STATES:
+        fall_back_to_server(socketio, transfer_id, "Peer connection timed out")
+        return
+
+    socketio.sleep(transfer_timeout)
+    if transfer_id in p2p_transfers:
+        fall_back_to_server(socketio, transfer_id, "Peer transfer timed out")
+
+
+def fail_transfers_for_sid(socketio: SocketIO, sid: str):
+    """
+    Fall back every transfer involving a disconnected user
+
+    Args:
+        socketio: SocketIO instance
+        sid: Socket ID that went away
+    """
+    for transfer_id in list(p2p_transfers_by_sid.get(sid, ())):
+        fall_back_to_server(
+            socketio, transfer_id, "Peer disconnected", departed_sid=sid
+        )
@@ -0,0 +1,79 @@
+"""
+Expiry of pending chat and call requests
+Unanswered requests expire after their TTL (CHAT_REQUEST_TTL, or
+CALL_RING_TIMEOUT for calls) and requests involving a user who
+disconnected are dropped; either way the remaining sides are told
+"""
+
+from flask_socketio import SocketIO
+from models.data_models import pending_requests
+from services.session_service import emit_to_user
+
+
+def close_request(socketio: SocketIO, req: dict, reason: str, departed_sid=None):
+    """
+    Tell both sides a pending request will not be answered
+
+    The sender gets ``request_expired``; the target gets ``call_missed``
+    for calls and ``request_expired`` for chat requests
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        req: The removed request
+        reason: ``"expired"`` or ``"user_left"``
+        departed_sid: Side that disconnected and is not notified
+    """
+    payload = {"request_id": req["id"], "type": req["type"], "reason": reason}
+
+    if req["from_sid"] != departed_sid:
+        emit_to_user(socketio, req["from_sid"], "request_expired", payload)
+
+    if req["to_sid"] != departed_sid:
+        if req["type"] == "chat":
+            emit_to_user(socketio, req["to_sid"], "request_expired", payload)
+        else:
+            emit_to_user(
+                socketio,
+                req["to_sid"],
+                "call_missed",
+                {
+                    **payload,
+                    "from_sid": req["from_sid"],
+                    "from_username": req["from_username"],
+                },
+            )
+
+
+def cancel_requests_for_sid(socketio: SocketIO, sid: str):
+    """
+    Drop the requests sent by or to a disconnected user
+    """
+    for req in pending_requests.pop_for_sid(sid):
+        close_request(socketio, req, "user_left", departed_sid=sid)
+
+
+def expire_requests(app, socketio: SocketIO):
+    """
+    Background task: every REQUEST_EXPIRY_TICK seconds, expire the
+    requests whose deadline passed
+
+    Args:
+        app: Flask application instance
+        socketio: SocketIO instance
+    """
+    tick = app.config["REQUEST_EXPIRY_TICK"]
+    while True:
+        socketio.sleep(tick)
+        try:
+            with app.app_context():
+                for req in pending_requests.pop_expired():
+                    close_request(socketio, req, "expired")
+        except Exception as e:
+            print(f"Request expiry error: {str(e)}")
+
+
+def start_request_expiry(app, socketio: SocketIO):
+    """
+    Start the request expiry loop
+    """
+    socketio.start_background_task(expire_requests, app, socketio)
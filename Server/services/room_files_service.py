@@ -0,0 +1,210 @@
+"""
+Per-room shared files index
+Every completed file shared into a room is recorded incrementally, so
+clients that missed ``file_received`` (offline, reload) can list it later
+"""
+
+import base64
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+
+SORT_COLUMNS = {"time": "created_at", "size": "file_size"}
+
+
+class RoomFileIndex:
+    """
+    SQLite-backed per-room file list with keyset pagination and a
+    response cache invalidated per room on new uploads
+
+    Only first pages are cached (later pages are cheap keyset seeks), at
+    most ``cache_pages`` variants per room
+    """
+
+    def __init__(self, db_path: str, cache_rooms: int, cache_pages: int):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS room_files ("
+            "room_id TEXT, file_id TEXT, file_name TEXT, original_name TEXT,"
+            "file_size INTEGER, file_type TEXT, category TEXT, icon TEXT,"
+            "download_url TEXT, from_sid TEXT, created_at REAL, thumbnail TEXT,"
+            "PRIMARY KEY (room_id, file_id))"
+        )
+        for column in ("created_at", "file_size"):
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS room_files_{column} "
+                f"ON room_files (room_id, {column}, file_id)"
+            )
+            self.db.execute(
+                f"CREATE INDEX IF NOT EXISTS room_files_category_{column} "
+                f"ON room_files (room_id, category, {column}, file_id)"
+            )
+        self.db.commit()
+
+        self.cache_rooms = cache_rooms
+        self.cache_pages = cache_pages
+        self._cache = OrderedDict()
+
+    def add(self, room_id: str, file_data: dict):
+        """
+        Record a file shared into a room and drop the room's cached pages
+
+        Args:
+            room_id: Room the file was shared into
+            file_data: ``file_received`` payload
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO room_files VALUES "
+            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                room_id,
+                file_data["fileId"],
+                file_data["fileName"],
+                file_data["originalName"],
+                file_data["fileSize"],
+                file_data["fileType"],
+                file_data["fileCategory"],
+                file_data["fileIcon"],
+                file_data["downloadUrl"],
+                file_data["from_sid"],
+                time.time(),
+                file_data.get("thumbnail"),
+            ),
+        )
+        self.db.commit()
+        self._cache.pop(room_id, None)
+
+    def list(self, room_id, cursor=None, limit=50, category=None, sort="time"):
+        """
+        Get one page of a room's files, newest or largest first
+
+        Args:
+            room_id: Room to list
+            cursor: Opaque cursor from a previous page
+            limit: Page size
+            category: Only files of this category
+            sort: "time" or "size"
+
+        Returns:
+            dict: ``{"files", "nextCursor"}``
+
+        Raises:
+            ValueError: If the sort key or cursor is invalid
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Invalid sort: {sort}")
+
+        key = (limit, category, sort)
+        pages = self._cache.get(room_id)
+        if not cursor and pages and key in pages:
+            pages.move_to_end(key)
+            self._cache.move_to_end(room_id)
+            return pages[key]
+
+        column = SORT_COLUMNS[sort]
+        query = "SELECT * FROM room_files WHERE room_id = ?"
+        params = [room_id]
+
+        if category:
+            query += " AND category = ?"
+            params.append(category)
+
+        if cursor:
+            value, file_id = decode_cursor(cursor)
+            query += f" AND ({column}, file_id) < (?, ?)"
+            params.extend([value, file_id])
+
+        query += f" ORDER BY {column} DESC, file_id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        rows = self.db.execute(query, params).fetchall()
+        files = [_row_to_file(row) for row in rows[:limit]]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            sort_value = last[10] if sort == "time" else last[4]
+            next_cursor = encode_cursor(sort_value, last[1])
+
+        page = {"files": files, "nextCursor": next_cursor}
+
+        if not cursor:
+            self._cache_page(room_id, key, page)
+
+        return page
+
+    def _cache_page(self, room_id, key, page: dict):
+        pages = self._cache.setdefault(room_id, OrderedDict())
+        pages[key] = page
+        while len(pages) > self.cache_pages:
+            pages.popitem(last=False)
+
+        self._cache.move_to_end(room_id)
+        while len(self._cache) > self.cache_rooms:
+            self._cache.popitem(last=False)
+
+
+def _row_to_file(row) -> dict:
+    return {
+        "fileId": row[1],
+        "fileName": row[2],
+        "originalName": row[3],
+        "fileSize": row[4],
+        "fileType": row[5],
+        "fileCategory": row[6],
+        "fileIcon": row[7],
+        "downloadUrl": row[8],
+        "from_sid": row[9],
+        "timestamp": datetime.fromtimestamp(row[10]).isoformat(),
+        "thumbnail": row[11],
+    }
+
+
+def encode_cursor(value, file_id: str) -> str:
+    raw = json.dumps([value, file_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str):
+    try:
+        value, file_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+    # Sort values are timestamps or sizes
+    if (
+        isinstance(value, bool)
+        or not isinstance(value, (int, float))
+        or not isinstance(file_id, str)
+    ):
+        raise ValueError("Invalid cursor")
+    return value, file_id
+
+
+_index = None
+
+
+def get_room_file_index() -> RoomFileIndex:
+    global _index
+    if _index is None:
+        _index = RoomFileIndex(
+            current_app.config["ROOM_FILES_DB"],
+            current_app.config["ROOM_FILES_CACHE_ROOMS"],
+            current_app.config["ROOM_FILES_CACHE_PAGES"],
+        )
+    return _index
+
+
+def record_room_files(room_ids, file_data: dict):
+    """
+    Add a shared file to the gallery of every room it was shared into
+    """
+    index = get_room_file_index()
+    for room_id in room_ids:
+        index.add(room_id, file_data)
@@ -0,0 +1,48 @@
+"""
+Crash recovery for upload sessions
+Sessions left under the temp folder by a previous run are rehydrated
+lazily on first access (see ``load_metadata``); this module adds an
+optional low-priority background sweep so startup never waits on a scan
+"""
+
+from flask_socketio import SocketIO
+from utils.files.metadata_manager import reconcile_session, rehydrated_sessions
+from utils.files.paths import iter_temp_sessions
+
+
+def recover_sessions(app, socketio: SocketIO):
+    """
+    Background task: reconcile every session not yet touched by a client,
+    yielding to the event loop between sessions
+
+    Args:
+        app: Flask application instance
+        socketio: SocketIO instance
+    """
+    recovered = 0
+    with app.app_context():
+        for file_id, _ in iter_temp_sessions(app.config["UPLOAD_FOLDER"]):
+            if file_id in rehydrated_sessions:
+                continue
+
+            try:
+                reconcile_session(file_id)
+                recovered += 1
+            except FileNotFoundError:
+                # Completed or cleaned up meanwhile, or no metadata
+                pass
+            except Exception as e:
+                print(f"Session recovery error ({file_id}): {str(e)}")
+
+            socketio.sleep(0)
+
+    if recovered:
+        print(f"Upload session recovery finished: {recovered} sessions")
+
+
+def start_session_recovery(app, socketio: SocketIO):
+    """
+    Schedule the recovery sweep without blocking startup
+    """
+    if app.config["UPLOAD_RECOVERY_SWEEP"]:
+        socketio.start_background_task(recover_sessions, app, socketio)
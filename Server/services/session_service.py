@@ -0,0 +1,47 @@
+"""
+Resumable user sessions
+A user keeps the sid it first connected with for its whole session. When
+its socket drops, the session stays for RECONNECT_GRACE seconds (status
+"reconnecting") and can be resumed from a new socket with the token sent
+in ``connection_established``. Events sent to the user meanwhile are
+queued and replayed on resume
+"""
+
+from flask import current_app, request
+from flask_socketio import SocketIO
+from models.data_models import user_registry
+
+
+def current_sid() -> str:
+    """
+    Session sid of the socket handling the current event
+    """
+    return user_registry.resolve(request.sid)
+
+
+def emit_to_user(
+    socketio: SocketIO,
+    sid: str,
+    event: str,
+    data: dict,
+    queue_only: bool = False,
+):
+    """
+    Emit to a user, or queue the event while it is reconnecting
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        sid: Session sid of the user
+        event: Event name
+        data: Event payload
+        queue_only: Only queue, the event already went out some other way
+            (e.g. to a room) to connected users
+    """
+    user = user_registry.get(sid)
+    if user is not None and user.disconnected_at is not None:
+        if len(user.queued_events) < current_app.config["RECONNECT_QUEUE_LIMIT"]:
+            user.queued_events.append((event, data))
+        return
+
+    if not queue_only:
+        socketio.emit(event, data, to=sid)
@@ -1,29 +1,486 @@
 """
 User management and utility functions
+
+Presence changes are not broadcast one by one: they are gathered for a
+short window and sent as one ``presence_delta``, so a reconnect storm
+costs a handful of emits instead of one per client. Every delta carries
+``since``, the version the receiver must already have; a client seeing a
+larger ``since`` than its own version requests a new snapshot
+
+Clients in the presence room get every change. A client can instead
+subscribe to the users it has on screen and only get their changes
 """
 
+import base64
+import ipaddress
+import json
+import time
+from flask import current_app
 from flask_socketio import SocketIO
-from models.data_models import connected_users
+from models.data_models import active_calls, user_registry
+from services.p2p_transfer_service import fail_transfers_for_sid
+from services.live_relay_service import abort_relays_for_sid
+from services.request_service import cancel_requests_for_sid
 
+# Room of the clients receiving every presence change
+PRESENCE_ROOM = "presence"
 
-def broadcast_user_list(socketio: SocketIO):
+
+class PresenceBroadcaster:
     """
-    Broadcast updated user list to all connected clients
+    Coalesces presence changes into at most one broadcast per window
 
     Args:
         socketio: SocketIO instance for emitting events
+        window: Seconds changes are gathered before a flush
+        max_rate: Hard limit of flushes per second, whatever the window
     """
-    users_list = [
-        {
-            "sid": user_info["sid"],
-            "ip": user_info["ip"],
-            "username": user_info["username"],
-            "status": user_info["status"],
-            "in_call": user_info.get("in_call", False),
+
+    def __init__(self, socketio: SocketIO, window: float, max_rate: float):
+        self.socketio = socketio
+        self.window = window
+        self.min_interval = 1.0 / max_rate
+        self._scheduled = False
+        self._last_flush = 0.0
+
+        # Subscribed client -> watched sids, watched sid -> subscribed
+        # clients, subscribed client -> last version sent to it
+        self._subscriptions = {}
+        self._watchers = {}
+        self._sent_versions = {}
+
+        self.flushes = 0
+        self.changes = 0
+        self.last_batch = 0
+        self.max_batch = 0
+
+    def schedule(self):
+        """
+        Flush the pending changes at the end of the current window
+        """
+        if self._scheduled:
+            return
+        self._scheduled = True
+        self.socketio.start_background_task(self._flush_later)
+
+    def flush(self):
+        """
+        Broadcast the presence changes recorded since the last flush
+        """
+        changes = _emit_changes(self.socketio, to=PRESENCE_ROOM)
+        if not changes:
+            return
+
+        version = changes[-1]["version"]
+        relevant = {}
+        for change in changes:
+            for subscriber in self._watchers.get(change["sid"], ()):
+                relevant.setdefault(subscriber, []).append(change)
+        for subscriber, own_changes in relevant.items():
+            self.socketio.emit(
+                "presence_delta",
+                {
+                    "since": self._sent_versions[subscriber],
+                    "version": version,
+                    "changes": own_changes,
+                },
+                to=subscriber,
+            )
+            self._sent_versions[subscriber] = version
+
+        self._last_flush = time.monotonic()
+        self.flushes += 1
+        self.changes += len(changes)
+        self.last_batch = len(changes)
+        self.max_batch = max(self.max_batch, len(changes))
+
+    def subscribe(self, sid: str, watched: set) -> int:
+        """
+        Send a client only the changes of the watched users, instead of
+        every change
+
+        Returns:
+            int: Presence version the subscription starts from
+        """
+        self.unsubscribe(sid)
+        self._subscriptions[sid] = watched
+        for watched_sid in watched:
+            self._watchers.setdefault(watched_sid, set()).add(sid)
+        self._sent_versions[sid] = user_registry.version
+        self.socketio.server.leave_room(sid, PRESENCE_ROOM)
+        return user_registry.version
+
+    def unsubscribe(self, sid: str, rejoin: bool = False):
+        """
+        Drop a client's subscription, optionally putting it back in the
+        presence room
+        """
+        watched = self._subscriptions.pop(sid, None)
+        if watched is None:
+            return
+
+        del self._sent_versions[sid]
+        for watched_sid in watched:
+            subscribers = self._watchers.get(watched_sid)
+            if subscribers is not None:
+                subscribers.discard(sid)
+                if not subscribers:
+                    del self._watchers[watched_sid]
+        if rejoin:
+            self.socketio.server.enter_room(sid, PRESENCE_ROOM)
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "maxFlushRate": 1.0 / self.min_interval,
+            "flushes": self.flushes,
+            "changes": self.changes,
+            "lastBatch": self.last_batch,
+            "maxBatch": self.max_batch,
+            "averageBatch": (
+                round(self.changes / self.flushes, 2) if self.flushes else 0
+            ),
+            "subscribers": len(self._subscriptions),
         }
-        for sid, user_info in connected_users.items()
-    ]
-    socketio.emit("online_users_list", {"users": users_list})
+
+    def _flush_later(self):
+        elapsed = time.monotonic() - self._last_flush
+        self.socketio.sleep(max(self.window, self.min_interval - elapsed))
+        self._scheduled = False
+        self.flush()
+
+
+def _emit_changes(socketio: SocketIO, to: str = None) -> list:
+    changes = user_registry.take_changes()
+    if changes:
+        socketio.emit(
+            "presence_delta",
+            {
+                "since": changes[0]["version"] - 1,
+                "version": changes[-1]["version"],
+                "changes": changes,
+            },
+            to=to,
+        )
+    return changes
+
+
+_broadcaster = None
+
+
+def init_presence_broadcaster(app, socketio: SocketIO) -> PresenceBroadcaster:
+    """
+    Create the application's presence broadcaster
+    """
+    global _broadcaster
+    _broadcaster = PresenceBroadcaster(
+        socketio,
+        app.config["PRESENCE_FLUSH_WINDOW"],
+        app.config["PRESENCE_MAX_FLUSH_RATE"],
+    )
+    return _broadcaster
+
+
+def get_presence_broadcaster():
+    return _broadcaster
+
+
+def broadcast_presence(socketio: SocketIO):
+    """
+    Broadcast the recorded presence changes at the end of the current
+    window (right away when no broadcaster was initialized)
+
+    Args:
+        socketio: SocketIO instance for emitting events
+    """
+    if _broadcaster is not None:
+        _broadcaster.schedule()
+    else:
+        _emit_changes(socketio)
+
+
+def subscribe_presence(sid: str, sids: list) -> dict:
+    """
+    Subscribe a client to the presence of the given users only
+
+    Args:
+        sid: Socket ID of the subscribing client
+        sids: Socket IDs of the users it shows
+
+    Returns:
+        dict: ``users`` (those of them online) and the ``version`` the
+        following deltas build on
+
+    Raises:
+        ValueError: If too many users are watched
+    """
+    if len(sids) > current_app.config["PRESENCE_MAX_WATCHED"]:
+        raise ValueError(
+            f"At most {current_app.config['PRESENCE_MAX_WATCHED']} users can be watched"
+        )
+
+    watched = set(sids)
+    version = _broadcaster.subscribe(sid, watched)
+    users = [user_registry.get(s).to_dict() for s in watched if s in user_registry]
+    return {"users": users, "version": version}
+
+
+def unsubscribe_presence(sid: str, rejoin: bool = False):
+    """
+    Drop a client's presence subscription (on disconnect, or to get every
+    change again with ``rejoin``)
+    """
+    if _broadcaster is not None:
+        _broadcaster.unsubscribe(sid, rejoin=rejoin)
+
+
+def query_online_users(
+    prefix: str = "",
+    subnet: str = None,
+    status: str = None,
+    cursor: str = None,
+    limit=None,
+    exclude_sid: str = None,
+) -> dict:
+    """
+    One page of online users in username order
+
+    Args:
+        prefix: Username prefix, case-insensitive
+        subnet: Only users whose IP is in this network (e.g. 10.0.3.0/24)
+        status: ``in_call``, ``available`` or a user status
+        cursor: ``nextCursor`` of the previous page
+        limit: Page size
+        exclude_sid: Socket ID left out of the results (the requester)
+
+    Returns:
+        dict: ``users``, ``nextCursor`` (None on the last page) and the
+        presence ``version``
+
+    Raises:
+        ValueError: If a parameter is invalid
+    """
+    max_limit = current_app.config["USER_QUERY_MAX_LIMIT"]
+    if limit is None:
+        limit = current_app.config["USER_QUERY_DEFAULT_LIMIT"]
+    limit = int(limit)
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f"limit must be between 1 and {max_limit}")
+
+    network = None
+    if subnet:
+        try:
+            network = ipaddress.ip_network(subnet, strict=False)
+        except ValueError:
+            raise ValueError(f"Invalid subnet: {subnet}")
+
+    after = None
+    if cursor:
+        try:
+            after = tuple(json.loads(base64.urlsafe_b64decode(cursor.encode())))
+        except Exception:
+            raise ValueError("Invalid cursor")
+        # A cursor is the (casefolded username, sid) key of the last user
+        if len(after) != 2 or not all(isinstance(part, str) for part in after):
+            raise ValueError("Invalid cursor")
+
+    users, next_key = user_registry.query(
+        prefix or "", network, status, after, limit, exclude_sid
+    )
+    next_cursor = None
+    if next_key:
+        next_cursor = base64.urlsafe_b64encode(json.dumps(next_key).encode()).decode()
+
+    return {
+        "users": [user.to_dict() for user in users],
+        "nextCursor": next_cursor,
+        "version": user_registry.version,
+    }
+
+
+def remove_user(socketio: SocketIO, sid: str):
+    """
+    Tear down everything a departing user takes part in, then unregister
+    it
+
+    Only the user's own state is visited, through the reverse indexes:
+    its private chat room and the members of that room, its current call,
+    the requests it sent or received, its P2P transfers and live relays.
+    The presence changes (partner leaving the call, user leaving) are
+    queued for the next ``broadcast_presence``
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        sid: Socket ID of the departing user
+
+    Returns:
+        UserRecord: The removed user, or None if it was not registered
+    """
+    user = user_registry.get(sid)
+    if user is None:
+        return None
+
+    room_id = user.current_room
+    if room_id:
+        socketio.emit(
+            "user_left_room",
+            {"user": user.username, "sid": sid},
+            to=room_id,
+            skip_sid=user.socket_sid,
+        )
+        socketio.emit(
+            "partner_left_chat",
+            {"username": user.username, "room_id": room_id},
+            to=room_id,
+            skip_sid=user.socket_sid,
+        )
+        for member in user_registry.room_members(room_id):
+            socketio.server.leave_room(user_registry.get(member).socket_sid, room_id)
+            user_registry.set_room(member, None)
+
+    end_user_call(socketio, user, departing=True)
+
+    cancel_requests_for_sid(socketio, sid)
+    fail_transfers_for_sid(socketio, sid)
+    abort_relays_for_sid(sid)
+    unsubscribe_presence(user.socket_sid)
+    return user_registry.remove(sid)
+
+
+def end_user_call(socketio: SocketIO, user, departing: bool = False):
+    """
+    End the call a user is in; the other participants get ``call_ended``
+
+    Args:
+        socketio: SocketIO instance for emitting events
+        user: UserRecord of the user
+        departing: The user's record is about to be removed and is left as
+            is
+    """
+    call_id = user.current_call
+    call = active_calls.pop(call_id, None) if call_id else None
+    if not call:
+        return
+
+    socketio.emit(
+        "call_ended",
+        {"ended_by": user.username},
+        to=call_id,
+        skip_sid=user.socket_sid,
+    )
+    for participant in call["participants"]:
+        if departing and participant == user.sid:
+            continue
+        if participant in user_registry:
+            user_registry.set_call(participant, None)
+            socketio.server.leave_room(
+                user_registry.get(participant).socket_sid, call_id
+            )
+
+
+def suspend_user(socketio: SocketIO, sid: str):
+    """
+    Keep a disconnected user's session for RECONNECT_GRACE seconds
+
+    The user shows as "reconnecting" and keeps its chat room, call and
+    requests; it is removed (see ``remove_user``) if it does not resume
+    in time
+
+    Args:
+        socketio: SocketIO instance
+        sid: Session sid of the user
+    """
+    user = user_registry.get(sid)
+    user.disconnected_at = time.time()
+    unsubscribe_presence(user.socket_sid)
+    user_registry.set_status(sid, "reconnecting")
+    socketio.start_background_task(
+        _expire_suspended,
+        current_app._get_current_object(),
+        socketio,
+        sid,
+        user.disconnected_at,
+    )
+
+
+def resume_user(socketio: SocketIO, user, socket_sid: str):
+    """
+    Reattach a reconnecting user's session to its new socket
+
+    The socket joins the rooms of the session (its sid, chat room, call
+    room and the presence room) and receives the events queued meanwhile.
+    A presence subscription of the old socket is dropped: the new one gets
+    every change until it subscribes again. An old socket still connected
+    (a reloaded page) is disconnected once the session moved off it
+
+    Args:
+        socketio: SocketIO instance
+        user: UserRecord of the reconnecting user
+        socket_sid: Socket ID of the new connection
+    """
+    previous_sid = user.socket_sid
+    unsubscribe_presence(previous_sid)
+    user_registry.attach(user.sid, socket_sid)
+    if user.disconnected_at is None:
+        # Its disconnect is then ignored as that of a stale socket
+        socketio.server.disconnect(previous_sid)
+
+    for room in (user.sid, user.current_room, user.current_call, PRESENCE_ROOM):
+        if room and room != socket_sid:
+            socketio.server.enter_room(socket_sid, room)
+
+    user.disconnected_at = None
+    user_registry.set_status(user.sid, "online")
+    user_registry.touch(user.sid)
+
+    queued, user.queued_events = user.queued_events, []
+    for event, data in queued:
+        socketio.emit(event, data, to=socket_sid)
+
+
+def get_user_chat(user):
+    """
+    Get the private chat a user is in, shaped like ``chat_started``
+
+    Returns:
+        dict: ``room_id``, ``partner_sid``, ``partner_username`` and
+        ``partner_ip``, or None if the user is in no chat
+    """
+    room_id = user.current_room
+    partners = user_registry.room_members(room_id) - {user.sid} if room_id else None
+    if not partners:
+        return None
+
+    partner = user_registry.get(next(iter(partners)))
+    return {
+        "room_id": room_id,
+        "partner_sid": partner.sid,
+        "partner_username": partner.username,
+        "partner_ip": partner.ip,
+    }
+
+
+def _expire_suspended(app, socketio: SocketIO, sid: str, disconnected_at: float):
+    socketio.sleep(app.config["RECONNECT_GRACE"])
+    user = user_registry.get(sid)
+    # Resumed, or disconnected again since (with its own timer)
+    if user is None or user.disconnected_at != disconnected_at:
+        return
+
+    with app.app_context():
+        remove_user(socketio, sid)
+        broadcast_presence(socketio)
+
+
+def get_presence_snapshot():
+    """
+    Get the cached user list at the current presence version
+
+    Returns:
+        PresenceSnapshot: Shared by socket and HTTP readers, must not be
+        modified
+    """
+    return user_registry.snapshot()
 
 
 def get_user_list(exclude_sid: str = None):
@@ -36,16 +493,4 @@ def get_user_list(exclude_sid: str = None):
     Returns:
         list: List of user dictionaries
     """
-    users_list = [
-        {
-            "sid": user_info["sid"],
-            "ip": user_info["ip"],
-            "username": user_info["username"],
-            "status": user_info["status"],
-            "in_call": user_info.get("in_call", False),
-        }
-        for sid, user_info in connected_users.items()
-        if sid != exclude_sid  # Exclude self if specified
-    ]
-
-    return users_list
+    return user_registry.to_list(exclude_sid=exclude_sid)
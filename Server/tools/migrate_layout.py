@@ -0,0 +1,100 @@
+"""
+Move a flat uploads store into the sharded layout (see utils/files/paths.py)
+
+Safe to run while the server is up: every entry is moved with one atomic
+rename and the server resolves both layouts. Temp sessions that received
+a chunk recently are left in place (they keep working from the flat
+layout) and are picked up by a later run
+
+Usage (from the Server directory):
+    python -m tools.migrate_layout [--idle-seconds 300] [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.settings import Config
+from utils.files.paths import get_sharded_path, is_shard_dir
+
+# Files being written next to their final name
+PARTIAL_SUFFIXES = (".part", ".tmp")
+
+
+def _move(path: str, target: str, dry_run: bool) -> bool:
+    if os.path.exists(target):
+        print(f"  skipped, already in the sharded layout: {target}")
+        return False
+
+    if not dry_run:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.rename(path, target)
+    return True
+
+
+def _last_activity(path: str) -> float:
+    # Latest mtime of a session directory and its files
+    latest = os.stat(path).st_mtime
+    with os.scandir(path) as entries:
+        for entry in entries:
+            latest = max(latest, entry.stat().st_mtime)
+    return latest
+
+
+def migrate_completed(folder: str, dry_run: bool) -> int:
+    moved = 0
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.endswith(PARTIAL_SUFFIXES):
+                continue
+            if _move(entry.path, get_sharded_path(folder, entry.name), dry_run):
+                moved += 1
+    return moved
+
+
+def migrate_temp(folder: str, idle_seconds: int, dry_run: bool) -> tuple:
+    moved = active = 0
+    now = time.time()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if not entry.is_dir() or is_shard_dir(entry.name):
+                continue
+
+            try:
+                if now - _last_activity(entry.path) < idle_seconds:
+                    active += 1
+                    continue
+            except FileNotFoundError:
+                # Completed or cleaned up meanwhile
+                continue
+
+            if _move(entry.path, get_sharded_path(folder, entry.name), dry_run):
+                moved += 1
+    return moved, active
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--idle-seconds",
+        type=int,
+        default=300,
+        help="Only move temp sessions idle for at least this long",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    completed = migrate_completed(Config.COMPLETED_FOLDER, args.dry_run)
+    temp, active = migrate_temp(Config.UPLOAD_FOLDER, args.idle_seconds, args.dry_run)
+
+    action = "Would move" if args.dry_run else "Moved"
+    print(f"{action} {completed} completed files and {temp} temp sessions")
+    if active:
+        print(f"{active} active temp sessions left in place, run again later")
+
+
+if __name__ == "__main__":
+    main()
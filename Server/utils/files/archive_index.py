@@ -0,0 +1,301 @@
+"""
+Archive content index
+
+The entry list (central directory for ZIP, member headers for TAR, header
+database for 7z) of completed archives is read once by a background job and
+stored as JSON, so recipients can browse an archive and pull single entries
+without downloading it
+
+7z support needs the optional ``py7zr`` package; RAR is not supported
+"""
+
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from datetime import datetime
+from eventlet import tpool
+from flask import current_app
+from .storage import open_stored_file
+
+try:
+    import py7zr
+except ImportError:  # 7z listing is optional
+    py7zr = None
+
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+SEVEN_ZIP_MAGIC = b"7z\xbc\xaf\x27\x1c"
+COMPRESSED_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+# Archives queued or being indexed (by file ID)
+indexing_archives = set()
+
+
+def _index_path(file_id: str) -> str:
+    if os.path.basename(file_id) != file_id:
+        raise ValueError("Invalid file ID")
+    return os.path.join(current_app.config["ARCHIVE_INDEX_FOLDER"], f"{file_id}.json")
+
+
+def _detect_format(f):
+    header = f.read(8)
+    f.seek(0)
+    if header.startswith(ZIP_MAGIC):
+        return "zip"
+    if header.startswith(SEVEN_ZIP_MAGIC):
+        return "7z"
+    try:
+        with tarfile.open(fileobj=f, mode="r:*"):
+            pass
+    except tarfile.TarError:
+        return None
+    finally:
+        f.seek(0)
+    return "tar.compressed" if header.startswith(COMPRESSED_MAGIC) else "tar"
+
+
+def _zip_time(date_time):
+    try:
+        return datetime(*date_time).isoformat()
+    except ValueError:
+        return None
+
+
+def _list_zip(f, max_entries):
+    with zipfile.ZipFile(f) as archive:
+        for info in archive.infolist()[:max_entries]:
+            yield {
+                "name": info.filename,
+                "size": info.file_size,
+                "compressedSize": info.compress_size,
+                "isDir": info.is_dir(),
+                "modified": _zip_time(info.date_time),
+                "encrypted": bool(info.flag_bits & 0x1),
+            }
+
+
+def _list_tar(f, max_entries):
+    with tarfile.open(fileobj=f, mode="r:*") as archive:
+        for i, member in enumerate(archive):
+            if i >= max_entries:
+                break
+            yield {
+                "name": member.name,
+                "size": member.size if member.isfile() else 0,
+                "compressedSize": None,
+                "isDir": member.isdir(),
+                "modified": datetime.fromtimestamp(member.mtime).isoformat(),
+                "encrypted": False,
+                # Start of the member's data, for direct reads from plain tars
+                "offset": member.offset_data,
+                "isFile": member.isfile(),
+            }
+
+
+def _list_7z(f, max_entries):
+    with py7zr.SevenZipFile(f, "r") as archive:
+        for info in archive.list()[:max_entries]:
+            yield {
+                "name": info.filename,
+                "size": info.uncompressed or 0,
+                "compressedSize": info.compressed,
+                "isDir": info.is_directory,
+                "modified": (
+                    info.creationtime.isoformat() if info.creationtime else None
+                ),
+                "encrypted": False,
+            }
+
+
+def index_archive(file_id: str, stored_name: str) -> dict:
+    """
+    Read the entry list of a completed archive and store it
+
+    Args:
+        file_id: Unique file identifier
+        stored_name: Stored name of the archive (fileId_fileName)
+
+    Returns:
+        dict: The stored index (``format``, ``entries``, ``truncated``,
+        ``error`` when the format is not supported)
+    """
+    max_entries = current_app.config["ARCHIVE_MAX_ENTRIES"]
+    index = {
+        "fileId": file_id,
+        "fileName": stored_name,
+        "format": None,
+        "entries": [],
+        "truncated": False,
+        "error": None,
+    }
+
+    with open_stored_file(stored_name) as f:
+        archive_format = _detect_format(f)
+        listers = {
+            "zip": _list_zip,
+            "tar": _list_tar,
+            "tar.compressed": _list_tar,
+            "7z": _list_7z if py7zr else None,
+        }
+        lister = listers.get(archive_format)
+
+        index["format"] = archive_format
+        if lister is None:
+            index["error"] = "Unsupported archive format"
+        else:
+            index["entries"] = list(lister(f, max_entries + 1))
+            if len(index["entries"]) > max_entries:
+                index["entries"].pop()
+                index["truncated"] = True
+
+    _save_index(index)
+    return index
+
+
+def _save_index(index: dict):
+    index_path = _index_path(index["fileId"])
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+
+
+def load_archive_index(file_id: str):
+    """
+    Get the stored index of an archive
+
+    Returns:
+        dict: The index, or None if the archive was not indexed (yet)
+    """
+    try:
+        with open(_index_path(file_id), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def copy_archive_index(source_file_id: str, file_id: str, stored_name: str):
+    """
+    Reuse the index of identical content for an instant upload
+
+    Returns:
+        bool: Whether the source archive had an index
+    """
+    index = load_archive_index(source_file_id)
+    if index is None:
+        return False
+
+    index["fileId"] = file_id
+    index["fileName"] = stored_name
+    _save_index(index)
+    return True
+
+
+def _read_blocks(f, block_size: int, size=None):
+    # Every read (and the decompression behind it) runs on a tpool thread
+    while size is None or size > 0:
+        data = tpool.execute(
+            f.read, block_size if size is None else min(size, block_size)
+        )
+        if not data:
+            break
+        if size is not None:
+            size -= len(data)
+        yield data
+
+
+def _open_zip_entry(f, position: int):
+    archive = zipfile.ZipFile(f)
+    return archive, archive.open(archive.infolist()[position])
+
+
+def _open_tar_member(f, position: int):
+    # Streaming mode decompresses every member before the wanted one
+    archive = tarfile.open(fileobj=f, mode="r|*")
+    for i, member in enumerate(archive):
+        if i == position:
+            return archive, archive.extractfile(member)
+    return archive, None
+
+
+def _extract_7z(f, temp_dir: str, name: str):
+    with py7zr.SevenZipFile(f, "r") as archive:
+        archive.extract(path=temp_dir, targets=[name])
+    return open(_extracted_path(temp_dir, name), "rb")
+
+
+def safe_member_name(name: str) -> str:
+    """
+    Normalize an archive member name for extraction
+
+    Raises:
+        ValueError: If the name is absolute or leads out of the extraction
+            directory
+    """
+    member = os.path.normpath(name)
+    if os.path.isabs(member) or member == ".." or member.startswith(".." + os.sep):
+        raise ValueError("Invalid archive entry name")
+    return member
+
+
+def _extracted_path(temp_dir: str, name: str) -> str:
+    # Member names come from the archive: never follow one out of temp_dir
+    root = os.path.realpath(temp_dir)
+    path = os.path.realpath(os.path.join(root, safe_member_name(name)))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError("Invalid archive entry name")
+    return path
+
+
+def iter_entry(index: dict, position: int, block_size=1024 * 1024):
+    """
+    Yield the decompressed contents of one archive entry
+
+    Only the entry is read: ZIP entries are decompressed on their own,
+    plain TAR members are read straight from their offset, compressed TARs
+    are decompressed up to the member. 7z entries are extracted to a
+    temporary directory first (solid blocks cannot be read in isolation).
+    Decompression and extraction run on tpool threads, never on the hub
+
+    Args:
+        index: Stored archive index
+        position: Position of the entry in ``index["entries"]``
+        block_size: Size of the yielded blocks
+    """
+    archive_format = index["format"]
+
+    with open_stored_file(index["fileName"]) as f:
+        if archive_format == "zip":
+            archive, entry = tpool.execute(_open_zip_entry, f, position)
+            with archive, entry:
+                yield from _read_blocks(entry, block_size)
+
+        elif archive_format == "tar":
+            entry = index["entries"][position]
+            f.seek(entry["offset"])
+            yield from _read_blocks(f, block_size, entry["size"])
+
+        elif archive_format == "tar.compressed":
+            archive, entry = tpool.execute(_open_tar_member, f, position)
+            with archive:
+                if entry is not None:
+                    yield from _read_blocks(entry, block_size)
+
+        elif archive_format == "7z":
+            if py7zr is None:
+                raise ValueError("7z support needs the py7zr package")
+
+            name = index["entries"][position]["name"]
+            temp_dir = tempfile.mkdtemp()
+            try:
+                entry = tpool.execute(_extract_7z, f, temp_dir, name)
+                with entry:
+                    yield from _read_blocks(entry, block_size)
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+        else:
+            raise ValueError("Unsupported archive format")
@@ -0,0 +1,127 @@
+"""
+Embedded blob store for small completed files
+
+Files up to SMALL_FILE_THRESHOLD bytes are kept as BLOBs in one SQLite
+database instead of one file each in COMPLETED_FOLDER, so the directory
+(and every lookup in it) stays small. Larger files stay on the filesystem
+"""
+
+import os
+import sqlite3
+import time
+from eventlet import patcher
+from flask import current_app
+from .durability import get_durability_mode
+
+# SQLite commit durability matching each DURABILITY_MODE
+SYNCHRONOUS = {"none": "OFF", "batched": "NORMAL", "strict": "FULL"}
+
+# Merge jobs store files from native threads, downloads read on the event loop
+_threading = patcher.original("threading")
+
+
+class BlobStore:
+    """
+    SQLite table of small files
+
+    Tables:
+        blobs(name, size, mtime, data): stored name (fileId_fileName),
+        size in bytes, time stored and content
+
+    Every native thread uses its own SQLite connection
+    """
+
+    def __init__(self, db_path: str, synchronous: str = "NORMAL"):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.synchronous = synchronous
+        self._connections = _threading.local()
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "name TEXT PRIMARY KEY, size INTEGER, mtime REAL, data BLOB)"
+        )
+        self.db.commit()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # The calling thread's connection
+        db = getattr(self._connections, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._connections.db = db
+        return db
+
+    def put(self, name: str, data: bytes):
+        self.db.execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+            (name, len(data), time.time(), data),
+        )
+        self.db.commit()
+
+    def get(self, name: str):
+        """
+        Get a stored file
+
+        Returns:
+            tuple: (data, mtime), or None if the file is not stored
+        """
+        row = self.db.execute(
+            "SELECT data, mtime FROM blobs WHERE name = ?", (name,)
+        ).fetchone()
+        return (bytes(row[0]), row[1]) if row else None
+
+    def get_size(self, name: str):
+        row = self.db.execute(
+            "SELECT size FROM blobs WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def stats(self) -> dict:
+        files, size = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        return {"files": files, "bytes": size}
+
+
+_store = None
+
+
+def get_blob_store() -> BlobStore:
+    global _store
+    if _store is None:
+        _store = BlobStore(
+            current_app.config["BLOB_STORE_PATH"],
+            SYNCHRONOUS[get_durability_mode()],
+        )
+    return _store
+
+
+def store_small_file(path: str) -> bool:
+    """
+    Move a completed file into the blob store if it is small enough
+
+    Returns:
+        bool: Whether the file was moved
+    """
+    threshold = current_app.config["SMALL_FILE_THRESHOLD"]
+    if not threshold or os.path.getsize(path) > threshold:
+        return False
+
+    with open(path, "rb") as f:
+        get_blob_store().put(os.path.basename(path), f.read())
+    os.remove(path)
+    return True
+
+
+def find_blob(name: str):
+    """
+    Get the size of a file held by the blob store
+
+    Returns:
+        int: File size, or None if the tier is disabled or lacks the file
+    """
+    if not current_app.config["SMALL_FILE_THRESHOLD"]:
+        return None
+    return get_blob_store().get_size(name)
@@ -1,3 +1,4 @@
 # File size limits
 MAX_FILE_SIZE = 50 * 1024 * 1024 * 1024     # 50 GB
 MAX_CHUNK_SIZE = 5 * 1024 * 1024            # 5 MB per chunk
+MAX_THUMBNAIL_SIZE = 64 * 1024              # 64 KB data URL per thumbnail
@@ -0,0 +1,186 @@
+"""
+Content index of completed files, keyed by fingerprint
+Lets an upload of content the server already holds complete instantly
+
+Fingerprints:
+- sha256: SHA-256 of the whole file
+- sampleHash: SHA-256 of the file size (8 bytes, big endian) followed by
+  the first, middle and last SAMPLE_SIZE bytes (the whole file when it is
+  smaller than three samples). Cheap to compute client side; a sample
+  match must be confirmed with the full hash
+
+A full hash alone proves nothing (hashes get shared), so it is answered
+with a challenge: the SHA-256 of a random nonce (hex string, UTF-8)
+followed by a random byte range of the file. Only a client holding the
+content can send it back as ``proof``. Every full hash gets a challenge,
+known or not, so challenges do not reveal which files the server holds
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from flask import current_app
+from .storage import open_stored_file, stored_file_size
+
+SAMPLE_SIZE = 64 * 1024
+
+# Loaded lazily from the append-only index file
+_by_sha256 = {}
+_by_sample = {}
+_loaded = False
+
+# Challenge ID -> challenge, single use
+_challenges = {}
+
+
+def compute_sample_hash(path: str, size: int) -> str:
+    digest = hashlib.sha256(size.to_bytes(8, "big"))
+    with open(path, "rb") as f:
+        if size <= 3 * SAMPLE_SIZE:
+            digest.update(f.read())
+        else:
+            for offset in (0, size // 2 - SAMPLE_SIZE // 2, size - SAMPLE_SIZE):
+                f.seek(offset)
+                digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def _index_path() -> str:
+    return current_app.config["CONTENT_INDEX_PATH"]
+
+
+def _add(entry: dict):
+    _by_sha256[entry["sha256"]] = entry
+    _by_sample.setdefault((entry["sampleHash"], entry["fileSize"]), set()).add(
+        entry["sha256"]
+    )
+
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded:
+        return
+
+    path = _index_path()
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    _add(json.loads(line))
+                except (ValueError, KeyError):
+                    # Torn last line after a crash
+                    continue
+    _loaded = True
+
+
+def record_content(metadata: dict, final_path: str):
+    """
+    Add a completed file to the index
+
+    Args:
+        metadata: Completed session metadata including ``sha256``
+        final_path: Path of the completed file
+    """
+    _ensure_loaded()
+
+    entry = {
+        "sha256": metadata["sha256"],
+        "sampleHash": compute_sample_hash(final_path, metadata["fileSize"]),
+        "fileSize": metadata["fileSize"],
+        "fileId": metadata["fileId"],
+        "fileName": metadata["fileName"],
+        "fileType": metadata.get("fileType", ""),
+        "path": final_path,
+    }
+    _add(entry)
+
+    with open(_index_path(), "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def find_content(fingerprint: dict, file_size: int):
+    """
+    Look up content the server already holds
+
+    Args:
+        fingerprint: ``{"sha256": ...}`` and/or ``{"sampleHash": ...}``
+        file_size: Size of the file being sent
+
+    Returns:
+        tuple: ("match", entry) when the full hash matches a file still
+        stored and comes with a valid ``proof``, ("challenge", challenge)
+        when a full hash comes without one, ("sample", None) when only the
+        sample hash matches and the client should confirm with the full
+        hash, else (None, None)
+    """
+    _ensure_loaded()
+
+    sha256 = fingerprint.get("sha256")
+    if sha256:
+        sha256 = sha256.lower()
+        proof = fingerprint.get("proof")
+        if not isinstance(proof, dict):
+            return "challenge", issue_challenge(sha256, file_size)
+
+        challenge = _challenges.pop(proof.get("challengeId"), None)
+        entry = _by_sha256.get(sha256)
+        if (
+            challenge
+            and challenge["expiresAt"] > time.time()
+            and challenge["sha256"] == sha256
+            and challenge["fileSize"] == file_size
+            and entry
+            and entry["fileSize"] == file_size
+            and stored_file_size(os.path.basename(entry["path"])) is not None
+            and _check_proof(challenge, entry, proof.get("hash"))
+        ):
+            return "match", entry
+        return None, None
+
+    sample_hash = fingerprint.get("sampleHash")
+    if sample_hash and _by_sample.get((sample_hash.lower(), file_size)):
+        return "sample", None
+
+    return None, None
+
+
+def issue_challenge(sha256: str, file_size: int) -> dict:
+    """
+    Challenge a client to prove it holds the content of a full hash
+
+    Returns:
+        dict: ``{"challengeId", "nonce", "offset", "length"}``
+    """
+    now = time.time()
+    for challenge_id, challenge in list(_challenges.items()):
+        if challenge["expiresAt"] <= now:
+            del _challenges[challenge_id]
+
+    length = min(current_app.config["INSTANT_CHALLENGE_SIZE"], file_size)
+    challenge = {
+        "challengeId": secrets.token_hex(16),
+        "nonce": secrets.token_hex(16),
+        "offset": secrets.randbelow(file_size - length + 1),
+        "length": length,
+    }
+    _challenges[challenge["challengeId"]] = {
+        **challenge,
+        "sha256": sha256,
+        "fileSize": file_size,
+        "expiresAt": now + current_app.config["INSTANT_CHALLENGE_TTL"],
+    }
+    return challenge
+
+
+def _check_proof(challenge: dict, entry: dict, proof_hash) -> bool:
+    if not isinstance(proof_hash, str):
+        return False
+
+    with open_stored_file(os.path.basename(entry["path"])) as f:
+        f.seek(challenge["offset"])
+        data = f.read(challenge["length"])
+    expected = hashlib.sha256(challenge["nonce"].encode("utf-8") + data)
+    return hmac.compare_digest(expected.hexdigest(), proof_hash.lower())
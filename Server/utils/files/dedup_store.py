@@ -0,0 +1,381 @@
+"""
+Chunk-level dedup storage engine
+
+Completed files are split with content-defined chunking (FastCDC, gear
+hash with normalized chunking), so an insertion only changes the chunks
+around it. Unique chunks are appended to pack files and indexed by their
+SHA-256 in SQLite; each file is stored as a recipe (ordered chunk hashes)
+and rebuilt as a stream on download
+"""
+
+import bisect
+import hashlib
+import io
+import os
+import sqlite3
+from eventlet import patcher
+from flask import current_app
+from .durability import sync_written_file
+
+# 256 pseudo-random 64-bit values, deterministic so cut points are stable
+GEAR = [
+    int.from_bytes(hashlib.sha256(b"gear" + bytes([i])).digest()[:8], "big")
+    for i in range(256)
+]
+HASH_MASK = (1 << 64) - 1
+HASH_SIZE = 32
+
+# Ingests run on native threads, readers on the event loop
+_threading = patcher.original("threading")
+
+
+def _mask(bits: int) -> int:
+    # Spread ``bits`` one-bits over the high half of the hash
+    mask = 0
+    for i in range(bits):
+        mask |= 1 << (63 - i * 2)
+    return mask
+
+
+def cdc_boundaries(data, min_size: int, avg_size: int, max_size: int):
+    """
+    Yield (start, end) chunk boundaries of ``data`` using FastCDC
+
+    A stricter mask is used before the average size and a looser one after
+    it, which narrows the chunk size distribution around ``avg_size``
+    """
+    bits = avg_size.bit_length() - 1
+    mask_s = _mask(bits + 2)
+    mask_l = _mask(bits - 2)
+    length = len(data)
+
+    start = 0
+    while start < length:
+        end = min(length, start + max_size)
+        if end - start <= min_size:
+            yield start, end
+            return
+
+        normal = min(end, start + avg_size)
+        h = 0
+        i = start + min_size
+        cut = end
+        while i < normal:
+            h = ((h << 1) + GEAR[data[i]]) & HASH_MASK
+            if not h & mask_s:
+                cut = i + 1
+                break
+            i += 1
+        else:
+            while i < end:
+                h = ((h << 1) + GEAR[data[i]]) & HASH_MASK
+                if not h & mask_l:
+                    cut = i + 1
+                    break
+                i += 1
+
+        yield start, cut
+        start = cut
+
+
+class DedupStore:
+    """
+    Pack file chunk store with a SQLite index
+
+    Tables:
+        chunks(hash, pack, offset, length): where each unique chunk lives
+        files(name, size, chunks): recipe of concatenated chunk hashes
+
+    Every native thread uses its own SQLite connection, so an ingest's open
+    transaction is never seen or committed by another thread. Ingests are
+    serialized: they append to the same pack file
+    """
+
+    def __init__(self, folder: str, pack_size: int, min_size, avg_size, max_size):
+        self.folder = folder
+        self.pack_size = pack_size
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+
+        os.makedirs(folder, exist_ok=True)
+        self.db_path = os.path.join(folder, "index.db")
+        self._connections = _threading.local()
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "hash BLOB PRIMARY KEY, pack INTEGER, offset INTEGER, length INTEGER)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "name TEXT PRIMARY KEY, size INTEGER, chunks BLOB)"
+        )
+        self.db.commit()
+
+        row = self.db.execute("SELECT MAX(pack) FROM chunks").fetchone()
+        self.pack_id = row[0] or 0
+        self._ingest_lock = _threading.Lock()
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        # The calling thread's connection
+        db = getattr(self._connections, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._connections.db = db
+        return db
+
+    def _pack_path(self, pack_id: int) -> str:
+        return os.path.join(self.folder, f"pack-{pack_id:06d}.pack")
+
+    def ingest(self, name: str, path: str) -> dict:
+        """
+        Split a file into chunks and store the unique ones
+
+        Args:
+            name: Stored name of the file (fileId_fileName)
+            path: Path of the file to ingest
+
+        Returns:
+            dict: ``{"size", "chunks", "newChunks", "newBytes"}``
+        """
+        with self._ingest_lock:
+            return self._ingest(name, path)
+
+    def _ingest(self, name: str, path: str) -> dict:
+        pack_path = self._pack_path(self.pack_id)
+        if os.path.exists(pack_path) and os.path.getsize(pack_path) >= self.pack_size:
+            self.pack_id += 1
+            pack_path = self._pack_path(self.pack_id)
+
+        recipe = []
+        size = new_chunks = new_bytes = 0
+        seen = set()
+
+        with open(path, "rb") as f, open(pack_path, "ab") as pack:
+            offset = pack.tell()
+            carry = b""
+            while True:
+                block = f.read(8 * 1024 * 1024)
+                data = carry + block
+                if not data:
+                    break
+
+                boundaries = list(
+                    cdc_boundaries(data, self.min_size, self.avg_size, self.max_size)
+                )
+                # Keep the open-ended last chunk for the next read
+                if block:
+                    boundaries, (tail_start, _) = boundaries[:-1], boundaries[-1]
+                    carry = data[tail_start:]
+
+                for start, end in boundaries:
+                    chunk = data[start:end]
+                    digest = hashlib.sha256(chunk).digest()
+                    recipe.append(digest)
+                    size += len(chunk)
+
+                    if (
+                        digest in seen
+                        or self.db.execute(
+                            "SELECT 1 FROM chunks WHERE hash = ?", (digest,)
+                        ).fetchone()
+                    ):
+                        continue
+
+                    pack.write(chunk)
+                    self.db.execute(
+                        "INSERT INTO chunks VALUES (?, ?, ?, ?)",
+                        (digest, self.pack_id, offset, len(chunk)),
+                    )
+                    seen.add(digest)
+                    offset += len(chunk)
+                    new_chunks += 1
+                    new_bytes += len(chunk)
+
+                if not block:
+                    break
+
+        sync_written_file(pack_path, new_bytes)
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+            (name, size, b"".join(recipe)),
+        )
+        self.db.commit()
+
+        return {
+            "size": size,
+            "chunks": len(recipe),
+            "newChunks": new_chunks,
+            "newBytes": new_bytes,
+        }
+
+    def get_size(self, name: str):
+        row = self.db.execute(
+            "SELECT size FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def iter_file(self, name: str):
+        """
+        Yield the contents of a stored file chunk by chunk
+        """
+        row = self.db.execute(
+            "SELECT chunks FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        if not row:
+            raise FileNotFoundError(name)
+
+        recipe = row[0]
+        packs = {}
+        try:
+            for i in range(0, len(recipe), HASH_SIZE):
+                pack_id, offset, length = self.db.execute(
+                    "SELECT pack, offset, length FROM chunks WHERE hash = ?",
+                    (recipe[i : i + HASH_SIZE],),
+                ).fetchone()
+
+                if pack_id not in packs:
+                    packs[pack_id] = open(self._pack_path(pack_id), "rb")
+                pack = packs[pack_id]
+                pack.seek(offset)
+                yield pack.read(length)
+        finally:
+            for pack in packs.values():
+                pack.close()
+
+    def open_file(self, name: str):
+        """
+        Open a stored file for random access (e.g. reading an archive's
+        central directory) without rebuilding it
+
+        Returns:
+            io.BufferedReader: Seekable read-only file object
+        """
+        row = self.db.execute(
+            "SELECT chunks FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        if not row:
+            raise FileNotFoundError(name)
+
+        recipe = row[0]
+        locations = [
+            self.db.execute(
+                "SELECT pack, offset, length FROM chunks WHERE hash = ?",
+                (recipe[i : i + HASH_SIZE],),
+            ).fetchone()
+            for i in range(0, len(recipe), HASH_SIZE)
+        ]
+        return io.BufferedReader(_RecipeReader(self, locations), 1024 * 1024)
+
+    def stats(self) -> dict:
+        logical, files = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0), COUNT(*) FROM files"
+        ).fetchone()
+        stored, chunks = self.db.execute(
+            "SELECT COALESCE(SUM(length), 0), COUNT(*) FROM chunks"
+        ).fetchone()
+        return {
+            "files": files,
+            "chunks": chunks,
+            "logicalBytes": logical,
+            "storedBytes": stored,
+            "dedupRatio": round(logical / stored, 3) if stored else 1.0,
+        }
+
+
+class _RecipeReader(io.RawIOBase):
+    """
+    Raw seekable reader over the chunks of a file recipe
+    """
+
+    def __init__(self, store: DedupStore, locations: list):
+        self._store = store
+        self._locations = locations
+        # Logical start offset of every chunk
+        self._starts = []
+        size = 0
+        for _, _, length in locations:
+            self._starts.append(size)
+            size += length
+        self._size = size
+        self._pos = 0
+        self._packs = {}
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._pos = offset
+        return offset
+
+    def readinto(self, buffer):
+        if self._pos >= self._size:
+            return 0
+
+        index = bisect.bisect_right(self._starts, self._pos) - 1
+        pack_id, offset, length = self._locations[index]
+        skip = self._pos - self._starts[index]
+        size = min(len(buffer), length - skip)
+
+        if pack_id not in self._packs:
+            self._packs[pack_id] = open(self._store._pack_path(pack_id), "rb")
+        pack = self._packs[pack_id]
+        pack.seek(offset + skip)
+        data = pack.read(size)
+
+        buffer[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def close(self):
+        for pack in self._packs.values():
+            pack.close()
+        self._packs.clear()
+        super().close()
+
+
+_store = None
+
+
+def get_dedup_store() -> DedupStore:
+    global _store
+    if _store is None:
+        config = current_app.config
+        _store = DedupStore(
+            config["DEDUP_FOLDER"],
+            config["DEDUP_PACK_SIZE"],
+            config["DEDUP_MIN_CHUNK"],
+            config["DEDUP_AVG_CHUNK"],
+            config["DEDUP_MAX_CHUNK"],
+        )
+    return _store
+
+
+def uses_dedup(category: str) -> bool:
+    # Categories (keys of ALLOWED_EXTENSIONS) stored in the dedup engine
+    return category in current_app.config["DEDUP_CATEGORIES"]
+
+
+def find_deduped(name: str):
+    """
+    Get the size of a file held by the dedup engine
+
+    Returns:
+        int: File size, or None if the engine is disabled or lacks the file
+    """
+    if not current_app.config["DEDUP_CATEGORIES"]:
+        return None
+    return get_dedup_store().get_size(name)
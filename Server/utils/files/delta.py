@@ -0,0 +1,170 @@
+"""
+rsync-style delta transfer
+
+Signature of a base file: for each block of ``blockSize`` bytes (the last
+one may be shorter) a pair ``[weak, strong]`` where ``weak`` is the
+Adler-32 checksum (rollable client side) and ``strong`` the first 32 hex
+digits of the block's SHA-256
+
+Delta stream (uploaded through the regular chunk endpoints) is a sequence
+of records:
+- COPY:    0x01, uint64 first block index, uint32 block count (big endian)
+- LITERAL: 0x02, uint32 length (big endian), followed by ``length`` bytes
+"""
+
+import hashlib
+import json
+import os
+import struct
+import zlib
+from eventlet import tpool
+from flask import current_app
+from .storage import open_stored_file, stored_file_size
+
+OP_COPY = 0x01
+OP_LITERAL = 0x02
+
+MIN_BLOCK_SIZE = 1024
+MAX_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def compute_signature(f, block_size: int) -> list:
+    blocks = []
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        blocks.append([zlib.adler32(block), hashlib.sha256(block).hexdigest()[:32]])
+    return blocks
+
+
+def get_signature(name: str, block_size: int) -> dict:
+    """
+    Get the block signature of a completed file, computed once per
+    (file, block size) and cached on disk
+
+    Reading the whole file (or a large cached signature) runs on a tpool
+    thread so it does not stall the event loop
+
+    Args:
+        name: Stored name of the base file, in whichever tier holds it
+        block_size: Block size in bytes
+
+    Returns:
+        dict: ``{"fileSize", "blockSize", "blocks"}``
+
+    Raises:
+        FileNotFoundError: If no tier holds the file
+    """
+    signature_dir = current_app.config["SIGNATURE_FOLDER"]
+    file_size = stored_file_size(name)
+    if file_size is None:
+        raise FileNotFoundError(name)
+
+    cache_path = os.path.join(signature_dir, f"{name}.{block_size}.json")
+    with open_stored_file(name) as f:
+        return tpool.execute(_load_signature, f, file_size, block_size, cache_path)
+
+
+def _load_signature(f, file_size: int, block_size: int, cache_path: str) -> dict:
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as cached:
+            signature = json.load(cached)
+        if signature["fileSize"] == file_size:
+            return signature
+
+    signature = {
+        "fileSize": file_size,
+        "blockSize": block_size,
+        "blocks": compute_signature(f, block_size),
+    }
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as out:
+        json.dump(signature, out)
+    os.replace(tmp_path, cache_path)
+
+    return signature
+
+
+class _StreamReader:
+    """
+    Reads exact byte counts across the boundaries of an iterator of chunks
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+        self._offset = 0
+
+    def read(self, size: int) -> bytes:
+        parts = []
+        while size > 0:
+            if self._offset >= len(self._buffer):
+                self._buffer = next(self._chunks, b"")
+                self._offset = 0
+                if not self._buffer:
+                    break
+
+            part = self._buffer[self._offset : self._offset + size]
+            self._offset += len(part)
+            size -= len(part)
+            parts.append(part)
+
+        return b"".join(parts)
+
+
+def apply_delta(base, base_size: int, block_size: int, delta_chunks, write):
+    """
+    Rebuild a file from a base file and a delta stream
+
+    Args:
+        base: Seekable binary file object of the base file
+        base_size: Size of the base file
+        block_size: Block size the delta was computed with
+        delta_chunks: Iterator over the delta stream bytes
+        write: Callable receiving the rebuilt file's bytes in order
+
+    Raises:
+        ValueError: If the delta stream is malformed
+    """
+    reader = _StreamReader(delta_chunks)
+
+    while True:
+        op = reader.read(1)
+        if not op:
+            break
+
+        if op[0] == OP_COPY:
+            header = reader.read(12)
+            if len(header) != 12:
+                raise ValueError("Truncated COPY record")
+            first, count = struct.unpack(">QI", header)
+
+            offset = first * block_size
+            if offset + (count - 1) * block_size >= base_size:
+                raise ValueError("COPY record outside the base file")
+
+            base.seek(offset)
+            remaining = count * block_size
+            while remaining > 0:
+                data = base.read(min(remaining, 1024 * 1024))
+                if not data:
+                    break
+                write(data)
+                remaining -= len(data)
+
+        elif op[0] == OP_LITERAL:
+            header = reader.read(4)
+            if len(header) != 4:
+                raise ValueError("Truncated LITERAL record")
+            (length,) = struct.unpack(">I", header)
+
+            data = reader.read(length)
+            if len(data) != length:
+                raise ValueError("Truncated LITERAL data")
+            write(data)
+
+        else:
+            raise ValueError(f"Unknown delta opcode: {op[0]}")
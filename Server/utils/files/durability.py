@@ -0,0 +1,193 @@
+"""
+Durability policy for upload writes
+
+none:    rely on the OS page cache, never fsync
+batched: group fsync across all sessions every N bytes or T ms
+strict:  fsync each chunk and the metadata before the chunk is acked
+"""
+
+import os
+import time
+from eventlet import patcher
+from flask import current_app
+
+DURABILITY_MODES = ("none", "batched", "strict")
+
+# Group fsyncs run on a native thread, off the event loop
+_threading = patcher.original("threading")
+
+
+def get_durability_mode() -> str:
+    mode = current_app.config.get("DURABILITY_MODE", "none")
+    if mode not in DURABILITY_MODES:
+        raise ValueError(f"Unknown DURABILITY_MODE: {mode}")
+    return mode
+
+
+def fsync_path(path: str):
+    # Windows needs a writable handle to flush a file
+    fd = os.open(path, os.O_RDWR if os.name == "nt" else os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(path: str):
+    # Directories cannot be opened (nor need syncing) on Windows
+    if os.name == "nt":
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FsyncBatcher:
+    """
+    Collects written paths and fsyncs them as one group once ``max_bytes``
+    were written or ``interval`` seconds passed since the first pending write
+
+    Writers only record the path; the group fsync runs on a native flusher
+    thread, so a write that crosses the byte threshold never blocks the
+    event loop
+    """
+
+    def __init__(self, max_bytes: int, interval: float):
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.flushes = 0
+
+        self._pending = set()
+        self._pending_bytes = 0
+        self._first_at = None
+        self._lock = _threading.Lock()
+        self._wake = _threading.Condition(self._lock)
+        self._thread = None
+
+    def add(self, path: str, nbytes: int):
+        with self._lock:
+            self._pending.add(path)
+            self._pending_bytes += nbytes
+            if self._first_at is None:
+                # Start the interval
+                self._first_at = time.monotonic()
+                self._wake.notify()
+            elif self._pending_bytes >= self.max_bytes:
+                self._wake.notify()
+
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = _threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def flush(self):
+        """
+        Fsync everything pending now, on the calling thread
+        """
+        with self._lock:
+            paths = self._take()
+        self._sync(paths)
+
+    def _take(self) -> set:
+        # Caller holds the lock
+        paths = self._pending
+        self._pending = set()
+        self._pending_bytes = 0
+        self._first_at = None
+        return paths
+
+    def _sync(self, paths: set):
+        if not paths:
+            return
+
+        for path in paths:
+            try:
+                fsync_path(path)
+            except FileNotFoundError:
+                # Chunk already merged and removed
+                pass
+
+        for directory in {os.path.dirname(path) for path in paths}:
+            try:
+                fsync_dir(directory)
+            except FileNotFoundError:
+                pass
+
+        self.flushes += 1
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._first_at is None:
+                        self._wake.wait()
+                        continue
+
+                    remaining = self.interval - (time.monotonic() - self._first_at)
+                    if self._pending_bytes >= self.max_bytes or remaining <= 0:
+                        break
+                    self._wake.wait(remaining)
+
+                paths = self._take()
+
+            self._sync(paths)
+
+
+_batcher = None
+
+
+def get_batcher() -> FsyncBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = FsyncBatcher(
+            current_app.config["DURABILITY_BATCH_BYTES"],
+            current_app.config["DURABILITY_BATCH_INTERVAL_MS"] / 1000,
+        )
+    return _batcher
+
+
+def sync_written_file(path: str, nbytes: int):
+    """
+    Apply the durability policy to a file that was just written
+    """
+    mode = get_durability_mode()
+    if mode == "strict":
+        fsync_path(path)
+    elif mode == "batched":
+        get_batcher().add(path, nbytes)
+
+
+def replace_durably(tmp_path: str, final_path: str):
+    """
+    Atomically move a fully written ``tmp_path`` over ``final_path``
+
+    strict syncs the data before the rename and the directory after it;
+    batched hands the renamed file to the group fsync
+    """
+    mode = get_durability_mode()
+    if mode == "strict":
+        fsync_path(tmp_path)
+
+    os.replace(tmp_path, final_path)
+
+    if mode == "strict":
+        fsync_dir(os.path.dirname(final_path))
+    elif mode == "batched":
+        get_batcher().add(final_path, os.path.getsize(final_path))
+
+
+def finalize_file(part_path: str, final_path: str):
+    """
+    Publish a merged upload: fsync, atomic rename, then directory fsync,
+    so a crash never leaves a truncated file under the final name
+    """
+    durable = get_durability_mode() != "none"
+    if durable:
+        fsync_path(part_path)
+
+    os.replace(part_path, final_path)
+
+    if durable:
+        fsync_dir(os.path.dirname(final_path))
@@ -1,4 +1,7 @@
 from .allowed_extensions import ALLOWED_EXTENSIONS
+from .constants import MAX_FILE_SIZE, MAX_THUMBNAIL_SIZE
+from .delta import MIN_BLOCK_SIZE, MAX_BLOCK_SIZE
+from .storage import stored_file_size
 
 
 def allowed_file(filename):
@@ -20,3 +23,93 @@ def allowed_file(filename):
     allowed_exts = {ext for category in ALLOWED_EXTENSIONS.values() for ext in category}
 
     return ext in allowed_exts
+
+
+def validate_init_payload(data):
+    """
+    Validate an upload session init payload
+
+    Args:
+        data (dict): Init payload sent by the client
+
+    Returns:
+        str: Error message, or None if the payload is valid
+
+    Raises:
+        ValueError: If numeric fields cannot be parsed
+    """
+    if not data:
+        return "No JSON data provided"
+
+    # Validate required fields
+    for field in ["fileId", "fileName", "fileSize", "totalChunks"]:
+        if field not in data:
+            return f"Missing required field: {field}"
+
+    # Validate optional fan-out targets
+    for field in ["recipients", "rooms"]:
+        if not isinstance(data.get(field) or [], list):
+            return f"{field} must be a list"
+
+    if not isinstance(data.get("fingerprint") or {}, dict):
+        return "fingerprint must be an object"
+
+    # Optional client-generated thumbnail (data URL) shown in room galleries
+    thumbnail = data.get("thumbnail")
+    if thumbnail is not None and (
+        not isinstance(thumbnail, str)
+        or not thumbnail.startswith("data:image/")
+        or len(thumbnail) > MAX_THUMBNAIL_SIZE
+    ):
+        return "Invalid thumbnail"
+
+    file_size = int(data["fileSize"])
+    int(data["totalChunks"])
+
+    # Validate delta upload against a base file the server holds
+    delta = data.get("delta")
+    if delta is not None:
+        error = validate_delta_spec(delta)
+        if error:
+            return error
+
+    # Validate file size
+    if file_size > MAX_FILE_SIZE:
+        return f"File too large. Maximum size is {MAX_FILE_SIZE // (1024*1024*1024)}GB"
+
+    # Validate file type
+    if not allowed_file(data["fileName"]):
+        return "File type not allowed"
+
+    return None
+
+
+def validate_delta_spec(delta):
+    """
+    Validate the ``delta`` part of an init payload
+
+    Args:
+        delta (dict): ``{"baseFile", "blockSize", "deltaSize", "sha256"}``
+
+    Returns:
+        str: Error message, or None if the spec is valid
+
+    Raises:
+        ValueError: If numeric fields cannot be parsed
+    """
+    if not isinstance(delta, dict):
+        return "delta must be an object"
+
+    for field in ["baseFile", "blockSize", "deltaSize"]:
+        if field not in delta:
+            return f"Missing required delta field: {field}"
+
+    block_size = int(delta["blockSize"])
+    int(delta["deltaSize"])
+    if not MIN_BLOCK_SIZE <= block_size <= MAX_BLOCK_SIZE:
+        return "Invalid delta block size"
+
+    if stored_file_size(delta["baseFile"]) is None:
+        return "Delta base file not found"
+
+    return None
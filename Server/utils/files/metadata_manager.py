@@ -1,22 +1,18 @@
 import json
 from datetime import datetime
 import os
-from flask import current_app
 from werkzeug.utils import secure_filename
 from .file_categories import get_file_category, get_icon_for_category
-from .paths import get_metadata_path
+from .paths import get_metadata_path, get_temp_dir
+from .durability import replace_durably
 
 
-def create_metadata(file_id, file_name, file_size, total_chunks, extra: dict):
-    # Create initial metadata structure
+def build_metadata(file_id, file_name, file_size, total_chunks, extra: dict):
+    # Build initial metadata structure
     safe_name = secure_filename(file_name)
     category = get_file_category(file_name)
 
-    # Create temporary directory for chunks
-    temp_dir = os.path.join(current_app.config["UPLOAD_FOLDER"], file_id)
-    os.makedirs(temp_dir, exist_ok=True)
-
-    metadata = {
+    return {
         "fileId": file_id,
         "fileName": safe_name,
         "originalName": file_name,
@@ -28,29 +24,135 @@ def create_metadata(file_id, file_name, file_size, total_chunks, extra: dict):
         "uploadedChunks": [],
         "roomId": extra.get("roomId"),
         "partnerSid": extra.get("partnerSid"),
+        "chunkSize": extra.get("chunkSize"),
+        "recipients": extra.get("recipients") or [],
+        "rooms": extra.get("rooms") or [],
+        "delta": extra.get("delta"),
+        "thumbnail": extra.get("thumbnail"),
         "createdAt": datetime.now().isoformat(),
     }
 
-    with open(get_metadata_path(file_id), "w", encoding="utf-8") as f:
-        json.dump(metadata, f, ensure_ascii=False, indent=2)
+
+def create_metadata(file_id, file_name, file_size, total_chunks, extra: dict):
+    # Create temporary directory for chunks
+    os.makedirs(get_temp_dir(file_id), exist_ok=True)
+
+    metadata = build_metadata(file_id, file_name, file_size, total_chunks, extra)
+    save_metadata(file_id, metadata)
+    rehydrated_sessions.add(file_id)
 
     return metadata
 
 
 def load_metadata(file_id: str) -> dict:
-    # Load metadata from disk
+    # Load metadata from disk, reconciling sessions left by a previous run
+    if file_id not in rehydrated_sessions:
+        return reconcile_session(file_id)
+
+    return _read_metadata(file_id)
+
+
+def _read_metadata(file_id: str) -> dict:
     with open(get_metadata_path(file_id), "r", encoding="utf-8") as f:
         return json.load(f)
 
 
 def save_metadata(file_id: str, metadata: dict):
-    # Persist metadata to disk
-    with open(get_metadata_path(file_id), "w", encoding="utf-8") as f:
+    # Persist metadata to disk (write to a temp file, then atomic rename)
+    metadata_path = get_metadata_path(file_id)
+    tmp_path = metadata_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(metadata, f, ensure_ascii=False, indent=2)
 
+    replace_durably(tmp_path, metadata_path)
+
+
+def register_uploaded_chunk(metadata: dict, chunk_index: int, chunk_size=None):
+    # Remember the regular chunk size so recovery can validate chunk files
+    if (
+        chunk_size
+        and not metadata.get("chunkSize")
+        and chunk_index < metadata["totalChunks"] - 1
+    ):
+        metadata["chunkSize"] = chunk_size
 
-def register_uploaded_chunk(metadata: dict, chunk_index: int):
     # Register uploaded chunk index
     if chunk_index not in metadata["uploadedChunks"]:
         metadata["uploadedChunks"].append(chunk_index)
         metadata["lastUpdate"] = datetime.now().isoformat()
+
+
+# Sessions whose metadata was created or reconciled by this process
+rehydrated_sessions = set()
+
+
+def expected_chunk_size(metadata: dict, chunk_index: int):
+    # Expected byte size of a chunk, or None if the chunk size is unknown
+    chunk_size = metadata.get("chunkSize")
+    total_chunks = metadata["totalChunks"]
+
+    # Delta sessions upload the delta stream, not the file itself
+    delta = metadata.get("delta")
+    upload_size = int(delta["deltaSize"]) if delta else metadata["fileSize"]
+
+    if chunk_index == total_chunks - 1:
+        if total_chunks == 1:
+            return upload_size
+        if chunk_size:
+            return upload_size - chunk_size * (total_chunks - 1)
+        return None
+
+    return chunk_size
+
+
+def reconcile_session(file_id: str) -> dict:
+    """
+    Rehydrate an upload session left on disk by a previous run
+
+    ``uploadedChunks`` is rebuilt from the chunk files actually present
+    with the expected size, so chunks the metadata claims but that never
+    reached disk are uploaded again, and truncated chunks are discarded
+
+    Args:
+        file_id: Unique file identifier
+
+    Returns:
+        dict: The reconciled metadata
+    """
+    metadata = _read_metadata(file_id)
+    temp_dir = get_temp_dir(file_id)
+    total_chunks = metadata["totalChunks"]
+
+    verified = []
+    for entry in os.scandir(temp_dir):
+        if entry.name == "metadata.json.tmp":
+            # Interrupted metadata write, the renamed file is authoritative
+            os.remove(entry.path)
+            continue
+
+        if not entry.name.startswith("chunk_"):
+            continue
+
+        try:
+            chunk_index = int(entry.name[len("chunk_") :])
+        except ValueError:
+            continue
+
+        size = entry.stat().st_size
+        expected = expected_chunk_size(metadata, chunk_index)
+        if chunk_index < total_chunks and size > 0 and expected in (None, size):
+            verified.append(chunk_index)
+        else:
+            os.remove(entry.path)
+
+    verified.sort()
+    if verified != sorted(metadata["uploadedChunks"]):
+        print(
+            f"Recovered session {file_id}: {len(verified)}/{total_chunks} chunks on disk "
+            f"(metadata claimed {len(metadata['uploadedChunks'])})"
+        )
+        metadata["uploadedChunks"] = verified
+        save_metadata(file_id, metadata)
+
+    rehydrated_sessions.add(file_id)
+    return metadata
@@ -1,9 +1,45 @@
+"""
+Path resolution for temp sessions and completed files
+
+Entries are fanned out over two levels of hashed directories
+(``ab/cd/<name>``, from the SHA-256 of the name) so no directory grows
+with the number of files. Entries still in the legacy flat layout are
+found there until ``tools.migrate_layout`` moves them
+"""
+
+import hashlib
 import os
 from flask import current_app
 
 
+def get_shard_dir(folder: str, name: str) -> str:
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+    return os.path.join(folder, digest[:2], digest[2:4])
+
+
+def get_sharded_path(folder: str, name: str) -> str:
+    return os.path.join(get_shard_dir(folder, name), name)
+
+
+def is_shard_dir(name: str) -> bool:
+    return len(name) == 2 and all(c in "0123456789abcdef" for c in name)
+
+
+def _resolve(folder: str, name: str) -> str:
+    sharded = get_sharded_path(folder, name)
+    if os.path.exists(sharded):
+        return sharded
+
+    legacy = os.path.join(folder, name)
+    if os.path.exists(legacy):
+        return legacy
+
+    # New entry, or moved by a running migration between the two checks
+    return sharded
+
+
 def get_temp_dir(file_id: str) -> str:
-    return os.path.join(current_app.config["UPLOAD_FOLDER"], file_id)
+    return _resolve(current_app.config["UPLOAD_FOLDER"], file_id)
 
 
 def get_metadata_path(file_id: str) -> str:
@@ -15,4 +51,32 @@ def get_chunk_path(file_id: str, index: int) -> str:
 
 
 def get_final_path(file_id: str, filename: str) -> str:
-    return os.path.join(current_app.config["COMPLETED_FOLDER"], f"{file_id}_{filename}")
+    return _resolve(current_app.config["COMPLETED_FOLDER"], f"{file_id}_{filename}")
+
+
+def get_completed_path(filename: str) -> str:
+    # Path of a completed file from its stored name (fileId_fileName)
+    if os.path.basename(filename) != filename:
+        raise ValueError("Invalid file name")
+    return _resolve(current_app.config["COMPLETED_FOLDER"], filename)
+
+
+def iter_temp_sessions(upload_folder: str):
+    """
+    Yield ``(file_id, path)`` of every temp session directory, in the
+    sharded and the legacy flat layout
+    """
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+
+            if not is_shard_dir(entry.name):
+                yield entry.name, entry.path
+                continue
+
+            for second in os.scandir(entry.path):
+                if second.is_dir():
+                    for session in os.scandir(second.path):
+                        if session.is_dir():
+                            yield session.name, session.path
@@ -0,0 +1,79 @@
+"""
+Storage tiers of completed files
+
+A completed file lives in exactly one tier: as a plain file in
+COMPLETED_FOLDER, as a BLOB in the small file store, or as a recipe in the
+chunk-level dedup engine
+"""
+
+import io
+import os
+import unicodedata
+from urllib.parse import quote
+from werkzeug.http import dump_options_header
+from .blob_store import find_blob, get_blob_store
+from .dedup_store import find_deduped, get_dedup_store
+from .paths import get_completed_path
+
+
+def stored_file_size(name: str):
+    """
+    Get the size of a completed file from whichever tier holds it
+
+    Args:
+        name: Stored name of the file (fileId_fileName)
+
+    Returns:
+        int: File size, or None if no tier holds the file
+    """
+    try:
+        return os.path.getsize(get_completed_path(name))
+    except FileNotFoundError:
+        pass
+
+    size = find_blob(name)
+    if size is None:
+        size = find_deduped(name)
+    return size
+
+
+def open_stored_file(name: str):
+    """
+    Open a completed file for random access from whichever tier holds it
+
+    Raises:
+        FileNotFoundError: If no tier holds the file
+    """
+    try:
+        return open(get_completed_path(name), "rb")
+    except FileNotFoundError:
+        pass
+
+    if find_blob(name) is not None:
+        data, _ = get_blob_store().get(name)
+        return io.BytesIO(data)
+
+    if find_deduped(name) is not None:
+        return get_dedup_store().open_file(name)
+
+    raise FileNotFoundError(name)
+
+
+def attachment_header(name: str) -> str:
+    """
+    Build a Content-Disposition header that downloads ``name``
+
+    The name is quoted, so quotes or semicolons in it cannot break the
+    header; non-ASCII names get an ASCII fallback plus an RFC 5987
+    ``filename*`` (as ``send_file`` does)
+    """
+    try:
+        name.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", name)
+        simple = simple.encode("ascii", "ignore").decode("ascii")
+        quoted = quote(name, safe="!#$&+-.^_`|~")
+        return dump_options_header(
+            "attachment", {"filename": simple, "filename*": f"UTF-8''{quoted}"}
+        )
+    return dump_options_header("attachment", {"filename": name})
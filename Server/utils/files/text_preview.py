@@ -0,0 +1,253 @@
+"""
+Text previews of completed code and document files
+
+A preview (first and last PREVIEW_BYTES, line count, detected encoding) is
+computed once per stored file from a memory-mapped read and cached on disk
+next to a sparse line index: the number of newlines before every
+LINE_INDEX_BLOCK bytes. A line range is then served by reading only the
+blocks that hold its first and last lines
+"""
+
+import bisect
+import codecs
+import json
+import mmap
+import os
+import tempfile
+from flask import current_app
+from .storage import open_stored_file
+from .paths import get_completed_path
+
+PREVIEW_CATEGORIES = {"code", "documents"}
+
+LINE_INDEX_BLOCK = 1024 * 1024
+SCAN_BLOCK = 16 * 1024 * 1024
+
+# Encodings whose newline is not the single byte 0x0A
+WIDE_ENCODINGS = {"utf-16", "utf-32"}
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+class NotTextError(ValueError):
+    """
+    Raised when a file does not look like text
+    """
+
+
+def detect_encoding(sample: bytes) -> str:
+    """
+    Detect the encoding of a text sample
+
+    Returns:
+        str: Codec name (BOM encodings, "utf-8", else "latin-1")
+
+    Raises:
+        NotTextError: If the sample contains NUL bytes without a UTF-16/32 BOM
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    if b"\x00" in sample:
+        raise NotTextError("Not a text file")
+
+    try:
+        # The sample may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def _decode_head(data: bytes, encoding: str) -> str:
+    # Drop an incomplete trailing character
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    return decoder.decode(data, final=False)
+
+
+def _decode_tail(data: bytes, encoding: str) -> str:
+    # Skip UTF-8 continuation bytes of a character cut at the start
+    if encoding.startswith("utf-8"):
+        start = 0
+        while start < min(len(data), 4) and 0x80 <= data[start] <= 0xBF:
+            start += 1
+        data = data[start:]
+    return data.decode(encoding, errors="replace")
+
+
+def _open_source(stored_name: str):
+    # Memory map plain files; other tiers give a seekable reader
+    path = get_completed_path(stored_name)
+    if not os.path.exists(path):
+        return open_stored_file(stored_name)
+
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return open(path, "rb")
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _cache_path(stored_name: str) -> str:
+    return os.path.join(current_app.config["PREVIEW_FOLDER"], f"{stored_name}.json")
+
+
+def _build_preview(source, size: int, preview_bytes: int) -> dict:
+    source.seek(0)
+    head = source.read(preview_bytes)
+    encoding = detect_encoding(head[:8192])
+
+    # Newlines before each LINE_INDEX_BLOCK offset
+    line_index = [0]
+    newlines = 0
+    source.seek(0)
+    while True:
+        data = source.read(SCAN_BLOCK)
+        if not data:
+            break
+        for start in range(0, len(data), LINE_INDEX_BLOCK):
+            newlines += data.count(b"\n", start, start + LINE_INDEX_BLOCK)
+            line_index.append(newlines)
+    # The entry past the end is only a running total
+    line_index.pop()
+
+    tail = b""
+    if size > preview_bytes:
+        source.seek(max(preview_bytes, size - preview_bytes))
+        tail = source.read(preview_bytes)
+
+    last_byte = b""
+    if size:
+        source.seek(size - 1)
+        last_byte = source.read(1)
+
+    line_count = newlines + (1 if size and last_byte != b"\n" else 0)
+    if encoding in WIDE_ENCODINGS:
+        line_count, line_index = None, []
+
+    return {
+        "encoding": encoding,
+        "fileSize": size,
+        # A last line without a trailing newline still counts
+        "lineCount": line_count,
+        "head": _decode_head(head, encoding),
+        "tail": _decode_tail(tail, encoding),
+        "truncated": size > preview_bytes * 2,
+        "lineIndex": line_index,
+    }
+
+
+def get_preview(stored_name: str) -> dict:
+    """
+    Get the cached preview of a completed text file, building it on first
+    use
+
+    Args:
+        stored_name: Stored name of the file (fileId_fileName)
+
+    Returns:
+        dict: ``{"encoding", "fileSize", "lineCount", "head", "tail",
+        "truncated", "lineIndex"}``
+
+    Raises:
+        FileNotFoundError: If the file does not exist
+        NotTextError: If the file is not text
+    """
+    cache_path = _cache_path(stored_name)
+    preview_bytes = current_app.config["PREVIEW_BYTES"]
+
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            preview = json.load(f)
+        if preview.get("previewBytes") == preview_bytes:
+            return preview
+
+    source = _open_source(stored_name)
+    try:
+        source.seek(0, os.SEEK_END)
+        size = source.tell()
+        preview = _build_preview(source, size, preview_bytes)
+    finally:
+        source.close()
+    preview["previewBytes"] = preview_bytes
+
+    # The preview job and a request may build the same preview at once
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(preview, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+    return preview
+
+
+def _offset_after_newlines(source, line_index: list, count: int, size: int) -> int:
+    # Offset right after the ``count``-th newline (EOF if there are fewer)
+    if count <= 0:
+        return 0
+
+    # Last block starting before that newline
+    block = bisect.bisect_left(line_index, count) - 1
+    offset = block * LINE_INDEX_BLOCK
+    remaining = count - line_index[block]
+
+    source.seek(offset)
+    data = source.read(LINE_INDEX_BLOCK)
+    position = -1
+    for _ in range(remaining):
+        position = data.find(b"\n", position + 1)
+        if position < 0:
+            return size
+
+    return offset + position + 1
+
+
+def read_lines(stored_name: str, first: int, last: int) -> dict:
+    """
+    Read a range of lines of a previewed file
+
+    Args:
+        stored_name: Stored name of the file (fileId_fileName)
+        first: First line (1-based)
+        last: Last line (inclusive)
+
+    Returns:
+        dict: ``{"firstLine", "lastLine", "text", "truncated"}``, text
+        capped at PREVIEW_MAX_RANGE_BYTES
+
+    Raises:
+        NotTextError: If the file is not text or not line addressable
+    """
+    preview = get_preview(stored_name)
+    if preview["lineCount"] is None:
+        raise NotTextError(f"Line ranges are not supported for {preview['encoding']}")
+    line_index = preview["lineIndex"]
+    size = preview["fileSize"]
+    max_bytes = current_app.config["PREVIEW_MAX_RANGE_BYTES"]
+
+    source = _open_source(stored_name)
+    try:
+        start = _offset_after_newlines(source, line_index, first - 1, size)
+        end = _offset_after_newlines(source, line_index, last, size)
+
+        source.seek(start)
+        data = source.read(min(end - start, max_bytes))
+    finally:
+        source.close()
+
+    return {
+        "firstLine": first,
+        "lastLine": min(last, preview["lineCount"]),
+        "text": _decode_head(data, preview["encoding"]),
+        "truncated": end - start > max_bytes,
+    }